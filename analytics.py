@@ -0,0 +1,412 @@
+"""
+Аналитика использования: журнал событий и агрегаты для /stats.
+
+- События: вопрос (намерение и сетап), найденные схемы сетапов,
+  ввод /calc, вызов LLM (задержка, токены). В журнал пишется одна короткая
+  JSON-строка на событие: DATA_DIR/analytics/events-000001.jsonl, ...
+- Текст вопросов не хранится — ни целиком, ни обрезанным, ни хэшем: в нём бывают
+  балансы, номера счетов и личные детали, а /stats считает только намерения
+  и сетапы. Хэш короткого текста легко подобрать, а дедупликации
+  формулировок отчёт не требует
+- record() только обновляет агрегаты в памяти и кладёт событие в буфер.
+  На диск буфер уходит пачкой из фоновой задачи через пул I/O — раз в
+  FLUSH_INTERVAL секунд или сразу, когда набралось FLUSH_BATCH событий
+- Агрегаты по часам, дням и сетапам обновляются на лету и сохраняются
+  в rollups.json при каждом сбросе вместе с позицией журнала, до которой
+  они посчитаны — /stats журнал не читает
+- Журнал режется на сегменты по SEGMENT_BYTES; старые сегменты сверх MAX_BYTES
+  удаляются — их вклад уже в агрегатах. Почасовые агрегаты хранятся
+  HOURLY_KEEP часов, дневные — DAILY_KEEP дней
+- load() при старте дочитывает журнал после сохранённой позиции: падение
+  между записью журнала и rollups.json не теряет и не удваивает события.
+  Нет rollups.json (первый запуск, порча файла) — агрегаты пересчитываются
+  по оставшемуся журналу
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_BYTES = 1024 * 1024
+MAX_BYTES = 16 * 1024 * 1024
+HOURLY_KEEP = 7 * 24
+DAILY_KEEP = 400
+FLUSH_INTERVAL = 10.0
+FLUSH_BATCH = 500
+MAX_BUFFER = 20_000          # диск недоступен — старые события из буфера теряются, агрегаты нет
+
+QUESTION, IMAGES, CALC, LLM_CALL = "q", "img", "calc", "llm"
+KIND_NAMES = {QUESTION: "вопросов", IMAGES: "показов схем", CALC: "расчётов", LLM_CALL: "вызовов LLM"}
+
+# Границы корзин гистограммы задержки LLM, мс; последняя корзина — всё, что дольше
+LATENCY_BOUNDS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+CALC_FIELDS = ("balance", "initial", "phase", "setup", "atr", "cf", "cycle_day")
+
+
+def _hour_key(ts: float) -> str:
+    return time.strftime("%Y-%m-%dT%H", time.gmtime(ts))
+
+
+def _day_key(ts: float) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(ts))
+
+
+def _bump(counter: dict, key, n=1) -> None:
+    counter[key] = counter.get(key, 0) + n
+
+
+def _empty_rollups() -> dict:
+    return {
+        "since": None,
+        "events": 0,
+        "hourly": {},      # "2026-10-19T14" -> {вид события: число, llm_ms, tokens}
+        "daily": {},       # "2026-10-19" -> то же
+        "setups": {},      # "3" -> {вид события: число}
+        "intents": {},
+        "calc": {"phase": {}, "atr": {}, "cf": {}},
+        "llm": {"calls": 0, "errors": 0, "ms": 0.0, "prompt_tokens": 0,
+                "completion_tokens": 0, "hist": [0] * (len(LATENCY_BOUNDS) + 1)},
+    }
+
+
+def _latency_percentile(hist: list, q: float):
+    """Оценка перцентиля по гистограмме: верхняя граница корзины."""
+    total = sum(hist)
+    if not total:
+        return None
+    rank = total * q / 100
+    seen = 0
+    for bound, count in zip(LATENCY_BOUNDS + (None,), hist):
+        seen += count
+        if seen >= rank:
+            return bound
+    return None
+
+
+class UsageAnalytics:
+    def __init__(self, directory: str, segment_bytes: int = SEGMENT_BYTES, max_bytes: int = MAX_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.rollups_path = os.path.join(directory, "rollups.json")
+        self._buffer: deque = deque(maxlen=MAX_BUFFER)
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._run_io = None
+        self._stopping = False
+        self.dropped = 0
+        self.flushes = 0
+        self.flush_ms = 0.0
+        self._segments: list = []                  # [[номер, размер], ...] по возрастанию
+        self.rollups = _empty_rollups()
+
+    # ─── ЗАПИСЬ СОБЫТИЙ ───
+
+    def question(self, intent: str, setup=None) -> None:
+        event = {"i": intent}
+        if setup is not None:
+            event["s"] = setup
+        self.record(QUESTION, event)
+
+    def images(self, setups: list) -> None:
+        if setups:
+            self.record(IMAGES, {"s": setups})
+
+    def calc(self, session: dict) -> None:
+        self.record(CALC, {"v": [session.get(f) for f in CALC_FIELDS]})
+
+    def llm(self, started: float, usage: dict = None, ok: bool = True) -> None:
+        """started — time.perf_counter() перед запросом; usage — поле usage ответа OpenRouter."""
+        usage = usage or {}
+        event = {"ms": round((time.perf_counter() - started) * 1000),
+                 "pt": usage.get("prompt_tokens", 0), "ct": usage.get("completion_tokens", 0)}
+        if not ok:
+            event["err"] = 1
+        self.record(LLM_CALL, event)
+
+    def record(self, kind: str, fields: dict, ts: float = None) -> None:
+        event = {"t": round(time.time() if ts is None else ts, 3), "e": kind, **fields}
+        self._apply(event)
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(event)
+        if len(self._buffer) >= FLUSH_BATCH:
+            self._wakeup.set()
+
+    def _apply(self, event: dict) -> None:
+        """Инкрементальное обновление агрегатов одним событием."""
+        r = self.rollups
+        ts, kind = event["t"], event["e"]
+        if r["since"] is None:
+            r["since"] = ts
+        r["events"] += 1
+        buckets = (r["hourly"].setdefault(_hour_key(ts), {}), r["daily"].setdefault(_day_key(ts), {}))
+        for bucket in buckets:
+            _bump(bucket, kind)
+
+        if kind == QUESTION:
+            _bump(r["intents"], event["i"])
+            setups = [event["s"]] if "s" in event else []
+        elif kind == IMAGES:
+            setups = event["s"]
+        elif kind == CALC:
+            inputs = dict(zip(CALC_FIELDS, event["v"]))
+            for field in ("phase", "atr", "cf"):
+                _bump(r["calc"][field], str(inputs[field]))
+            setups = [inputs["setup"]] if inputs["setup"] is not None else []
+        elif kind == LLM_CALL:
+            llm = r["llm"]
+            llm["calls"] += 1
+            llm["errors"] += event.get("err", 0)
+            llm["ms"] += event["ms"]
+            llm["prompt_tokens"] += event["pt"]
+            llm["completion_tokens"] += event["ct"]
+            slot = next((i for i, b in enumerate(LATENCY_BOUNDS) if event["ms"] <= b), len(LATENCY_BOUNDS))
+            llm["hist"][slot] += 1
+            for bucket in buckets:
+                _bump(bucket, "llm_ms", event["ms"])
+                _bump(bucket, "tokens", event["pt"] + event["ct"])
+            setups = []
+        else:
+            setups = []
+
+        for setup in setups:
+            _bump(r["setups"].setdefault(str(setup), {}), kind)
+
+    def _compact_rollups(self) -> None:
+        """Почасовые и дневные агрегаты — только за окно хранения."""
+        for key, keep in (("hourly", HOURLY_KEEP), ("daily", DAILY_KEEP)):
+            buckets = self.rollups[key]
+            if len(buckets) > keep:
+                for old in sorted(buckets)[:len(buckets) - keep]:
+                    del buckets[old]
+
+    # ─── СБРОС НА ДИСК ───
+
+    def start(self, run_io) -> None:
+        """run_io — корутина выноса в пул потоков (Offloader.run_io)."""
+        self._run_io = run_io
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновую задачу и сбрасывает остаток буфера."""
+        # Без cancel(): отмена посреди записи потеряла бы пачку, а wait_for
+        # в 3.11 может проглотить отмену, если событие пришло одновременно
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Аналитика: сброс не удался: {e}")
+
+    async def flush(self) -> int:
+        """Пишет накопленные события и снимок агрегатов. Возвращает число событий."""
+        async with self._flush_lock:
+            if not self._buffer:
+                return 0
+            batch = list(self._buffer)
+            self._buffer.clear()
+            self._compact_rollups()
+            # Снимок агрегатов — в event loop: record() меняет их между сбросами
+            snapshot = json.dumps(self.rollups, ensure_ascii=False)
+            started = time.perf_counter()
+            try:
+                if self._run_io is not None:
+                    await self._run_io(self._write, batch, snapshot)
+                else:
+                    self._write(batch, snapshot)
+            except Exception:
+                # Вернём пачку в начало буфера — уйдёт следующим сбросом
+                self._buffer.extendleft(reversed(batch))
+                raise
+            self.flushes += 1
+            self.flush_ms = (time.perf_counter() - started) * 1000
+            return len(batch)
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"events-{number:06d}.jsonl")
+
+    def _write(self, batch: list, snapshot: str) -> None:
+        """Выполняется в пуле I/O: дописывает журнал, ротирует сегменты, сохраняет агрегаты."""
+        lines = [(json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8") for e in batch]
+        while lines:
+            if not self._segments or self._segments[-1][1] >= self.segment_bytes:
+                self._segments.append([self._segments[-1][0] + 1 if self._segments else 1, 0])
+            segment = self._segments[-1]
+            # Набираем строки до заполнения сегмента; остаток пачки — в следующий
+            room, count = self.segment_bytes - segment[1], 0
+            while count < len(lines) and (room > 0 or count == 0):
+                room -= len(lines[count])
+                count += 1
+            data = b"".join(lines[:count])
+            with open(self._segment_path(segment[0]), "ab") as f:
+                f.write(data)
+            segment[1] += len(data)
+            lines = lines[count:]
+
+        while len(self._segments) > 1 and sum(size for _, size in self._segments) > self.max_bytes:
+            number, _ = self._segments.pop(0)
+            try:
+                os.remove(self._segment_path(number))
+            except FileNotFoundError:
+                pass
+
+        # Позиция — конец журнала после этой пачки: снимок посчитан ровно до неё
+        tmp = self.rollups_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(f'{{"pos":{json.dumps(self._segments[-1])},"rollups":{snapshot}}}')
+        os.replace(tmp, self.rollups_path)
+
+    # ─── ЗАГРУЗКА ───
+
+    def load(self) -> None:
+        """Читает журнал и агрегаты. Блокирующая: вызывать через пул I/O до приёма апдейтов."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._segments = self._scan_segments()
+        self.rollups = self._load_rollups()
+
+    def _scan_segments(self) -> list:
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith("events-") and name.endswith(".jsonl"):
+                try:
+                    number = int(name[len("events-"):-len(".jsonl")])
+                except ValueError:
+                    continue
+                segments.append([number, os.path.getsize(os.path.join(self.directory, name))])
+        return sorted(segments)
+
+    def _load_rollups(self) -> dict:
+        try:
+            with open(self.rollups_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            rollups, (number, offset) = saved["rollups"], saved["pos"]
+        except FileNotFoundError:
+            return self.rebuild()
+        except Exception as e:
+            logger.warning(f"Аналитика: не удалось прочитать {self.rollups_path}: {e}")
+            return self.rebuild()
+        self.rollups = {**_empty_rollups(), **rollups}
+        replayed = self._replay(number, offset)
+        self._compact_rollups()
+        if replayed:
+            logger.info(f"Аналитика: дочитано из журнала после {number}:{offset} событий {replayed}")
+        return self.rollups
+
+    def rebuild(self) -> dict:
+        """Пересчитывает агрегаты по всему журналу."""
+        self.rollups = _empty_rollups()
+        self._replay(0, 0)
+        self._compact_rollups()
+        if self._segments:
+            logger.info(f"Аналитика: агрегаты пересчитаны по журналу, событий {self.rollups['events']}")
+        return self.rollups
+
+    def _replay(self, number: int, offset: int) -> int:
+        """Применяет события журнала начиная с позиции (сегмент, байт); строки с ошибкой пропускаются."""
+        applied = 0
+        for segment, _ in self._segments:
+            if segment < number:
+                continue
+            with open(self._segment_path(segment), "rb") as f:
+                if segment == number:
+                    f.seek(offset)
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    applied += 1
+        return applied
+
+    # ─── ОТЧЁТ ───
+
+    def _sum(self, key: str, since_key: str) -> dict:
+        total: dict = {}
+        for bucket_key, bucket in self.rollups[key].items():
+            if bucket_key >= since_key:
+                for k, v in bucket.items():
+                    _bump(total, k, v)
+        return total
+
+    def _line(self, counts: dict) -> str:
+        return ", ".join(f"{KIND_NAMES[k]} {counts.get(k, 0)}" for k in KIND_NAMES)
+
+    def summary(self, days: int = 7, now: float = None) -> str:
+        r = self.rollups
+        if not r["events"]:
+            return "📈 Событий ещё не было."
+        now = time.time() if now is None else now
+        journal = sum(size for _, size in self._segments) / 1024 / 1024
+        lines = [
+            "📈 *Статистика использования* (UTC)",
+            f"Событий: {r['events']} с {_day_key(r['since'])} | журнал {len(self._segments)} сегм., "
+            f"{journal:.1f} МБ | в буфере {len(self._buffer)}",
+            "",
+            f"За 24 ч: {self._line(self._sum('hourly', _hour_key(now - 23 * 3600)))}",
+            f"За {days} дн.: {self._line(self._sum('daily', _day_key(now - (days - 1) * 86400)))}",
+        ]
+
+        day_keys = sorted(k for k in r["daily"] if k >= _day_key(now - (days - 1) * 86400))
+        if day_keys:
+            lines.append("\n📅 *По дням* (вопросы / LLM / расчёты / схемы):")
+            for key in day_keys:
+                d = r["daily"][key]
+                lines.append(f"  {key[5:]}: {d.get(QUESTION, 0)} / {d.get(LLM_CALL, 0)} / "
+                             f"{d.get(CALC, 0)} / {d.get(IMAGES, 0)}")
+
+        if r["setups"]:
+            top = sorted(r["setups"].items(), key=lambda kv: -sum(kv[1].values()))[:5]
+            lines.append("\n📐 *Сетапы* (вопросы / схемы / расчёты):")
+            for setup, c in top:
+                lines.append(f"  №{setup}: {c.get(QUESTION, 0)} / {c.get(IMAGES, 0)} / {c.get(CALC, 0)}")
+
+        llm = r["llm"]
+        if llm["calls"]:
+            p50 = _latency_percentile(llm["hist"], 50)
+            p95 = _latency_percentile(llm["hist"], 95)
+            lines.append(
+                f"\n🤖 *LLM:* вызовов {llm['calls']}, ошибок {llm['errors']} | "
+                f"среднее {llm['ms'] / llm['calls']:.0f} мс, p50 ≤ {p50 or '>32000'} мс, "
+                f"p95 ≤ {p95 or '>32000'} мс\n"
+                f"Токены: вход {llm['prompt_tokens']}, выход {llm['completion_tokens']} "
+                f"(≈{(llm['prompt_tokens'] + llm['completion_tokens']) / llm['calls']:.0f} на вызов)"
+            )
+
+        calc = r["calc"]
+        if calc["phase"]:
+            def top_values(counter):
+                return ", ".join(f"{k} ×{v}" for k, v in sorted(counter.items(), key=lambda kv: -kv[1])[:4])
+            lines.append(f"\n🧮 *Калькулятор:* фазы {top_values(calc['phase'])}\n"
+                         f"ATR {top_values(calc['atr'])} | CF {top_values(calc['cf'])}")
+
+        if r["intents"]:
+            # "_" в именах намерений (list_setups) — разметка Markdown, экранируем
+            lines.append("\n🧭 Намерения: " + ", ".join(
+                f"{k}={v}".replace("_", "\\_") for k, v in sorted(r["intents"].items(), key=lambda kv: -kv[1])))
+        return "\n".join(lines)
+
+    def stats(self) -> dict:
+        return {"events": self.rollups["events"], "buffered": len(self._buffer), "dropped": self.dropped,
+                "flushes": self.flushes, "last_flush_ms": round(self.flush_ms, 1),
+                "segments": len(self._segments)}
@@ -0,0 +1,160 @@
+"""
+Подготовка изображений стратегии к отправке в Telegram.
+
+- Дедупликация по содержимому (sha256): одинаковые картинки под разными
+  именами хранятся в памяти один раз и загружаются в Telegram один раз
+- Перекодирование под Telegram: длинная сторона не больше 1280px,
+  JPEG для картинок без прозрачности (если это меньше оригинала).
+  Результат кэшируется на диске по хэшу исходника и настройкам перекодирования
+- Проверка что все пути из image_map.IMAGE_RULES существуют
+- file_id уже загруженных картинок запоминается — повторно байты не шлём
+
+Запуск как скрипт — сборка кэша и проверка путей (шаг сборки на Render):
+    python assets.py
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import sys
+
+from storage import read_json, write_json
+
+logger = logging.getLogger(__name__)
+
+ASSET_CACHE_DIR = ".cache/assets"
+MAX_SIDE = 1280          # Telegram всё равно ужимает фото до 1280px
+JPEG_QUALITY = 85
+
+
+def missing_rule_images(rules) -> list:
+    """Пути из IMAGE_RULES, которых нет на диске."""
+    return sorted({p for _, paths, _ in rules for p in paths if not os.path.exists(p)})
+
+
+def transcode(data: bytes) -> bytes:
+    """
+    Уменьшает и перекодирует картинку. Без Pillow или при ошибке
+    возвращает исходные байты. Никогда не возвращает результат больше исходника.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return data
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        if max(img.size) > MAX_SIDE:
+            img.thumbnail((MAX_SIDE, MAX_SIDE), Image.LANCZOS)
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        out = io.BytesIO()
+        if has_alpha:
+            img.save(out, format="PNG", optimize=True)
+        else:
+            img.convert("RGB").save(out, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+        result = out.getvalue()
+        return result if len(result) < len(data) else data
+    except Exception as e:
+        logger.warning(f"Не удалось перекодировать изображение: {e}")
+        return data
+
+
+class AssetStore:
+    """
+    Предзагруженные в память изображения.
+    path -> sha256 исходника -> оптимизированные байты / file_id в Telegram.
+    """
+
+    def __init__(self, cache_dir: str = ASSET_CACHE_DIR, file_ids_path: str = None):
+        self.cache_dir = cache_dir
+        self.file_ids_path = file_ids_path
+        self.path_hash: dict = {}
+        self.blobs: dict = {}
+        self.file_ids: dict = read_json(file_ids_path, {}) if file_ids_path else {}
+        self.stats = {"files": 0, "unique": 0, "source_bytes": 0, "optimized_bytes": 0}
+
+    def _cached_transcode(self, digest: str, data: bytes) -> bytes:
+        # Настройки в имени: сменили MAX_SIDE или качество — старый кэш не подхватится
+        cache_path = os.path.join(self.cache_dir, f"{digest}-{MAX_SIDE}-q{JPEG_QUALITY}")
+        if os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                return f.read()
+        result = transcode(data)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = cache_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(result)
+        os.replace(tmp, cache_path)
+        return result
+
+    def build(self, paths) -> None:
+        """Загружает, дедуплицирует и перекодирует файлы. Блокирующий."""
+        for path in sorted(set(paths)):
+            if path in self.path_hash or not os.path.exists(path):
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()
+            self.path_hash[path] = digest
+            self.stats["files"] += 1
+            self.stats["source_bytes"] += len(data)
+            if digest not in self.blobs:
+                self.blobs[digest] = self._cached_transcode(digest, data)
+                self.stats["unique"] += 1
+                self.stats["optimized_bytes"] += len(self.blobs[digest])
+        logger.info(
+            f"Изображения: {self.stats['files']} файлов, {self.stats['unique']} уникальных, "
+            f"{self.stats['source_bytes'] // 1024} → {self.stats['optimized_bytes'] // 1024} КБ"
+        )
+
+    def key(self, path: str):
+        """Хэш содержимого — одинаковые картинки под разными именами дают один ключ."""
+        return self.path_hash.get(path)
+
+    def get(self, path: str):
+        """Байты для отправки или None, если файла нет."""
+        digest = self.path_hash.get(path)
+        return self.blobs.get(digest) if digest else None
+
+    def file_id(self, path: str):
+        digest = self.path_hash.get(path)
+        return self.file_ids.get(digest) if digest else None
+
+    def remember_file_id(self, path: str, file_id: str) -> None:
+        digest = self.path_hash.get(path)
+        if not digest or self.file_ids.get(digest) == file_id:
+            return
+        self.file_ids[digest] = file_id
+        self._save_file_ids()
+
+    def forget_file_id(self, path: str) -> None:
+        digest = self.path_hash.get(path)
+        if digest and self.file_ids.pop(digest, None) is not None:
+            self._save_file_ids()
+
+    def _save_file_ids(self) -> None:
+        if not self.file_ids_path:
+            return
+        try:
+            write_json(self.file_ids_path, self.file_ids)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить file_id: {e}")
+
+
+def rule_paths(rules) -> list:
+    return [p for _, paths, _ in rules for p in paths]
+
+
+if __name__ == "__main__":
+    from image_map import IMAGE_RULES
+
+    logging.basicConfig(level=logging.INFO)
+    missing = missing_rule_images(IMAGE_RULES)
+    if missing:
+        print("Нет файлов из IMAGE_RULES:\n" + "\n".join(missing))
+        sys.exit(1)
+    store = AssetStore()
+    store.build(rule_paths(IMAGE_RULES))
+    print(json.dumps(store.stats, ensure_ascii=False))
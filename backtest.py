@@ -0,0 +1,411 @@
+"""
+Бэктест правил калькулятора на истории сделок.
+
+Лог сделок — CSV (или Parquet, если установлен pyarrow), по строке на сделку:
+
+    account,date,setup,outcome,rr
+    ftmo1,2024-03-01,3,win,2.1
+    ftmo1,2024-03-04,5,loss,-1
+
+- account — счёт (необязательно; без колонки всё считается одним счётом)
+- date    — дата сделки; день цикла = номер торгового дня в текущем месяце
+- setup   — номер сетапа 1-16
+- rr      — фактический результат в R (2.1 — плюс 2.1 риска, -1 — стоп)
+- outcome — win/loss/be, если rr нет: win берёт RR-цель калькулятора
+
+Лог должен быть отсортирован по дате внутри счёта. Риск каждой сделки
+считается формулами калькулятора (T9 и J9, как в full_calculate, без
+форматирования) по текущему балансу, фазе и дню цикла; прибыль прошлой
+сделки идёт в бонус. Фазы: 1ph → 2ph при +8%, 2ph → funded при +5%
+(баланс начинается заново); просадка 10% — слив, счёт начинает 1ph заново.
+
+Файл читается кусками по CHUNK_ROWS строк, на счёт хранится только состояние
+и прореженная кривая эквити (не больше CURVE_POINTS точек) — память не зависит
+от длины лога. Для параллельности лог разбирается один раз: partition()
+раскладывает годные сделки по файлам шардов (счета — по хэшу имени, порядок
+сделок внутри счёта сохраняется), и каждый процесс считает только свой шард.
+
+    python backtest.py trades.csv --initial 50000 --phase 1ph --workers 4
+    python backtest.py trades.parquet --curve equity.csv
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from calculator import calc_J, calc_Z, SETUP_NAMES
+from grid import risk_base, profit_bonus, MAX_RISK
+
+CHUNK_ROWS = 10_000
+CURVE_POINTS = 500
+MAX_DD = 10.0
+PHASE_TARGETS = {"1ph": ("2ph", 108.0), "2ph": ("funded", 105.0)}
+
+_COLUMNS = {
+    "account": ("account", "acc", "счёт", "счет"),
+    "date": ("date", "datetime", "time", "дата"),
+    "setup": ("setup", "сетап"),
+    "outcome": ("outcome", "result", "исход", "результат"),
+    "rr": ("rr", "r"),
+}
+_WIN = {"win", "tp", "w", "+", "1", "плюс", "тейк"}
+_LOSS = {"loss", "sl", "l", "-", "-1", "минус", "стоп"}
+
+
+# ─── ЧТЕНИЕ ЛОГА ───────────────────────────────────────────────────────────────
+
+def _column_map(header) -> dict:
+    normalized = {h.strip().lower(): h for h in header}
+    return {
+        field: next((normalized[a] for a in aliases if a in normalized), None)
+        for field, aliases in _COLUMNS.items()
+    }
+
+
+def iter_chunks(path: str, chunk_rows: int = CHUNK_ROWS):
+    """Куски по chunk_rows строк-словарей. Parquet — через pyarrow (опционально)."""
+    if path.lower().endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("для Parquet нужен pyarrow")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pylist()
+        return
+
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.DictReader(f, dialect=dialect)
+        while True:
+            chunk = list(itertools.islice(reader, chunk_rows))
+            if not chunk:
+                return
+            yield chunk
+
+
+def _parse_row(row: dict, cols: dict):
+    """(счёт, дата, сетап, rr или None, исход). ValueError — строка негодная."""
+    account = str(row[cols["account"]]).strip() if cols["account"] else "—"
+    date = str(row[cols["date"]])[:10] if cols["date"] else ""
+    setup = int(float(row[cols["setup"]]))
+    if setup not in SETUP_NAMES:
+        raise ValueError
+    rr_raw = row[cols["rr"]] if cols["rr"] else None
+    rr = float(str(rr_raw).replace(",", ".")) if rr_raw not in (None, "") else None
+    outcome = str(row[cols["outcome"]]).strip().lower() if cols["outcome"] else ""
+    if rr is None and outcome not in _WIN and outcome not in _LOSS and outcome != "be":
+        raise ValueError
+    return account, date, setup, rr, outcome
+
+
+# ─── СОСТОЯНИЕ СЧЁТА ───────────────────────────────────────────────────────────
+
+class _Curve:
+    """Прореженная кривая: при переполнении выкидывается каждая вторая точка."""
+
+    def __init__(self, max_points: int = CURVE_POINTS):
+        self.max_points = max_points
+        self.step = 1
+        self.points = []
+
+    def add(self, i: int, value: float) -> None:
+        if i % self.step:
+            return
+        self.points.append((i, round(value, 2)))
+        if len(self.points) > self.max_points:
+            self.step *= 2
+            self.points = [p for p in self.points if p[0] % self.step == 0]
+
+
+class AccountSim:
+    def __init__(self, initial: float, phase: str, atr: float = 1.0, cf: float = 1.0):
+        self.initial = initial
+        self.atr, self.cf = atr, cf
+        self.phase = phase
+        self.balance = initial
+        self.equity = initial            # непрерывный итог по всем попыткам
+        self.peak = initial
+        self.max_dd = 0.0
+        self.month = None
+        self.last_date = None
+        self.cycle_day = 0
+        self.prev_profit = 0.0
+        self.trades = self.wins = self.losses = 0
+        self.passes = {"1ph": 0, "2ph": 0}
+        self.blown = 0
+        self.dd_start = None             # номер сделки начала текущей просадки
+        self.recovered = 0               # просадок, после которых эквити обновило пик
+        self.recovery_sum = 0
+        self.recovery_max = 0
+        self.curve = _Curve()
+        self.curve.add(0, initial)
+
+    def _next_day(self, date: str) -> None:
+        if not date:
+            self.cycle_day = self.cycle_day % 20 + 1
+            return
+        if date[:7] != self.month:
+            self.month, self.cycle_day = date[:7], 0
+        if date != self.last_date:
+            self.last_date = date
+            self.cycle_day += 1
+
+    def trade(self, date: str, setup: int, rr, outcome: str) -> None:
+        self._next_day(date)
+        F, base = risk_base(self.balance, self.initial, self.phase, setup, self.atr, self.cf, 1.0, 1.0)
+        risk_pct = min(MAX_RISK, base * calc_Z(F, max(1, self.cycle_day)) + profit_bonus(self.prev_profit, self.balance))
+        if rr is None:
+            rr = calc_J(F, self.atr) if outcome in _WIN else (-1.0 if outcome in _LOSS else 0.0)
+        pnl = self.initial * risk_pct / 100 * rr
+        self.trades += 1
+        self.wins += pnl > 0
+        self.losses += pnl < 0
+        self.prev_profit = max(0.0, pnl)
+        self.balance += pnl
+        self.equity += pnl
+        self._track_drawdown()
+        self.curve.add(self.trades, self.equity)
+        self._check_phase()
+
+    def _track_drawdown(self) -> None:
+        if self.equity >= self.peak:
+            if self.dd_start is not None:
+                length = self.trades - self.dd_start
+                self.recovered += 1
+                self.recovery_sum += length
+                self.recovery_max = max(self.recovery_max, length)
+                self.dd_start = None
+            self.peak = self.equity
+        else:
+            if self.dd_start is None:
+                self.dd_start = self.trades - 1
+            self.max_dd = max(self.max_dd, (1 - self.equity / self.peak) * 100)
+
+    def _check_phase(self) -> None:
+        pct = self.balance / self.initial * 100
+        if pct <= 100 - MAX_DD:
+            self.blown += 1
+            self.phase, self.balance, self.prev_profit = "1ph", self.initial, 0.0
+        elif self.phase in PHASE_TARGETS and pct >= PHASE_TARGETS[self.phase][1]:
+            self.passes[self.phase] += 1
+            self.phase, self.balance, self.prev_profit = PHASE_TARGETS[self.phase][0], self.initial, 0.0
+
+    def result(self) -> dict:
+        return {
+            "trades": self.trades,
+            "wins": self.wins,
+            "losses": self.losses,
+            "pnl": round(self.equity - self.initial, 2),
+            "max_dd_pct": round(self.max_dd, 2),
+            "phase": self.phase,
+            "passes": self.passes,
+            "blown": self.blown,
+            "drawdowns": self.recovered + (self.dd_start is not None),
+            "recovered": self.recovered,
+            "avg_recovery_trades": round(self.recovery_sum / self.recovered, 1) if self.recovered else None,
+            "max_recovery_trades": self.recovery_max if self.recovered else None,
+            "in_drawdown": self.dd_start is not None,
+            "curve": self.curve.points,
+        }
+
+
+# ─── ПРОГОН ────────────────────────────────────────────────────────────────────
+
+# Ошибки чтения лога целиком (не отдельной строки) — сообщаются пользователю
+READ_ERRORS = (OSError, ValueError, UnicodeDecodeError, csv.Error)
+
+
+def iter_trades(path: str, stats: dict, chunk_rows: int = CHUNK_ROWS):
+    """
+    Годные сделки лога по порядку: (счёт, дата, сетап, rr или None, исход).
+    stats — счётчики "rows" и "skipped", заполняются по ходу чтения.
+    """
+    cols = None
+    for chunk in iter_chunks(path, chunk_rows):
+        if cols is None:
+            cols = _column_map(chunk[0].keys())
+            if not cols["setup"] or not (cols["rr"] or cols["outcome"]):
+                raise ValueError("нужны колонки setup и rr или outcome")
+        for row in chunk:
+            stats["rows"] += 1
+            try:
+                yield _parse_row(row, cols)
+            except (ValueError, TypeError, KeyError):
+                stats["skipped"] += 1
+
+
+def simulate(trades, initial: float = 50000.0, phase: str = "1ph", atr: float = 1.0, cf: float = 1.0) -> dict:
+    """Прогон сделок по счетам: {имя: результат}."""
+    sims: dict = {}
+    for account, date, setup, rr, outcome in trades:
+        sim = sims.get(account)
+        if sim is None:
+            sim = sims[account] = AccountSim(initial, phase, atr, cf)
+        sim.trade(date, setup, rr, outcome)
+    return {a: s.result() for a, s in sims.items()}
+
+
+def _shard(account: str, shards: int) -> int:
+    return zlib.crc32(account.encode()) % shards
+
+
+def partition(path: str, shards: int, directory: str, chunk_rows: int = CHUNK_ROWS) -> dict:
+    """
+    Разбирает лог один раз и раскладывает годные сделки по CSV шардов в directory.
+    Возвращает {"shards": [пути], "rows", "skipped"}.
+    """
+    stats = {"rows": 0, "skipped": 0}
+    paths = [os.path.join(directory, f"shard-{i}.csv") for i in range(shards)]
+    files = [open(p, "w", newline="", encoding="utf-8") for p in paths]
+    try:
+        writers = [csv.writer(f) for f in files]
+        for account, date, setup, rr, outcome in iter_trades(path, stats, chunk_rows):
+            writers[_shard(account, shards)].writerow((account, date, setup, "" if rr is None else rr, outcome))
+    finally:
+        for f in files:
+            f.close()
+    return {"shards": paths, **stats}
+
+
+def _read_shard(path: str):
+    with open(path, newline="", encoding="utf-8") as f:
+        for account, date, setup, rr, outcome in csv.reader(f):
+            yield account, date, int(setup), float(rr) if rr else None, outcome
+
+
+def run_shard(path: str, initial: float = 50000.0, phase: str = "1ph", atr: float = 1.0, cf: float = 1.0) -> dict:
+    """
+    Бэктест одного шарда из partition(): {имя счёта: результат}.
+    Функция верхнего уровня — отдаётся в пул процессов.
+    """
+    return simulate(_read_shard(path), initial, phase, atr, cf)
+
+
+def merge(parts: list, rows: int, skipped: int) -> dict:
+    """Сводит результаты шардов: счета не пересекаются."""
+    accounts = {}
+    for p in parts:
+        accounts.update(p)
+    return {"accounts": accounts, "rows": rows, "skipped": skipped}
+
+
+def run(path: str, workers: int = 1, **params) -> dict:
+    """Бэктест на workers процессах (шард на процесс)."""
+    if workers <= 1:
+        stats = {"rows": 0, "skipped": 0}
+        accounts = simulate(iter_trades(path, stats), **params)
+        return {"accounts": accounts, **stats}
+    directory = tempfile.mkdtemp(prefix="backtest-")
+    try:
+        split = partition(path, workers, directory)
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(run_shard, shard, **params) for shard in split["shards"]]
+            parts = [f.result() for f in futures]
+        return merge(parts, split["rows"], split["skipped"])
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+# ─── ВЫВОД ─────────────────────────────────────────────────────────────────────
+
+def format_backtest(result: dict, initial: float, limit: int = 15) -> str:
+    accounts = result["accounts"]
+    if not accounts:
+        return f"⚠️ Нет ни одной годной сделки (строк: {result['rows']}, пропущено: {result['skipped']})."
+    trades = sum(a["trades"] for a in accounts.values())
+    pnl = sum(a["pnl"] for a in accounts.values())
+    lines = [
+        f"📈 *Бэктест*: счетов {len(accounts)}, сделок {trades}, пропущено строк {result['skipped']}",
+        f"Итог: ${pnl:,.0f} | депозит ${initial:,.0f} на счёт",
+        "```",
+        f"{'Счёт':<12} {'сдел':>5} {'win%':>5} {'P&L $':>9} {'DD%':>5} {'1ph':>3} {'2ph':>3} {'слив':>4} {'восст':>6}",
+    ]
+    ranked = sorted(accounts.items(), key=lambda kv: -kv[1]["trades"])
+    for name, a in ranked[:limit]:
+        winrate = a["wins"] / a["trades"] if a["trades"] else 0
+        recovery = f"{a['avg_recovery_trades']:.1f}" if a["avg_recovery_trades"] is not None else "—"
+        lines.append(
+            f"{name[:12]:<12} {a['trades']:>5} {winrate:>5.0%} {a['pnl']:>9,.0f} {a['max_dd_pct']:>5.1f} "
+            f"{a['passes']['1ph']:>3} {a['passes']['2ph']:>3} {a['blown']:>4} {recovery:>6}"
+        )
+    if len(ranked) > limit:
+        lines.append(f"... и ещё {len(ranked) - limit}")
+    lines.append("```")
+    lines.append("1ph/2ph — пройдено фаз, восст — сделок в среднем до нового пика эквити")
+    return "\n".join(lines)
+
+
+def equity_chart(result: dict, limit: int = 10):
+    """PNG с кривыми эквити (bytes) или None, если matplotlib не установлен."""
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        return None
+    import io
+
+    ranked = sorted(result["accounts"].items(), key=lambda kv: -kv[1]["trades"])[:limit]
+    fig, ax = plt.subplots(figsize=(8, 4))
+    try:
+        for name, a in ranked:
+            xs, ys = zip(*a["curve"]) if a["curve"] else ((), ())
+            ax.plot(xs, ys, label=name, linewidth=1)
+        ax.set_xlabel("Сделка")
+        ax.set_ylabel("Эквити, $")
+        ax.set_title("Бэктест — кривая эквити")
+        if len(ranked) > 1:
+            ax.legend(fontsize=7)
+        fig.tight_layout()
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", dpi=110)
+        return buf.getvalue()
+    finally:
+        plt.close(fig)
+
+
+def write_curves(result: dict, path: str) -> None:
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["account", "trade", "equity"])
+        for name, a in result["accounts"].items():
+            for i, equity in a["curve"]:
+                w.writerow([name, i, equity])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бэктест правил калькулятора на логе сделок")
+    parser.add_argument("path", help="CSV или Parquet с колонками account,date,setup,outcome,rr")
+    parser.add_argument("--initial", type=float, default=50000.0, help="депозит счёта")
+    parser.add_argument("--phase", default="1ph", choices=("1ph", "2ph", "funded"))
+    parser.add_argument("--atr", type=float, default=1.0)
+    parser.add_argument("--cf", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--curve", help="записать кривые эквити в CSV")
+    parser.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    args = parser.parse_args()
+
+    try:
+        res = run(args.path, workers=args.workers, initial=args.initial, phase=args.phase,
+                  atr=args.atr, cf=args.cf)
+    except READ_ERRORS as e:
+        print(f"Ошибка: {e}")
+        sys.exit(1)
+    if args.curve:
+        write_curves(res, args.curve)
+    if args.json:
+        print(json.dumps(res, ensure_ascii=False))
+    else:
+        print(format_backtest(res, args.initial, limit=50))
@@ -0,0 +1,110 @@
+"""
+Нагрузочный тест задержки event loop.
+
+    python benchmarks/loop_lag.py                     # 5 с нагрузки, порог p99 5 мс
+    python benchmarks/loop_lag.py --seconds 10 --users 100 --max-p99 3
+
+Параллельно гоняет вопросы к AI (заглушка с задержкой сети), /calc одной строкой,
+/grid, отправку Excel-файла и /reload стратегии. LoopLagMonitor всё это время
+меряет опоздание loop. Exit 1, если p99 выше порога.
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+import types
+
+import run as bench   # настраивает окружение и импортирует bot
+from run import bot, _StubBot, _make_update
+
+LLM_LATENCY = 0.05
+
+
+async def _stub_openrouter(user_message, history):
+    await asyncio.sleep(LLM_LATENCY)
+    return bench.LLM_REPLY
+
+
+class _AdminMessage(bench._StubMessage):
+    async def reply_document(self, **kwargs):
+        return None
+
+
+async def _user(uid: int, deadline: float, counts: dict):
+    ctx = types.SimpleNamespace(bot=_StubBot(), args=None)
+    rnd = random.Random(uid)
+    while time.perf_counter() < deadline:
+        kind = rnd.choice(("ask", "ask", "ask", "calc", "grid", "file"))
+        bot.user_rate.pop(uid, None)
+        update = _make_update(uid, bench.SHORT_TEXT)
+        update.message = _AdminMessage(bench.SHORT_TEXT)
+        if kind == "ask":
+            await bot.handle_message(update, ctx)
+        elif kind == "calc":
+            ctx.args = f"{rnd.randint(45000, 55000)} 50000 1ph {rnd.randint(1, 16)} day={rnd.randint(1, 14)}".split()
+            await bot.calc_command(update, ctx)
+        elif kind == "grid":
+            ctx.args = f"50000 2ph {rnd.randint(1, 16)}".split()
+            await bot.grid_command(update, ctx)
+        else:
+            await bot.send_calculator(update, ctx)
+        ctx.args = None
+        counts[kind] = counts.get(kind, 0) + 1
+        await asyncio.sleep(rnd.uniform(0.01, 0.05))
+
+
+async def _reloader(deadline: float, counts: dict):
+    ctx = types.SimpleNamespace(bot=_StubBot(), args=None)
+    while time.perf_counter() < deadline:
+        update = _make_update(bot.ADMIN_IDS[0] if bot.ADMIN_IDS else 1, "/reload")
+        update.message = _AdminMessage("/reload")
+        await bot.reload_strategy(update, ctx)
+        counts["reload"] = counts.get("reload", 0) + 1
+        await asyncio.sleep(0.5)
+
+
+async def main_async(seconds: float, users: int) -> dict:
+    bot.ask_openrouter = _stub_openrouter
+    bot.offload.start()   # как в startup бота: форк до потоков пула I/O
+    await bot.offload.run_io(bot.asset_store.build, bot.rule_paths(bot.IMAGE_RULES))
+
+    async def always_subscribed(*args):
+        return True
+    bot.has_public_subscription = always_subscribed
+
+    monitor = bot.LoopLagMonitor(interval=0.01, window=100_000)
+    monitor.start()
+    deadline = time.perf_counter() + seconds
+    counts = {}
+    await asyncio.gather(
+        _reloader(deadline, counts),
+        *(_user(uid, deadline, counts) for uid in range(users)),
+    )
+    await monitor.stop()
+    bot.offload.shutdown()
+    return {"lag": monitor.stats(), "ops": counts, "offload": bot.offload.stats()}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест задержки event loop")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--max-p99", type=float, default=5.0, help="порог p99 задержки, мс")
+    args = parser.parse_args()
+
+    result = asyncio.run(main_async(args.seconds, args.users))
+    lag = result["lag"]
+    print(f"Операций: {result['ops']}")
+    print(f"Offload: {result['offload']}")
+    print(f"Loop lag: p50 {lag['p50_ms']} мс | p99 {lag['p99_ms']} мс | max {lag['max_ms']} мс | семплов {lag['samples']}")
+    if lag["p99_ms"] > args.max_p99:
+        print(f"❌ p99 выше порога {args.max_p99} мс")
+        return 1
+    print(f"✅ p99 в пределах {args.max_p99} мс")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Бенчмарк оптимизатора риска (/optimize).
+
+    python benchmarks/optimize.py                 # порог 5 с на холодный поиск
+    python benchmarks/optimize.py --max-seconds 3
+
+Меряет полный поиск по CF × ATR × день цикла через пул процессов бота
+(холодный кэш) и повторный запрос (попадание в кэш). Exit 1, если холодный
+поиск дольше порога.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from run import bot   # настраивает окружение и импортирует bot
+import optimizer
+
+CASES = [
+    (48500, 50000, "1ph", 3),
+    (97000, 100000, "2ph", 7),
+    (101000, 100000, "funded", 11),
+]
+
+
+async def main_async() -> list:
+    bot.offload.start()   # как в startup бота: форк до потоков
+    rows = []
+    for balance, initial, phase, setup in CASES:
+        params = dict(balance=float(balance), initial=float(initial), phase=phase, setup=setup,
+                      target=optimizer.DEFAULT_TARGETS[phase], max_dd=optimizer.DEFAULT_MAX_DD)
+        t0 = time.perf_counter()
+        front = await bot.optimize_front(**params)
+        cold = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        await bot.optimize_front(**params)
+        warm = time.perf_counter() - t0
+        rows.append((f"{phase} сетап {setup} ({balance}/{initial})", cold, warm, len(front)))
+    bot.offload.shutdown()
+    return rows
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк оптимизатора риска")
+    parser.add_argument("--max-seconds", type=float, default=5.0, help="порог холодного поиска, с")
+    args = parser.parse_args()
+
+    combos = len(optimizer.candidates())
+    print(f"Комбинаций: {combos} | симуляций на комбинацию: {optimizer.DEFAULT_PATHS} | процессов: {bot.CPU_WORKERS}")
+    rows = asyncio.run(main_async())
+    worst = 0.0
+    for name, cold, warm, front in rows:
+        worst = max(worst, cold)
+        print(f"{name:<32} холодный {cold:6.2f} с | из кэша {warm * 1e6:7.1f} мкс | фронт {front}")
+    if worst > args.max_seconds:
+        print(f"❌ Поиск дольше {args.max_seconds} с")
+        return 1
+    print(f"✅ Поиск укладывается в {args.max_seconds} с")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
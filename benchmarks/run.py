@@ -0,0 +1,419 @@
+"""
+Микробенчмарки горячих путей бота.
+
+    python benchmarks/run.py                  # прогон и вывод таблицы
+    python benchmarks/run.py --record         # записать baseline.json
+    python benchmarks/run.py --compare        # сравнить с baseline.json, exit 1 при регрессии
+    python benchmarks/run.py --compare --threshold 0.15 --latency-threshold 0.5 --filter calc
+
+baseline.json зависит от машины и не хранится в git — записывайте его локально.
+
+Для каждого кейса: ops/sec (по пачкам вызовов), перцентили времени одной
+операции p50/p90/p99 (каждый вызов замеряется отдельно, за вычетом стоимости
+самого таймера) и аллокации через tracemalloc (пик и остаток на операцию).
+Регрессия — падение ops/sec больше --threshold или рост p99 больше --latency-threshold.
+Вызовы Telegram и OpenRouter в handle_message заменены заглушками.
+"""
+
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+# bot.py читает конфиг из окружения при импорте
+for _key, _value in {
+    "BOT_TOKEN": "0:bench", "OPENROUTER_API_KEY": "bench", "CHANNEL_ID": "-1",
+    "PUBLIC_CHANNEL_ID": "-2", "WEBHOOK_URL": "http://localhost",
+}.items():
+    os.environ.setdefault(_key, _value)
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="bench-")
+
+import logging
+logging.disable(logging.CRITICAL)
+
+import bot
+from calculator import full_calculate, format_result
+from image_map import find_images
+from intents import classify
+import webhook_filter
+from analytics import UsageAnalytics, DAILY_KEEP
+from telegram import Update
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_LATENCY_THRESHOLD = 0.5   # хвост шумнее среднего — порог шире
+
+SHORT_TEXT = "Как торговать сетап 3?"
+ROUTED_TEXT = "Какой винрейт у сетапа 3"    # отвечается роутером без LLM
+LONG_TEXT = (
+    "Разберём сетап №8 на GER40: 12ч FVG, затем 90м FVG и подтверждение 2ч bFVGc. "
+    "Риск считаем по формуле риска с коэффициентом роста KR, вход делим на два входа. "
+) * 12
+LLM_REPLY = (
+    "Сетап №3 — NAS100: 12ч FVG + 4ч bFVGc. Вход после подтверждения, "
+    "стоп за экстремум, фиксация по шагам RR."
+)
+
+
+def _webhook_stream() -> list:
+    """Смешанный поток сырых апдейтов, как его видит /webhook без allowed_updates."""
+    user = {"id": 42, "is_bot": False, "first_name": "bench"}
+    chat = {"id": 42, "type": "private", "first_name": "bench"}
+    msg = {"message_id": 1, "date": 1700000000, "chat": chat, "from": user}
+    channel = {"message_id": 2, "date": 1700000000, "chat": {"id": -100, "type": "channel", "title": "c"}}
+    updates = [
+        {"message": {**msg, "text": SHORT_TEXT}},
+        {"message": {**msg, "text": "/calc 48500 50000 1ph 3"}},
+        {"message": {**msg, "text": SHORT_TEXT * 60}},
+        {"message": {**msg, "sticker": {"file_id": "s", "file_unique_id": "u", "width": 512, "height": 512,
+                                        "is_animated": False, "is_video": False, "type": "regular"}}},
+        {"message": {**msg, "photo": [{"file_id": "p", "file_unique_id": "u", "width": 90, "height": 90}]}},
+        {"edited_message": {**msg, "edit_date": 1700000001, "text": SHORT_TEXT}},
+        {"channel_post": {**channel, "text": LLM_REPLY}},
+        {"my_chat_member": {"chat": chat, "from": user, "date": 1700000000,
+                            "old_chat_member": {"status": "member", "user": user},
+                            "new_chat_member": {"status": "kicked", "user": user, "until_date": 0}}},
+        {"callback_query": {"id": "1", "from": user, "chat_instance": "x", "data": "c_atr_1.0", "message": msg}},
+        {"inline_query": {"id": "2", "from": user, "query": "48500 50000 1ph 3", "offset": ""}},
+    ]
+    return [json.dumps({"update_id": i, **u}).encode() for i, u in enumerate(updates)]
+
+
+# ─── ЗАГЛУШКИ TELEGRAM / OPENROUTER ──────────────────────────────────────────
+
+class _StubMessage:
+    def __init__(self, text):
+        self.text = text
+
+    async def reply_text(self, text, **kwargs):
+        return None
+
+    async def reply_photo(self, photo=None, **kwargs):
+        return types.SimpleNamespace(photo=[types.SimpleNamespace(file_id="bench")])
+
+
+class _StubBot:
+    async def get_chat_member(self, chat_id, user_id):
+        return types.SimpleNamespace(status="member")
+
+    async def send_chat_action(self, **kwargs):
+        return True
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return None
+
+
+async def _stub_openrouter(user_message, history):
+    return LLM_REPLY
+
+
+def _make_update(uid, text):
+    return types.SimpleNamespace(
+        message=_StubMessage(text),
+        effective_user=types.SimpleNamespace(id=uid, first_name="bench"),
+        effective_chat=types.SimpleNamespace(id=uid),
+    )
+
+
+# ─── КЕЙСЫ ───────────────────────────────────────────────────────────────────
+
+def _cases():
+    r = full_calculate(48500, 50000, "1ph", 3, atr=0.7, cycle_day=5, cf=1.0)
+    rate_uid = iter(range(10**9))
+
+    bot.ask_openrouter = _stub_openrouter
+    bot.asset_store.build(bot.rule_paths(bot.IMAGE_RULES))
+    ctx = types.SimpleNamespace(bot=_StubBot(), args=None)
+    msg_uid = iter(range(10**9))
+    for uid in range(1000):
+        bot.recipients.ids.add(uid)
+
+    async def handle_message():
+        # Сбрасываем rate limit — меряем путь ответа, а не отказ
+        uid = next(msg_uid) % 1000
+        bot.user_rate.pop(uid, None)
+        await bot.handle_message(_make_update(uid, SHORT_TEXT), ctx)
+
+    async def handle_message_local():
+        uid = next(msg_uid) % 1000
+        bot.user_rate.pop(uid, None)
+        await bot.handle_message(_make_update(uid, ROUTED_TEXT), ctx)
+
+    # Webhook: разбор каждого апдейта целиком против отсева по сырому телу
+    stream = itertools.cycle(_webhook_stream())
+
+    def webhook_full():
+        Update.de_json(json.loads(next(stream)), None)
+
+    def webhook_fastpath():
+        decision, data = webhook_filter.classify(next(stream))
+        if decision == webhook_filter.ACCEPT:
+            Update.de_json(data, None)
+
+    # Аналитика: запись события на горячем пути и /stats по полной истории хранения
+    usage = UsageAnalytics(os.path.join(os.environ["DATA_DIR"], "analytics-bench"))
+    usage.load()
+    now = time.time()
+    for hour in range(DAILY_KEEP * 24):
+        ts = now - hour * 3600
+        usage.record("q", {"i": "llm", "s": 1 + hour % 16}, ts)
+        usage.record("llm", {"ms": 800 + hour % 5000, "pt": 1500, "ct": 200}, ts)
+        usage.record("calc", {"v": [48500, 50000, "1ph", 3, 0.7, 1.0, 1 + hour % 20]}, ts)
+
+    # (имя, функция, async, начальный размер замера, число замеров)
+    return [
+        ("calc.full_calculate", lambda: full_calculate(48500, 50000, "1ph", 3, atr=0.7, cycle_day=5), False, 100, 30),
+        ("calc.format_result", lambda: format_result(r), False, 100, 30),
+        ("image_map.find_images.short", lambda: find_images(SHORT_TEXT), False, 100, 30),
+        ("image_map.find_images.long", lambda: find_images(LONG_TEXT), False, 10, 30),
+        ("intents.classify.llm", lambda: classify(SHORT_TEXT), False, 100, 30),
+        ("intents.classify.local", lambda: classify(ROUTED_TEXT), False, 100, 30),
+        ("webhook.decode.full", webhook_full, False, 100, 30),
+        ("webhook.decode.fastpath", webhook_fastpath, False, 100, 30),
+        ("analytics.record", lambda: usage.question("llm", 3), False, 100, 30),
+        ("analytics.summary", usage.summary, False, 10, 30),
+        ("bot.is_rate_limited", lambda: bot.is_rate_limited(next(rate_uid) % 1000), False, 100, 30),
+        ("bot.load_strategy", bot.load_strategy, False, 1, 10),
+        ("bot.handle_message", handle_message, True, 10, 30),
+        ("bot.handle_message.local", handle_message_local, True, 10, 30),
+    ]
+
+
+MIN_SAMPLE_NS = 5_000_000   # замер не короче 5 мс — меньше шума таймера и планировщика
+LATENCY_MAX_OPS = 50_000    # потолок числа отдельно замеряемых вызовов для перцентилей
+
+
+def _time_sync(fn, batch, samples):
+    per_op = []
+    gc.disable()
+    try:
+        for _ in range(samples):
+            t0 = time.perf_counter_ns()
+            for _ in range(batch):
+                fn()
+            per_op.append((time.perf_counter_ns() - t0) / batch)
+    finally:
+        gc.enable()
+    return per_op
+
+
+async def _time_async(fn, batch, samples):
+    per_op = []
+    gc.disable()
+    try:
+        for _ in range(samples):
+            t0 = time.perf_counter_ns()
+            for _ in range(batch):
+                await fn()
+            per_op.append((time.perf_counter_ns() - t0) / batch)
+    finally:
+        gc.enable()
+    return per_op
+
+
+def _timer_overhead_ns() -> float:
+    """Стоимость пары вызовов perf_counter_ns — вычитается из замера одного вызова."""
+    clock = time.perf_counter_ns
+    samples = []
+    for _ in range(1000):
+        t0 = clock()
+        samples.append(clock() - t0)
+    return statistics.median(samples)
+
+
+def _time_each_sync(fn, count, overhead):
+    clock = time.perf_counter_ns
+    per_op = []
+    gc.disable()
+    try:
+        for _ in range(count):
+            t0 = clock()
+            fn()
+            per_op.append(max(0.0, clock() - t0 - overhead))
+    finally:
+        gc.enable()
+    return per_op
+
+
+async def _time_each_async(fn, count, overhead):
+    clock = time.perf_counter_ns
+    per_op = []
+    gc.disable()
+    try:
+        for _ in range(count):
+            t0 = clock()
+            await fn()
+            per_op.append(max(0.0, clock() - t0 - overhead))
+    finally:
+        gc.enable()
+    return per_op
+
+
+def _calibrate(fn, is_async, batch):
+    """Увеличивает batch, пока один замер не станет длиннее MIN_SAMPLE_NS."""
+    while True:
+        if is_async:
+            per_op = asyncio.run(_time_async(fn, batch, 1))[0]
+        else:
+            per_op = _time_sync(fn, batch, 1)[0]
+        if per_op * batch >= MIN_SAMPLE_NS or per_op * batch * 2 > 20 * MIN_SAMPLE_NS:
+            return batch
+        batch *= 2
+
+
+def _allocations(fn, is_async, batch):
+    """Пик памяти за batch операций и остаток на операцию, байт."""
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        if is_async:
+            async def loop():
+                for _ in range(batch):
+                    await fn()
+            asyncio.run(loop())
+        else:
+            for _ in range(batch):
+                fn()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - before, (after - before) / batch
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def run(name_filter: str = "", quick: bool = False, rounds: int = 3) -> dict:
+    """
+    Прогоняет кейсы rounds раз и берёт лучший раунд по каждому кейсу:
+    шум (соседние процессы, частота CPU) только замедляет, поэтому best-of
+    даёт самую воспроизводимую оценку.
+    """
+    cases = [c for c in _cases() if not name_filter or name_filter in c[0]]
+    results = {}
+    for _ in range(rounds):
+        for name, result in _run_round(cases, quick).items():
+            if name not in results or result["ops_per_sec"] > results[name]["ops_per_sec"]:
+                results[name] = result
+    return {name: results[name] for name, *_ in cases}
+
+
+def _run_round(cases, quick: bool) -> dict:
+    results = {}
+    overhead = _timer_overhead_ns()
+    for name, fn, is_async, batch, samples in cases:
+        if quick:
+            samples = max(3, samples // 5)
+        # Калибровка заодно служит прогревом
+        batch = _calibrate(fn, is_async, batch)
+        # Пропускная способность — по пачкам; перцентили — по отдельным вызовам:
+        # среднее по пачке сглаживает как раз те выбросы, что попадают в p99
+        count = min(batch * samples, LATENCY_MAX_OPS)
+        if is_async:
+            per_batch = asyncio.run(_time_async(fn, batch, samples))
+            per_op = asyncio.run(_time_each_async(fn, count, overhead))
+        else:
+            per_batch = _time_sync(fn, batch, samples)
+            per_op = _time_each_sync(fn, count, overhead)
+        peak, retained = _allocations(fn, is_async, batch)
+        # ops/sec по медиане — устойчивее к выбросам, чем среднее
+        median = statistics.median(per_batch)
+        results[name] = {
+            "ops_per_sec": round(1e9 / median, 1),
+            "p50_us": round(_percentile(per_op, 50) / 1000, 3),
+            "p90_us": round(_percentile(per_op, 90) / 1000, 3),
+            "p99_us": round(_percentile(per_op, 99) / 1000, 3),
+            "alloc_peak_kb": round(peak / 1024, 1),
+            "alloc_retained_b_per_op": round(retained, 1),
+        }
+    return results
+
+
+def compare(current: dict, baseline: dict, threshold: float,
+            latency_threshold: float = DEFAULT_LATENCY_THRESHOLD) -> list:
+    """Список регрессий: падение ops/sec больше чем на threshold или рост p99 больше чем на latency_threshold."""
+    regressions = []
+    for name, cur in current.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if cur["ops_per_sec"] < base["ops_per_sec"] * (1 - threshold):
+            regressions.append(
+                f"{name}: ops/sec {base['ops_per_sec']:,.0f} → {cur['ops_per_sec']:,.0f} "
+                f"(p50 {base['p50_us']}µs → {cur['p50_us']}µs)"
+            )
+        if base.get("p99_us") and cur["p99_us"] > base["p99_us"] * (1 + latency_threshold):
+            regressions.append(
+                f"{name}: p99 {base['p99_us']}µs → {cur['p99_us']}µs "
+                f"(p50 {base['p50_us']}µs → {cur['p50_us']}µs)"
+            )
+    return regressions
+
+
+def print_table(results: dict, baseline: dict = None) -> None:
+    header = f"{'кейс':32} {'ops/sec':>12} {'p50 µs':>10} {'p99 µs':>10} {'peak KB':>9} {'Δ ops':>8}"
+    print(header)
+    print("─" * len(header))
+    for name, r in results.items():
+        delta = ""
+        if baseline and name in baseline:
+            delta = f"{(r['ops_per_sec'] / baseline[name]['ops_per_sec'] - 1) * 100:+.0f}%"
+        print(f"{name:32} {r['ops_per_sec']:>12,.0f} {r['p50_us']:>10.2f} {r['p99_us']:>10.2f} "
+              f"{r['alloc_peak_kb']:>9.1f} {delta:>8}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Микробенчмарки бота")
+    parser.add_argument("--record", action="store_true", help="записать baseline")
+    parser.add_argument("--compare", action="store_true", help="сравнить с baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="допустимое падение ops/sec, доля (0.25 = 25%%)")
+    parser.add_argument("--latency-threshold", type=float, default=DEFAULT_LATENCY_THRESHOLD,
+                        help="допустимый рост p99, доля (0.5 = 50%%)")
+    parser.add_argument("--filter", default="", help="подстрока имени кейса")
+    parser.add_argument("--quick", action="store_true", help="меньше замеров")
+    parser.add_argument("--rounds", type=int, default=3, help="раундов, берётся лучший")
+    args = parser.parse_args()
+
+    results = run(args.filter, args.quick, args.rounds)
+    baseline = None
+    if args.compare:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+
+    if args.record:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"\nBaseline записан: {args.baseline}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold, args.latency_threshold)
+        thresholds = f"пороги: ops/sec {args.threshold:.0%}, p99 {args.latency_threshold:.0%}"
+        if regressions:
+            print(f"\n❌ Регрессии ({thresholds}):\n" + "\n".join(regressions))
+            return 1
+        print(f"\n✅ Регрессий нет ({thresholds})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
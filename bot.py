@@ -1,11 +1,39 @@
-import os, logging, time, math
+import os, logging, time, math, asyncio, shutil, tempfile
+PROCESS_START = time.perf_counter()
+from collections import OrderedDict
 from fastapi import FastAPI, Request
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
+from fastapi.responses import JSONResponse
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent, InlineQueryResultsButton
+from telegram.error import BadRequest
+from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, InlineQueryHandler, filters, ContextTypes
 import httpx
 import uvicorn
-from image_map import find_images
-from calculator import full_calculate, format_result, SETUP_NAMES, ATR_LABELS
+from image_map import find_images, caption_setup, IMAGE_RULES
+from calculator import full_calculate, format_result, calc_F, SETUP_NAMES, SETUP_WINRATES, ATR_LABELS
+from grid import grid_report, grid_heatmap
+from portfolio import PortfolioStore, portfolio_risk, format_portfolio, account_missing, ACCOUNT_NAME_RE
+from backtest import partition, run_shard, merge, format_backtest, equity_chart, READ_ERRORS
+from optimizer import (
+    candidates, simulate_batch, split, pareto_front, format_front,
+    DEFAULT_TARGETS, DEFAULT_MAX_DD, DEFAULT_PATHS,
+)
+from broadcast import RecipientIndex, Broadcaster
+from assets import AssetStore, missing_rule_images, rule_paths
+from tracing import Tracer, format_trace
+from profiler import SamplingProfiler
+from lifecycle import Lifecycle, HTTP_GRACE
+from outbox import Outbox, BULK
+import webhook_filter
+from webhook_filter import ALLOWED_UPDATES, FilterStats
+from offload import Offloader, OffloadBusy, LoopLagMonitor, read_bytes, CPU_WORKERS
+import storage
+from storage import read_json, write_json
+from analytics import UsageAnalytics
+from intents import classify, extract_setup, IntentStats, LLM
+from calc_input import (
+    CALC_FIELDS, OPTIONAL_DEFAULTS, CalcDefaults, parse_calc_text, parse_number, clamp_profit,
+    looks_like_calc, missing_fields,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -18,10 +46,54 @@ MODEL             = os.getenv("MODEL", "anthropic/claude-3.5-haiku")
 ADMIN_IDS         = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()]
 WEBHOOK_URL       = os.environ["WEBHOOK_URL"]
 PORT              = int(os.getenv("PORT", "10000"))
+DATA_DIR          = os.getenv("DATA_DIR", "data")          # персистентные данные бота
 
 # Пользователи которым уже показали приветствие — не спамим повторно
 welcomed_users: set = set()
 
+# Сильные ссылки на фоновые задачи: цикл событий держит только слабые,
+# и без этого задачу может собрать GC посреди работы
+_background_tasks: set = set()
+
+
+def _background_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error("Фоновая задача %s упала", task.get_name(), exc_info=task.exception())
+
+
+def spawn(coro, name: str = None) -> asyncio.Task:
+    """Фоновая задача со ссылкой в _background_tasks и логированием ошибок."""
+    task = asyncio.create_task(coro, name=name)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_done)
+    return task
+
+
+# Блокирующие файлы и тяжёлые вычисления — мимо event loop
+offload = Offloader()
+loop_lag = LoopLagMonitor()
+
+# Все исходящие вызовы Bot API: очередь на чат, лимиты, RetryAfter, приоритеты
+outbox = Outbox()
+
+# Что webhook отсеял до построения Update
+webhook_stats = FilterStats()
+
+# Трассировка апдейтов (/trace) и семплирующий профайлер (/profile)
+tracer = Tracer()
+profiler = SamplingProfiler()
+
+# Типовые запросы отвечаются шаблоном без LLM — счётчики для /status
+intent_stats = IntentStats()
+
+# Журнал событий использования и агрегаты по часам/дням/сетапам (/stats)
+analytics = UsageAnalytics(os.path.join(DATA_DIR, "analytics"))
+
+# Все, кто когда-либо писал боту — получатели /broadcast
+recipients = RecipientIndex(os.path.join(DATA_DIR, "recipients.json"), run_io=offload.run_io)
+broadcaster = None
+
 CALC_HELP = """
 КАЛЬКУЛЯТОР РИСКА — ЛОГИКА И КОЭФФИЦИЕНТЫ:
 
@@ -81,13 +153,27 @@ SYSTEM_PROMPT_PREFIX = """Ты — опытный трейдинг-советн
 
 # ─── ЗАГРУЗКА СТРАТЕГИИ ────────────────────────────────────────────────────────
 
+# Распарсенный docx кэшируется на диске — рестарт не парсит документ заново
+STRATEGY_CACHE = ".cache/strategy.json"
+
+
 def load_strategy() -> str:
     if os.path.exists("strategy.docx"):
         try:
+            st = os.stat("strategy.docx")
+            stamp = f"{st.st_size}:{st.st_mtime_ns}"
+            cached = read_json(STRATEGY_CACHE, {})
+            if cached.get("stamp") == stamp:
+                logger.info(f"Стратегия из кэша ({len(cached['text'])} символов)")
+                return cached["text"]
             from docx import Document
             doc = Document("strategy.docx")
             text = "\n".join(p.text for p in doc.paragraphs if p.text.strip())
             logger.info(f"Стратегия загружена ({len(text)} символов)")
+            try:
+                write_json(STRATEGY_CACHE, {"stamp": stamp, "text": text})
+            except OSError as e:
+                logger.warning(f"Не удалось сохранить кэш стратегии: {e}")
             return text
         except Exception as e:
             logger.error(f"Ошибка чтения strategy.docx: {e}")
@@ -98,38 +184,97 @@ def load_strategy() -> str:
 
 strategy_text = load_strategy()
 
+# Общий пул соединений к OpenRouter — создаётся и прогревается при старте
+http_client: httpx.AsyncClient = None
+
+# ─── ИЗОБРАЖЕНИЯ ───────────────────────────────────────────────────────────────
+
+_missing_images = missing_rule_images(IMAGE_RULES)
+if _missing_images:
+    logger.error(f"Нет файлов из IMAGE_RULES: {_missing_images}")
+
+# Наполняется при старте (startup) — до этого картинки просто не отправляются
+asset_store = AssetStore(file_ids_path=os.path.join(DATA_DIR, "file_ids.json"))
+
 # ─── OPENROUTER ────────────────────────────────────────────────────────────────
 
 async def ask_openrouter(user_message: str, history: list) -> str:
     messages = [{"role": "system", "content": SYSTEM_PROMPT_PREFIX + strategy_text}]
     messages.extend(history[-10:])
     messages.append({"role": "user", "content": user_message})
-    async with httpx.AsyncClient(timeout=60) as client:
-        r = await client.post(
+    started = time.perf_counter()
+    try:
+        r = await http_client.post(
             "https://openrouter.ai/api/v1/chat/completions",
             headers={"Authorization": f"Bearer {OPENROUTER_KEY}", "Content-Type": "application/json"},
             json={"model": MODEL, "messages": messages, "max_tokens": 1024, "temperature": 0.7},
         )
         r.raise_for_status()
-        return r.json()["choices"][0]["message"]["content"]
+        data = r.json()
+    except Exception:
+        analytics.llm(started, ok=False)
+        raise
+    analytics.llm(started, data.get("usage"))
+    return data["choices"][0]["message"]["content"]
 
 # ─── ДОСТУП ────────────────────────────────────────────────────────────────────
 
-async def has_access(bot, user_id: int) -> bool:
-    """Проверка доступа к платному каналу."""
+# Кэш проверки доступа: user_id -> (время проверки, есть ли доступ).
+# Отказ кэшируем ненадолго — чтобы только что купивший получил доступ быстро.
+ACCESS_TTL = 300
+NO_ACCESS_TTL = 60
+_access_cache: dict = {}
+_access_refreshing: set = set()
+
+
+async def _check_access(bot, user_id: int):
+    """Запрос к Telegram. None — если проверить не удалось."""
     try:
-        member = await bot.get_chat_member(chat_id=CHANNEL_ID, user_id=user_id)
-        return member.status in ["member", "administrator", "creator"]
+        with tracer.span("access"):
+            member = await bot.get_chat_member(chat_id=CHANNEL_ID, user_id=user_id)
+        ok = member.status in ["member", "administrator", "creator"]
+        _access_cache[user_id] = (time.time(), ok)
+        return ok
     except Exception as e:
         logger.warning(f"Ошибка проверки платного {user_id}: {e}")
-        return False
+        return None
+
+
+def _access_fresh(user_id: int):
+    cached = _access_cache.get(user_id)
+    if cached is None:
+        return None
+    checked_at, ok = cached
+    return ok if time.time() - checked_at < (ACCESS_TTL if ok else NO_ACCESS_TTL) else None
+
+
+async def has_access(bot, user_id: int) -> bool:
+    """Проверка доступа к платному каналу."""
+    ok = _access_fresh(user_id)
+    if ok is not None:
+        return ok
+    return bool(await _check_access(bot, user_id))
+
+
+def has_access_nowait(bot, user_id: int):
+    """
+    Доступ без ожидания get_chat_member (для inline-режима): значение из кэша,
+    даже устаревшее, а проверка обновляется в фоне. None — пользователь ещё не проверялся.
+    """
+    if _access_fresh(user_id) is None and user_id not in _access_refreshing:
+        _access_refreshing.add(user_id)
+        task = spawn(_check_access(bot, user_id), name="access")
+        task.add_done_callback(lambda _: _access_refreshing.discard(user_id))
+    cached = _access_cache.get(user_id)
+    return cached[1] if cached else None
 
 async def has_public_subscription(bot, user_id: int) -> bool:
     """Проверка подписки на публичный канал (для получения Excel-файла).
     ВАЖНО: бот должен быть администратором публичного канала!
     """
     try:
-        member = await bot.get_chat_member(chat_id=PUBLIC_CHANNEL_ID, user_id=user_id)
+        with tracer.span("public_access"):
+            member = await bot.get_chat_member(chat_id=PUBLIC_CHANNEL_ID, user_id=user_id)
         return member.status in ["member", "administrator", "creator"]
     except Exception as e:
         logger.warning(f"Ошибка проверки публичного {user_id}: {e}")
@@ -142,6 +287,8 @@ async def has_public_subscription(bot, user_id: int) -> bool:
 
 user_histories: dict = {}
 calc_sessions: dict = {}
+calc_defaults = CalcDefaults(os.path.join(DATA_DIR, "calc_defaults.json"), run_io=offload.run_io)
+portfolios = PortfolioStore(os.path.join(DATA_DIR, "portfolios.json"), run_io=offload.run_io)
 user_rate: dict = {}
 
 def is_rate_limited(user_id: int) -> bool:
@@ -200,6 +347,7 @@ def kb_cf():
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
+    recipients.add(user.id)
     is_member = await has_access(context.bot, user.id)
     first_time = user.id not in welcomed_users
 
@@ -211,6 +359,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Задавай вопросы по стратегии — объясню любой сетап, помогу с входом, разберу ситуацию на рынке.\n\n"
             "📎 /calculator — Excel-файл с продвинутым риск-менеджментом\n"
             "📐 /calc — калькулятор риска прямо в боте\n"
+            "📊 /grid — сетка риска «что если»\n"
+            "🧭 /optimize — самые быстрые настройки риска без слива\n"
+            "💼 /portfolio — риск по всем твоим счетам сразу\n"
             "🛒 /buy — приобрести полную стратегию\n"
             "🔄 /clear — очистить историю"
         )
@@ -244,16 +395,105 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
 
 
+CALC_PROMPTS = {
+    "balance": ("Шаг 1/6: Введи текущий баланс (в $)\n_например: 48500_", None),
+    "initial": ("Шаг 2/6: Введи начальный депозит\n_например: 50000_", None),
+    "phase": ("Шаг 3/6: Выбери фазу:", kb_phase),
+    "setup": ("Шаг 4/6: Выбери номер сетапа:", kb_setup),
+    "atr": ("Шаг 5/6: ATR-фаза рынка прямо сейчас?", kb_atr),
+    "cf": ("Дополнительно: Твой текущий уровень уверенности?", kb_cf),
+    "cycle_day": ("Шаг 6/6: День цикла (1-13+)\n_Сколько дней прошло с начала текущего цикла? Обычно 1-13_", None),
+    "prev_profit": ("Шаг 6/6: Прибыль от предыдущей сделки (в $)\n_Если не было — введи 0_", None),
+}
+
+CALC_USAGE = (
+    "💡 Можно одной строкой:\n"
+    "`/calc 48500 50000 1ph 3 atr=1.0 cf=1.0 day=5 profit=0`\n"
+    "Баланс, депозит, фаза, сетап — остальное по умолчанию или из прошлого расчёта."
+)
+
+PHASE_NAMES = {"1ph": "Challenge", "2ph": "Verification", "funded": "Funded"}
+
+FIELD_LABELS = {
+    "balance": "баланс", "initial": "депозит", "phase": "фаза", "setup": "сетап",
+    "atr": "ATR", "cf": "CF", "cycle_day": "день цикла",
+}
+
+FIELD_ERRORS = {
+    "balance": "баланс", "initial": "депозит", "setup": "сетап (1-16)",
+    "atr": "ATR (0.5/0.7/1.0/1.2)", "cf": "CF (0-2)", "cycle_day": "день цикла (от 1)",
+}
+
+
+def format_number(v) -> str:
+    """1234567.5 → «1,234,567.5»: без экспоненты и лишних нулей."""
+    return f"{v:,.2f}".rstrip("0").rstrip(".")
+
+
+def calc_result_text(session: dict) -> str:
+    r = full_calculate(
+        balance=session["balance"],
+        initial=session["initial"],
+        phase=session["phase"],
+        setup=session["setup"],
+        atr=session.get("atr", OPTIONAL_DEFAULTS["atr"]),
+        cycle_day=session["cycle_day"],
+        cf=session.get("cf", OPTIONAL_DEFAULTS["cf"]),
+        prev_profit=session.get("prev_profit", OPTIONAL_DEFAULTS["prev_profit"]),
+    )
+    return format_result(r)
+
+
+async def calc_advance(message, uid: int, confirmed: str = ""):
+    """
+    Спрашивает следующее недостающее поле или, если всё есть, отдаёт расчёт.
+    confirmed — подтверждение только что введённого значения.
+    """
+    session = calc_sessions[uid]
+    missing = missing_fields(session, full=session.get("full", False))
+    if missing:
+        field = missing[0]
+        session["step"] = field
+        prompt, kb = CALC_PROMPTS[field]
+        await message.reply_text(
+            f"{confirmed}\n\n{prompt}" if confirmed else prompt,
+            parse_mode="Markdown",
+            reply_markup=kb() if kb else None,
+        )
+        return
+    del calc_sessions[uid]
+    calc_defaults.remember(uid, session)
+    analytics.calc({**OPTIONAL_DEFAULTS, **session})
+    result = calc_result_text(session)
+    await message.reply_text(f"{confirmed}\n\n{result}" if confirmed else result, parse_mode="Markdown")
+
+
+async def calc_one_shot(update: Update, fields: dict):
+    """Расчёт из разобранной строки; недостающее — из прошлых значений или мастером."""
+    uid = update.effective_user.id
+    session = {**calc_defaults.get(uid), **fields}
+    calc_sessions[uid] = session
+    known = [f"{FIELD_LABELS[k]} {format_number(v)}" if isinstance(v, (int, float)) else f"{FIELD_LABELS[k]} {v}"
+             for k, v in session.items() if k in FIELD_LABELS and k not in fields]
+    confirmed = f"ℹ️ Из прошлого расчёта: {', '.join(known)}" if known else ""
+    await calc_advance(update.message, uid, confirmed)
+
+
 async def calc_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await has_access(context.bot, update.effective_user.id):
         await update.message.reply_text(NO_ACCESS_MSG, parse_mode="HTML", reply_markup=NO_ACCESS_KB)
         return
-    calc_sessions[update.effective_user.id] = {"step": "balance"}
-    await update.message.reply_text(
-        "📐 *Калькулятор риска*\n\n"
-        "Шаг 1/6: Введи текущий баланс \\(в $\\)\n_например: 48500_",
-        parse_mode="MarkdownV2"
-    )
+    uid = update.effective_user.id
+    if context.args:
+        fields, errors, _ = parse_calc_text(" ".join(context.args))
+        if errors:
+            bad = ", ".join(FIELD_ERRORS.get(f, f) for f in errors)
+            await update.message.reply_text(f"⚠️ Не понял: {bad}\n\n{CALC_USAGE}", parse_mode="Markdown")
+            return
+        await calc_one_shot(update, fields)
+        return
+    calc_sessions[uid] = {"full": True}
+    await calc_advance(update.message, uid, f"📐 *Калькулятор риска*\n\n{CALC_USAGE}")
 
 
 async def handle_calc_session(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
@@ -261,77 +501,43 @@ async def handle_calc_session(update: Update, context: ContextTypes.DEFAULT_TYPE
     if uid not in calc_sessions:
         return False
     session = calc_sessions[uid]
-    text = update.message.text.strip().replace(",", ".")
+    text = update.message.text.strip()
     step = session["step"]
 
     if step == "balance":
         try:
-            val = float(text)
+            val = parse_number(text)
             if val <= 0: raise ValueError
             session["balance"] = val
-            session["step"] = "initial"
-            await update.message.reply_text(
-                f"✅ Баланс: ${val:,.0f}\n\nШаг 2/6: Введи начальный депозит\n_например: 50000_",
-                parse_mode="Markdown"
-            )
+            await calc_advance(update.message, uid, f"✅ Баланс: ${val:,.0f}")
         except ValueError:
             await update.message.reply_text("⚠️ Введи число, например: 48500")
         return True
 
     elif step == "initial":
         try:
-            val = float(text)
+            val = parse_number(text)
             if val <= 0: raise ValueError
             session["initial"] = val
-            session["step"] = "phase"
-            await update.message.reply_text(
-                f"✅ Депозит: ${val:,.0f}\n\nШаг 3/6: Выбери фазу:",
-                reply_markup=kb_phase()
-            )
+            await calc_advance(update.message, uid, f"✅ Депозит: ${val:,.0f}")
         except ValueError:
             await update.message.reply_text("⚠️ Введи число, например: 50000")
         return True
 
-    elif step == "cycle":
+    elif step == "cycle_day":
         try:
-            val = int(float(text))
+            val = int(parse_number(text))
             if val < 1: raise ValueError
             session["cycle_day"] = val
-            session["step"] = "prev_profit"
-            await update.message.reply_text(
-                f"✅ День цикла: {val}\n\n"
-                "Шаг 6/6: Прибыль от предыдущей сделки \\(в $\\)\n"
-                "_Если не было — введи 0_",
-                parse_mode="MarkdownV2"
-            )
+            await calc_advance(update.message, uid, f"✅ День цикла: {val}")
         except ValueError:
             await update.message.reply_text("⚠️ Введи число от 1 и выше")
         return True
 
     elif step == "prev_profit":
         try:
-            val = float(text)
-            session["prev_profit"] = max(0, val)
-            session["step"] = None
-
-            r = full_calculate(
-                balance=session["balance"],
-                initial=session["initial"],
-                phase=session["phase"],
-                setup=session["setup"],
-                atr=session["atr"],
-                cycle_day=session["cycle_day"],
-                cf=session["cf"],
-                prev_profit=session["prev_profit"],
-            )
-            del calc_sessions[uid]
-
-            # Форматируем баланс правильно
-            text_out = format_result(r).replace(
-                f"${r['U']/r['T']*100*r['T']/r['T']:.0f}",
-                f"${session['balance']:,.0f}"
-            )
-            await update.message.reply_text(text_out, parse_mode="Markdown")
+            session["prev_profit"] = clamp_profit(parse_number(text))
+            await calc_advance(update.message, uid)
         except ValueError:
             await update.message.reply_text("⚠️ Введи число (или 0)")
         return True
@@ -350,44 +556,25 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if uid not in calc_sessions:
         return
 
-    session = calc_sessions[uid]
-
     if data.startswith("c_phase_"):
         phase = data.replace("c_phase_", "")
-        session["phase"] = phase
-        session["step"] = "setup"
-        phase_names = {"1ph": "Challenge", "2ph": "Verification", "funded": "Funded"}
-        await query.message.reply_text(
-            f"✅ Фаза: {phase_names[phase]}\n\nШаг 4/6: Выбери номер сетапа:",
-            reply_markup=kb_setup()
-        )
+        calc_sessions[uid]["phase"] = phase
+        await calc_advance(query.message, uid, f"✅ Фаза: {PHASE_NAMES[phase]}")
 
     elif data.startswith("c_setup_"):
         setup = int(data.replace("c_setup_", ""))
-        session["setup"] = setup
-        session["step"] = "atr"
-        await query.message.reply_text(
-            f"✅ Сетап №{setup}: {SETUP_NAMES[setup]}\n\nШаг 5/6: ATR-фаза рынка прямо сейчас?",
-            reply_markup=kb_atr()
-        )
+        calc_sessions[uid]["setup"] = setup
+        await calc_advance(query.message, uid, f"✅ Сетап №{setup}: {SETUP_NAMES[setup]}")
 
     elif data.startswith("c_atr_"):
         atr = float(data.replace("c_atr_", ""))
-        session["atr"] = atr
-        session["step"] = "cf"
-        await query.message.reply_text(
-            f"✅ ATR: {ATR_LABELS[atr]}\n\nДополнительно: Твой текущий уровень уверенности?",
-            reply_markup=kb_cf()
-        )
+        calc_sessions[uid]["atr"] = atr
+        await calc_advance(query.message, uid, f"✅ ATR: {ATR_LABELS[atr]}")
 
     elif data.startswith("c_cf_"):
         cf = float(data.replace("c_cf_", ""))
-        session["cf"] = cf
-        session["step"] = "cycle"
-        await query.message.reply_text(
-            f"✅ CF: {cf}\n\nШаг 6/6: День цикла (1-13+)\n_Сколько дней прошло с начала текущего цикла? Обычно 1-13_",
-            parse_mode="Markdown"
-        )
+        calc_sessions[uid]["cf"] = cf
+        await calc_advance(query.message, uid, f"✅ CF: {cf}")
 
     elif data == "get_calculator":
         # Проверяем подписку и отправляем файл
@@ -399,9 +586,10 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.message.reply_text("⚠️ Файл не найден. Обратись к администратору.")
             return
         await query.answer()
-        with open(calc_path, "rb") as f:
+        data = await offload.run_io(read_bytes, calc_path)
+        with tracer.span("upload_document"):
             await query.message.reply_document(
-                document=f,
+                document=data,
                 filename="Seiltanzer_Risk_Management.xlsx",
                 caption=(
                     "📊 *Excel-файл с продвинутым риск-менеджментом*\n\n"
@@ -413,25 +601,432 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         import asyncio
         await asyncio.sleep(1)
-        await query.message.reply_text(PROMO_TEXT, parse_mode="Markdown", reply_markup=PROMO_KB)
+        await context.bot.send_message(
+            chat_id=query.message.chat_id, text=PROMO_TEXT, parse_mode="Markdown",
+            reply_markup=PROMO_KB, rate_limit_args=BULK,
+        )
+
+
+# ─── INLINE-РЕЖИМ ──────────────────────────────────────────────────────────────
+# @bot 48500 50000 1ph 3 — варианты расчёта для всех ATR-состояний сразу.
+# Требует включённого inline-режима у бота (@BotFather → /setinline).
+
+INLINE_DEBOUNCE = 0.3        # ждём, пока пользователь допечатает
+INLINE_CACHE_SIZE = 1024
+# День цикла в inline не спрашиваем: без сохранённого day= считаем с первого дня
+INLINE_DEFAULTS = {"cycle_day": 1}
+_inline_cache: OrderedDict = OrderedDict()
+_inline_latest: dict = {}     # user_id -> id последнего inline-запроса
+
+
+def inline_key(fields: dict) -> tuple:
+    """Нормализованный ключ запроса: одинаковые параметры в любом порядке и записи."""
+    return tuple((f, fields.get(f)) for f in CALC_FIELDS)
+
+
+def inline_fields(uid: int, text: str):
+    """Поля inline-запроса с сохранёнными значениями и INLINE_DEFAULTS; None — запрос неполный."""
+    fields, errors, _ = parse_calc_text(text)
+    fields = {**INLINE_DEFAULTS, **calc_defaults.get(uid), **fields}
+    if errors or missing_fields(fields):
+        return None
+    return fields
+
+
+def inline_variants(fields: dict) -> list:
+    """
+    Расчёт для всех ATR одним пакетом. Выбранный пользователем ATR — первым.
+    Результат кэшируется по нормализованному ключу (LRU).
+    """
+    key = inline_key(fields)
+    cached = _inline_cache.get(key)
+    if cached is not None:
+        _inline_cache.move_to_end(key)
+        return cached
+
+    chosen = fields.get("atr", OPTIONAL_DEFAULTS["atr"])
+    variants = []
+    for atr in sorted(ATR_LABELS, key=lambda a: (a != chosen, -a)):
+        session = {**fields, "atr": atr}
+        r = full_calculate(
+            balance=session["balance"], initial=session["initial"], phase=session["phase"],
+            setup=session["setup"], atr=atr, cycle_day=session["cycle_day"],
+            cf=session.get("cf", OPTIONAL_DEFAULTS["cf"]),
+            prev_profit=session.get("prev_profit", OPTIONAL_DEFAULTS["prev_profit"]),
+        )
+        variants.append((
+            str(atr),
+            f"{ATR_LABELS[atr]}: {r['T']:.2f}% = ${r['U']:.2f}",
+            f"Сетап №{r['setup']} | {r['phase']} | баланс {r['F']}% | входов {r['V']}",
+            format_result(r),
+        ))
+
+    _inline_cache[key] = variants
+    if len(_inline_cache) > INLINE_CACHE_SIZE:
+        _inline_cache.popitem(last=False)
+    return variants
+
+
+async def handle_inline(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query
+    uid = query.from_user.id
+
+    access = has_access_nowait(context.bot, uid)
+    if not access:
+        await query.answer([], cache_time=0, is_personal=True, button=InlineQueryResultsButton(
+            "🔒 Проверить доступ в боте" if access is None else "🔒 Доступ закрыт — открыть бота",
+            start_parameter="inline",
+        ))
+        return
+
+    fields = inline_fields(uid, query.query)
+    if fields is None:
+        await query.answer([], cache_time=0, is_personal=True, button=InlineQueryResultsButton(
+            "Формат: баланс депозит фаза сетап", start_parameter="calc",
+        ))
+        return
+
+    if inline_key(fields) not in _inline_cache:
+        # Дебаунс: на каждый символ приходит новый запрос — отвечаем только на последний
+        _inline_latest[uid] = query.id
+        await asyncio.sleep(INLINE_DEBOUNCE)
+        if _inline_latest.get(uid) != query.id:
+            return
+        _inline_latest.pop(uid, None)
+
+    results = [
+        InlineQueryResultArticle(
+            id=rid, title=title, description=description,
+            input_message_content=InputTextMessageContent(text, parse_mode="Markdown"),
+        )
+        for rid, title, description, text in inline_variants(fields)
+    ]
+    await query.answer(results, cache_time=300, is_personal=True)
+
+
+GRID_USAGE = (
+    "📊 *Сетка чувствительности риска*\n\n"
+    "`/grid 50000 1ph 3` — баланс% × день цикла\n"
+    "`/grid 50000 1ph 3 atr 48500` — ATR × CF при балансе 48500\n\n"
+    "Опции: `atr=1.2 cf=0.7 day=5 profit=0 img`\n"
+    "Аргументы: депозит, фаза (1ph/2ph/funded), сетап (1-16)"
+)
+
+
+# Опции, которые каждый режим сетки не использует: в "atr" ATR и CF — оси таблицы,
+# в "day" день цикла — ось таблицы
+GRID_UNUSED_OPTS = {"atr": ("atr", "cf"), "day": ("day",)}
+GRID_OPTS = ("atr", "cf", "day", "profit")
+
+
+def parse_grid_args(args: list) -> dict:
+    """
+    Разбирает аргументы /grid. Бросает ValueError при ошибке.
+    В "ignored" — аргументы, которые режим не использует: о них сообщаем, а не молча теряем.
+    """
+    positional = [a for a in args if "=" not in a and a.lower() not in ("img", "atr", "day")]
+    opts = dict(a.lower().split("=", 1) for a in args if "=" in a)
+    flags = {a.lower() for a in args if "=" not in a}
+    if len(positional) < 3:
+        raise ValueError
+    initial = parse_number(positional[0])
+    phase = positional[1].lower()
+    setup = int(positional[2])
+    if initial <= 0 or phase not in ("1ph", "2ph", "funded") or setup not in SETUP_NAMES:
+        raise ValueError
+    mode = "atr" if "atr" in flags else "day"
+    balance = parse_number(positional[3]) if mode == "atr" and len(positional) > 3 else initial
+    atr = parse_number(opts.get("atr", "1"))
+    cf = parse_number(opts.get("cf", "1"))
+    if atr not in ATR_LABELS or balance <= 0 or cf <= 0:
+        raise ValueError
+
+    ignored = positional[4:] if mode == "atr" else positional[3:]
+    ignored += [f"{k}={v}" for k, v in opts.items() if k not in GRID_OPTS or k in GRID_UNUSED_OPTS[mode]]
+    return {
+        "mode": mode,
+        "initial": initial,
+        "phase": phase,
+        "setup": setup,
+        "balance": balance if mode == "atr" else 0.0,
+        "cycle_day": max(1, int(parse_number(opts.get("day", "1")))) if mode == "atr" else 1,
+        "atr": atr,
+        "cf": cf,
+        "prev_profit": clamp_profit(parse_number(opts.get("profit", "0"))),
+        "img": "img" in flags,
+        "ignored": ignored,
+    }
+
+
+# PNG тепловых карт по параметрам запроса. Рендер идёт в дочернем процессе,
+# и lru_cache grid_heatmap живёт там же — кэшируем результат здесь, в боте
+HEATMAP_CACHE_SIZE = 64
+_heatmap_cache: OrderedDict = OrderedDict()
+
+
+async def grid_heatmap_png(params: dict):
+    """PNG тепловой карты (None — нет matplotlib). Повторный запрос — из кэша."""
+    key = tuple(sorted(params.items()))
+    png = _heatmap_cache.get(key)
+    if png is not None:
+        _heatmap_cache.move_to_end(key)
+        return png
+    png = await offload.run_cpu(grid_heatmap, **params)
+    if png is not None:
+        _heatmap_cache[key] = png
+        if len(_heatmap_cache) > HEATMAP_CACHE_SIZE:
+            _heatmap_cache.popitem(last=False)
+    return png
+
+
+async def grid_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await has_access(context.bot, update.effective_user.id):
+        await update.message.reply_text(NO_ACCESS_MSG, parse_mode="HTML", reply_markup=NO_ACCESS_KB)
+        return
+    try:
+        params = parse_grid_args(context.args or [])
+    except ValueError:
+        await update.message.reply_text(GRID_USAGE, parse_mode="Markdown")
+        return
+    img = params.pop("img")
+    ignored = params.pop("ignored")
+    shown = " ".join(ignored).replace("`", "'")
+    note = f"ℹ️ Не учтено в этом режиме: `{shown}`\n" if ignored else ""
+    await update.message.reply_text(f"{note}```\n{grid_report(**params)}\n```", parse_mode="Markdown")
+    if img:
+        # Рендер matplotlib тяжёлый — в пул процессов
+        try:
+            png = await grid_heatmap_png(params)
+        except OffloadBusy:
+            await update.message.reply_text("⏳ Сервер занят, попробуй тепловую карту через минуту.")
+            return
+        if png is None:
+            await update.message.reply_text("⚠️ Тепловая карта недоступна (нет matplotlib).")
+        else:
+            await update.message.reply_photo(photo=png)
+
+
+# ─── ПОРТФЕЛЬ СЧЕТОВ ──────────────────────────────────────────────────────────
+
+PORTFOLIO_USAGE = (
+    "💼 *Портфель счетов*\n\n"
+    "`/portfolio` — риск по всем счетам и общая экспозиция\n"
+    "`/portfolio set ftmo1 48500 50000 1ph 3` — добавить счёт\n"
+    "`/portfolio set ftmo1 balance=49200` — обновить поля счёта\n"
+    "`/portfolio del ftmo1` — удалить счёт\n"
+    "`/portfolio clear` — удалить все\n\n"
+    "Параметры как у /calc: баланс, депозит, фаза, сетап, `atr=` `cf=` `day=`"
+)
+
+
+async def portfolio_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = update.effective_user.id
+    if not await has_access(context.bot, uid):
+        await update.message.reply_text(NO_ACCESS_MSG, parse_mode="HTML", reply_markup=NO_ACCESS_KB)
+        return
+    args = context.args or []
+    sub = args[0].lower() if args else ""
+
+    if sub in ("set", "add") and len(args) >= 3 and ACCOUNT_NAME_RE.fullmatch(args[1]):
+        name = args[1]
+        fields, errors, _ = parse_calc_text(" ".join(args[2:]))
+        account = {**portfolios.get(uid).get(name, {}), **fields}
+        missing = account_missing(account)
+        if errors or missing:
+            bad = ", ".join([FIELD_ERRORS.get(f, f) for f in errors] + [FIELD_LABELS[f] for f in missing])
+            await update.message.reply_text(f"⚠️ Не хватает или неверно: {bad}\n\n{PORTFOLIO_USAGE}", parse_mode="Markdown")
+            return
+        try:
+            portfolios.upsert(uid, name, fields)
+        except ValueError as e:
+            await update.message.reply_text(f"⚠️ Счёт не добавлен: {e}")
+            return
+    elif sub == "del" and len(args) == 2:
+        if not portfolios.remove(uid, args[1]):
+            await update.message.reply_text(f"⚠️ Счёта {args[1]} нет в портфеле.")
+            return
+    elif sub == "clear":
+        portfolios.remove(uid)
+        await update.message.reply_text("🔄 Портфель очищен.")
+        return
+    elif sub:
+        await update.message.reply_text(PORTFOLIO_USAGE, parse_mode="Markdown")
+        return
+
+    accounts = portfolios.get(uid)
+    if not accounts:
+        await update.message.reply_text(PORTFOLIO_USAGE, parse_mode="Markdown")
+        return
+    rows, recomputed = portfolio_risk(accounts)
+    await update.message.reply_text(format_portfolio(rows, recomputed), parse_mode="Markdown")
+
+
+# ─── ОПТИМИЗАТОР РИСКА ─────────────────────────────────────────────────────────
+
+OPTIMIZE_USAGE = (
+    "🧭 *Оптимизатор риска*\n\n"
+    "`/optimize 48500 50000 1ph 3` — баланс, депозит, фаза, сетап\n\n"
+    "Перебирает CF × ATR × день цикла и симулирует сделки по формулам калькулятора. "
+    "Показывает фронт Парето: сколько сделок до цели против вероятности слива.\n\n"
+    "Опции: `target=108` (цель, % депозита), `dd=10` (лимит просадки, %), `ruin=5` (допустимый слив, %)"
+)
+OPTIMIZE_CACHE_SIZE = 128
+_optimize_cache: OrderedDict = OrderedDict()
+
+
+def parse_optimize_args(args: list) -> dict:
+    """Разбирает аргументы /optimize. Бросает ValueError при ошибке."""
+    positional = [a for a in args if "=" not in a]
+    opts = dict(a.lower().split("=", 1) for a in args if "=" in a)
+    if len(positional) < 4:
+        raise ValueError
+    balance = float(positional[0].replace(",", "."))
+    initial = float(positional[1].replace(",", "."))
+    phase = positional[2].lower()
+    setup = int(positional[3])
+    if balance <= 0 or initial <= 0 or phase not in DEFAULT_TARGETS or setup not in SETUP_NAMES:
+        raise ValueError
+    target = float(opts.get("target", DEFAULT_TARGETS[phase]))
+    max_dd = float(opts.get("dd", DEFAULT_MAX_DD))
+    max_ruin = float(opts.get("ruin", 5)) / 100
+    if not 0 < max_dd < 100 or target <= calc_F(balance, initial) or not 0 <= max_ruin <= 1:
+        raise ValueError
+    if balance <= initial * (100 - max_dd) / 100:
+        raise ValueError
+    return {
+        # Баланс округляем до доллара — ключ кэша не дробится на центы
+        "balance": float(round(balance)),
+        "initial": initial,
+        "phase": phase,
+        "setup": setup,
+        "target": target,
+        "max_dd": max_dd,
+        "max_ruin": max_ruin,
+    }
+
+
+async def optimize_front(balance, initial, phase, setup, target, max_dd) -> list:
+    """
+    Фронт Парето для параметров (LRU-кэш). Комбинации делятся на пачки
+    по числу процессов пула и симулируются параллельно.
+    """
+    key = (balance, initial, phase, setup, target, max_dd)
+    cached = _optimize_cache.get(key)
+    if cached is not None:
+        _optimize_cache.move_to_end(key)
+        return cached
+
+    batches = split(candidates(), CPU_WORKERS)
+    with tracer.span("optimize"):
+        parts = await asyncio.gather(*(
+            offload.run_cpu(simulate_batch, batch, balance, initial, phase, setup, target, max_dd=max_dd)
+            for batch in batches
+        ))
+    front = pareto_front([r for part in parts for r in part])
+
+    _optimize_cache[key] = front
+    if len(_optimize_cache) > OPTIMIZE_CACHE_SIZE:
+        _optimize_cache.popitem(last=False)
+    return front
+
+
+async def optimize_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await has_access(context.bot, update.effective_user.id):
+        await update.message.reply_text(NO_ACCESS_MSG, parse_mode="HTML", reply_markup=NO_ACCESS_KB)
+        return
+    try:
+        params = parse_optimize_args(context.args or [])
+    except ValueError:
+        await update.message.reply_text(OPTIMIZE_USAGE, parse_mode="Markdown")
+        return
+    max_ruin = params.pop("max_ruin")
+
+    if tuple(params.values()) not in _optimize_cache:
+        # Промах кэша — секунды CPU, ограничиваем как вопросы к AI
+        if is_rate_limited(update.effective_user.id):
+            await update.message.reply_text("⏳ Слишком много запросов. Подожди минуту.")
+            return
+        await update.message.reply_text("⏳ Симулирую варианты, несколько секунд...")
+    try:
+        front = await optimize_front(**params)
+    except OffloadBusy:
+        await update.message.reply_text("⏳ Сервер занят, попробуй через минуту.")
+        return
+    await update.message.reply_text(
+        format_front(front, params["setup"], params["phase"], params["target"], params["max_dd"],
+                     max_ruin, DEFAULT_PATHS),
+        parse_mode="Markdown",
+    )
 
 
 async def send_relevant_images(update: Update, combined_text: str):
-    images = find_images(combined_text)
+    with tracer.span("find_images"):
+        images = find_images(combined_text)
+    analytics.images(sorted({n for n in (caption_setup(c) for _, c in images) if n is not None}))
     sent = set()
     for img_path, caption in images:
-        if img_path in sent: continue
-        sent.add(img_path)
-        if os.path.exists(img_path):
-            try:
-                with open(img_path, "rb") as f:
-                    await update.message.reply_photo(photo=f, caption=f"📊 {caption}")
-            except Exception as e:
-                logger.warning(f"Не удалось отправить {img_path}: {e}")
+        # Дедуп по содержимому: одна картинка под разными именами — одна отправка
+        key = asset_store.key(img_path)
+        if key is None or key in sent: continue
+        sent.add(key)
+        file_id = asset_store.file_id(img_path)
+        try:
+            with tracer.span("upload_photo" if not file_id else "send_photo"):
+                msg = await update.message.reply_photo(
+                    photo=file_id or asset_store.get(img_path), caption=f"📊 {caption}"
+                )
+            if not file_id and msg.photo:
+                asset_store.remember_file_id(img_path, msg.photo[-1].file_id)
+        except Exception as e:
+            if file_id:
+                asset_store.forget_file_id(img_path)
+            logger.warning(f"Не удалось отправить {img_path}: {e}")
+
+
+# ─── ЛОКАЛЬНЫЕ ОТВЕТЫ ─────────────────────────────────────────────────────────
+
+def setup_card(n: int) -> str:
+    return f"📐 *Сетап {n}* — {SETUP_NAMES[n]}\nВинрейт: *{SETUP_WINRATES[n]:.0%}*"
+
+
+def winrate_text(setup=None) -> str:
+    if setup is not None:
+        return setup_card(setup)
+    lines = ["🎯 *Винрейт сетапов:*\n"]
+    for n, name in SETUP_NAMES.items():
+        lines.append(f"{n}. {name} — *{SETUP_WINRATES[n]:.0%}*")
+    return "\n".join(lines)
+
+
+def setups_list_text() -> str:
+    lines = [f"📐 *Сетапы стратегии ({len(SETUP_NAMES)}):*\n"]
+    lines += [f"{n}. {name}" for n, name in SETUP_NAMES.items()]
+    lines.append("\nНапиши «покажи сетап N» — пришлю схемы.")
+    return "\n".join(lines)
+
+
+async def answer_locally(update: Update, context: ContextTypes.DEFAULT_TYPE, intent: str, slots: dict):
+    """Шаблонный ответ на распознанное намерение — без вызова LLM."""
+    if intent == "calculator_file":
+        await send_calculator(update, context)
+    elif intent == "buy":
+        await buy_command(update, context)
+    elif intent == "winrate":
+        await update.message.reply_text(winrate_text(slots.get("setup")), parse_mode="Markdown")
+    elif intent == "list_setups":
+        await update.message.reply_text(setups_list_text(), parse_mode="Markdown")
+    elif intent == "show_setup":
+        n = slots["setup"]
+        await update.message.reply_text(
+            setup_card(n) + "\n\nЗадай вопрос по сетапу — разберу подробно.", parse_mode="Markdown"
+        )
+        await send_relevant_images(update, f"сетап {n}")
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    started = time.perf_counter()
     user = update.effective_user
+    recipients.add(user.id)
 
     if not await has_access(context.bot, user.id):
         await update.message.reply_text(NO_ACCESS_MSG, parse_mode="HTML", reply_markup=NO_ACCESS_KB)
@@ -443,10 +1038,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if await handle_calc_session(update, context):
         return
 
-    # Триггер на запрос калькулятора / файла
-    text_lower = user_text.lower()
-    if any(kw in text_lower for kw in CALCULATOR_KEYWORDS):
-        await send_calculator(update, context)
+    # Расчёт свободным текстом: "48500 50000 1ph сетап 3"
+    if looks_like_calc(user_text):
+        await calc_one_shot(update, parse_calc_text(user_text)[0])
         return
 
     if len(user_text) > 1000:
@@ -457,13 +1051,24 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("⏳ Слишком много запросов. Подожди минуту.")
         return
 
+    # Файл, покупка, винрейты, схемы сетапов — шаблоном, без LLM
+    with tracer.span("intent"):
+        intent, slots = classify(user_text)
+    analytics.question(intent, slots.get("setup") or extract_setup(user_text))
+    if intent != LLM:
+        await answer_locally(update, context, intent, slots)
+        intent_stats.record(intent, started)
+        return
+
     if user.id not in user_histories:
         user_histories[user.id] = []
 
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+    with tracer.span("chat_action"):
+        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
 
     try:
-        reply = await ask_openrouter(user_text, user_histories[user.id])
+        with tracer.span("llm"):
+            reply = await ask_openrouter(user_text, user_histories[user.id])
         user_histories[user.id].extend([
             {"role": "user", "content": user_text},
             {"role": "assistant", "content": reply}
@@ -471,8 +1076,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if len(user_histories[user.id]) > 20:
             user_histories[user.id] = user_histories[user.id][-20:]
 
-        await update.message.reply_text(reply)
+        with tracer.span("reply"):
+            await update.message.reply_text(reply)
         await send_relevant_images(update, user_text + " " + reply)
+        intent_stats.record(LLM, started)
 
     except Exception as e:
         logger.error(f"OpenRouter error: {e}")
@@ -510,14 +1117,6 @@ RETURNING_KB = InlineKeyboardMarkup([[
     InlineKeyboardButton("🚀 Купить полную стратегию", url="https://t.me/tribute/app?startapp=sOg4")
 ]])
 
-CALCULATOR_KEYWORDS = [
-    "калькулятор", "excel", "эксель", "таблиц", "xlsx",
-    "скачать файл", "дай файл", "отправь файл", "хочу файл",
-    "получить файл", "бесплатно", "подарок", "скачать калькулятор",
-    "файл", "риск менеджмент", "риск-менеджмент", "файл с риском",
-    "продвинутый риск", "хочу файл", "дайте файл"
-]
-
 async def send_calculator(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отправляет Excel-файл с риск-менеджментом. Требует подписку на публичный канал."""
     uid = update.effective_user.id
@@ -539,9 +1138,10 @@ async def send_calculator(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     await update.message.reply_text("📎 Отправляю калькулятор риска...")
-    with open(calc_path, "rb") as f:
+    data = await offload.run_io(read_bytes, calc_path)
+    with tracer.span("upload_document"):
         await update.message.reply_document(
-            document=f,
+            document=data,
             filename="Seiltanzer_Risk_Calculator.xlsx",
             caption=(
                 "📊 *Калькулятор риска по стратегии @SeiltanzerFX*\n\n"
@@ -555,7 +1155,10 @@ async def send_calculator(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Пауза и реклама
     import asyncio
     await asyncio.sleep(1)
-    await update.message.reply_text(PROMO_TEXT, parse_mode="Markdown", reply_markup=PROMO_KB)
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id, text=PROMO_TEXT, parse_mode="Markdown",
+        reply_markup=PROMO_KB, rate_limit_args=BULK,
+    )
 
 
 async def buy_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -592,54 +1195,391 @@ async def reload_strategy(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("⛔ Только для администраторов.")
         return
     old = len(strategy_text)
-    strategy_text = load_strategy()
+    # Парсинг docx — сотни миллисекунд CPU, в пул процессов
+    strategy_text = await offload.run_cpu(load_strategy)
     await update.message.reply_text(f"✅ Обновлено! {old} → {len(strategy_text)} символов")
 
 
 async def status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if ADMIN_IDS and update.effective_user.id not in ADMIN_IDS: return
     src = "strategy.docx" if os.path.exists("strategy.docx") else "strategy.txt" if os.path.exists("strategy.txt") else "❌"
-    await update.message.reply_text(f"📊 {src}\nМодель: {MODEL}\nСимволов: {len(strategy_text)}")
+    lc = lifecycle.stats()
+    await update.message.reply_text(
+        f"📊 {src}\nМодель: {MODEL}\nСимволов: {len(strategy_text)}\n"
+        f"Старт за {lc['time_to_ready']} с | апдейтов: {lc['accepted']} | "
+        f"в работе: {lc['inflight']} | отклонено: {lc['rejected']} | брошено: {lc['dropped']}\n"
+        f"Loop lag: {loop_lag.stats()}\nOffload: {offload.stats()}\n{outbox.format_stats()}\n{webhook_stats.summary()}\n{intent_stats.summary()}\n"
+        f"Аналитика: {analytics.stats()}"
+    )
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if ADMIN_IDS and update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Только для администраторов.")
+        return
+    days = 7
+    if context.args:
+        try:
+            days = max(1, min(int(context.args[0]), 90))
+        except ValueError:
+            await update.message.reply_text("Использование: /stats [дней] — например /stats 30")
+            return
+    await update.message.reply_text(analytics.summary(days), parse_mode="Markdown")
+
+BACKTEST_USAGE = (
+    "📈 Бэктест правил риска на истории сделок:\n\n"
+    "Пришли CSV (или Parquet) документом с подписью\n"
+    "/backtest [депозит] [фаза] — например /backtest 100000 2ph\n\n"
+    "Колонки: account,date,setup,outcome,rr (account и date — необязательно)"
+)
+BACKTEST_MAX_BYTES = 20 * 1024 * 1024   # лимит скачивания файлов Bot API
+
+
+async def backtest_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if ADMIN_IDS and update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Только для администраторов.")
+        return
+    doc = update.message.document
+    if doc is None:
+        await update.message.reply_text(BACKTEST_USAGE)
+        return
+    args = (update.message.caption or "").split()[1:]
+    try:
+        initial = float(args[0]) if args else 50000.0
+        phase = args[1].lower() if len(args) > 1 else "1ph"
+        if initial <= 0 or phase not in ("1ph", "2ph", "funded"):
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text(BACKTEST_USAGE)
+        return
+    name = (doc.file_name or "").lower()
+    if not name.endswith((".csv", ".parquet")) or (doc.file_size or 0) > BACKTEST_MAX_BYTES:
+        await update.message.reply_text("⚠️ Нужен .csv или .parquet до 20 МБ.")
+        return
+
+    # Свой каталог на каждую загрузку: параллельные бэктесты не перетирают файлы
+    base = os.path.join(DATA_DIR, "backtest")
+    os.makedirs(base, exist_ok=True)
+    work = tempfile.mkdtemp(prefix=f"{update.effective_user.id}-", dir=base)
+    try:
+        path = os.path.join(work, "trades" + os.path.splitext(name)[1])
+        await (await doc.get_file()).download_to_drive(path)
+        await update.message.reply_text("⏳ Считаю бэктест...")
+        # Лог разбирается один раз, шарды по счетам считаются параллельно
+        split = await offload.run_cpu(partition, path, CPU_WORKERS, work)
+        parts = await asyncio.gather(*(
+            offload.run_cpu(run_shard, shard, initial=initial, phase=phase) for shard in split["shards"]
+        ))
+    except OffloadBusy:
+        await update.message.reply_text("⏳ Сервер занят, попробуй через минуту.")
+        return
+    except READ_ERRORS as e:
+        await update.message.reply_text(f"⚠️ Не удалось прочитать лог: {e}")
+        return
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    result = merge(parts, split["rows"], split["skipped"])
+    await update.message.reply_text(format_backtest(result, initial), parse_mode="Markdown")
+    if result["accounts"]:
+        png = await offload.run_cpu(equity_chart, result)
+        if png is not None:
+            await update.message.reply_photo(photo=png)
+
+
+BROADCAST_USAGE = (
+    "📣 Рассылка всем пользователям бота:\n\n"
+    "/broadcast <текст> — разослать текст (Markdown)\n"
+    "/broadcast promo — разослать промо стратегии\n"
+    "/broadcast status — прогресс\n"
+    "/broadcast cancel — отменить"
+)
+
+
+async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Рассылка всем — только явно заданным админам, даже если ADMIN_IDS пуст
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Только для администраторов.")
+        return
+    args = context.args or []
+    sub = args[0].lower() if args else ""
+
+    if not sub:
+        await update.message.reply_text(BROADCAST_USAGE)
+        return
+    if sub == "status":
+        await update.message.reply_text(broadcaster.format_progress())
+        return
+    if sub == "cancel":
+        await broadcaster.cancel()
+        await update.message.reply_text("🛑 Рассылка отменена.")
+        return
+
+    admin_chat = update.effective_chat.id
+    if sub == "promo" and len(args) == 1:
+        started = broadcaster.start(PROMO_TEXT, parse_mode="Markdown", reply_markup=PROMO_KB, report_to=admin_chat)
+    else:
+        # Берём текст как есть, сохраняя переносы строк
+        text = update.message.text.split(maxsplit=1)[1]
+        # Превью админу — заодно проверка разметки до отправки всем
+        try:
+            await update.message.reply_text(text, parse_mode="Markdown")
+        except BadRequest as e:
+            await update.message.reply_text(f"⚠️ Telegram не принял разметку: {e}\nРассылка не запущена.")
+            return
+        started = broadcaster.start(text, parse_mode="Markdown", report_to=admin_chat)
+    if not started:
+        await update.message.reply_text("⚠️ Рассылка уже идёт.\n\n" + broadcaster.format_progress())
+        return
+    await update.message.reply_text(f"📣 Рассылка запущена: {len(recipients)} получателей.\n/broadcast status — прогресс")
+
+# ─── ПРОФИЛИРОВАНИЕ И ТРАССИРОВКА ─────────────────────────────────────────────
+
+PROFILE_MAX_SECONDS = 120
+
+
+def update_kind(update: Update) -> str:
+    if update.inline_query:
+        return "inline"
+    if update.callback_query:
+        return "callback"
+    if update.message and update.message.text and update.message.text.startswith("/"):
+        return "command"
+    return "message"
+
+
+async def _profile_and_report(message, seconds: int):
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.stop()
+    await message.reply_text(profiler.format_top())
+    await message.reply_document(
+        document=profiler.collapsed().encode("utf-8"),
+        filename=f"profile-{time.strftime('%Y%m%d-%H%M%S')}.collapsed.txt",
+        caption="Формат collapsed stacks — открывается в speedscope.app или flamegraph.pl",
+    )
+
+
+async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if ADMIN_IDS and update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Только для администраторов.")
+        return
+    if profiler.running:
+        await update.message.reply_text("⏳ Профилирование уже идёт.")
+        return
+    try:
+        seconds = int(context.args[0]) if context.args else 10
+        if not 1 <= seconds <= PROFILE_MAX_SECONDS: raise ValueError
+    except ValueError:
+        await update.message.reply_text(f"⚠️ /profile <секунды>, от 1 до {PROFILE_MAX_SECONDS}")
+        return
+    await update.message.reply_text(f"🔬 Профилирую {seconds} с...")
+    # В фоне — чтобы не держать webhook-запрос открытым всё это время
+    spawn(_profile_and_report(update.message, seconds), name="profile")
+
+
+async def trace_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if ADMIN_IDS and update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Только для администраторов.")
+        return
+    arg = context.args[0].lower() if context.args else ""
+
+    if arg in ("on", "off"):
+        tracer.enabled = arg == "on"
+        await update.message.reply_text(f"🧵 Трассировка {'включена' if tracer.enabled else 'выключена'}.")
+        return
+
+    if arg:
+        try:
+            traces = tracer.for_user(int(arg))
+        except ValueError:
+            await update.message.reply_text("⚠️ /trace on|off|<user_id>")
+            return
+    else:
+        traces = tracer.recent()
+
+    header = f"🧵 Трассировка: {'вкл' if tracer.enabled else 'выкл'} | в буфере {len(tracer.traces)}"
+    stats = tracer.span_stats()
+    if stats and not arg:
+        header += "\n" + "\n".join(
+            f"  {name:<14} n={n:<4} ср {avg:7.1f} мс  макс {peak:7.1f} мс"
+            for name, (n, avg, peak) in sorted(stats.items(), key=lambda kv: -kv[1][1])
+        )
+    body = "\n\n".join(format_trace(t) for t in traces) or "Трасс нет."
+    await update.message.reply_text(f"{header}\n\n{body}"[:4000])
 
 # ─── FASTAPI + WEBHOOK ─────────────────────────────────────────────────────────
 app = FastAPI()
 application = None
+lifecycle = Lifecycle(PROCESS_START)
+
+# Незавершённые диалоги переживают рестарт
+# Переживает деплой только на постоянном диске (render.yaml: disk, DATA_DIR):
+# старый инстанс пишет файл по SIGTERM, новый стартует уже после и читает его
+STATE_PATH = os.path.join(DATA_DIR, "state.json")
+
+
+def save_state():
+    write_json(STATE_PATH, {
+        "calc_sessions": calc_sessions,
+        "user_histories": user_histories,
+        "welcomed_users": sorted(welcomed_users),
+    })
+
+
+def restore_state():
+    state = read_json(STATE_PATH, {})
+    calc_sessions.update({int(k): v for k, v in state.get("calc_sessions", {}).items()})
+    user_histories.update({int(k): v for k, v in state.get("user_histories", {}).items()})
+    welcomed_users.update(state.get("welcomed_users", []))
+    if state:
+        logger.info(f"Восстановлено: {len(calc_sessions)} сессий калькулятора, {len(user_histories)} историй")
+
+
+async def warm_http_client():
+    """Открывает TLS-соединение к OpenRouter заранее, чтобы первый вопрос не ждал рукопожатия."""
+    try:
+        await http_client.head("https://openrouter.ai/api/v1/models", timeout=5)
+    except Exception as e:
+        logger.warning(f"Прогрев соединения с OpenRouter не удался: {e}")
+
 
 @app.get("/")
 async def root():
     return {"status": "ok"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness для Render: 200 только когда кэши прогреты и нет остановки."""
+    return JSONResponse(lifecycle.stats(), status_code=200 if lifecycle.accepting else 503)
+
+async def process_update(update: Update):
+    user = update.effective_user
+    with tracer.trace(user.id if user else None, update_kind(update)):
+        await application.process_update(update)
+
 @app.post("/webhook")
 async def webhook(request: Request):
-    data = await request.json()
-    update = Update.de_json(data, application.bot)
-    await application.process_update(update)
+    if not lifecycle.accepting:
+        # Telegram повторит доставку — её подхватит новый инстанс
+        lifecycle.rejected += 1
+        return JSONResponse({"ok": False}, status_code=503)
+    # Отсев по сырому телу: Update строится только для того, что дойдёт до хендлеров.
+    # Отброшенным всё равно отвечаем 200 — иначе Telegram будет их повторять.
+    # Принятые обрабатываются после ответа: не более одного раза — при падении
+    # или SIGKILL посреди обработки Telegram апдейт уже не повторит (см. lifecycle)
+    decision, data = webhook_filter.classify(await request.body())
+    webhook_stats.record(decision)
+    if decision == webhook_filter.ACCEPT:
+        lifecycle.track(process_update(Update.de_json(data, application.bot)))
     return {"ok": True}
 
 @app.on_event("startup")
 async def startup():
-    global application
-    application = ApplicationBuilder().token(BOT_TOKEN).updater(None).build()
+    global application, broadcaster, http_client
+    http_client = httpx.AsyncClient(timeout=60)
+    # Процессы CPU-пула — форком до появления потоков (пул I/O, httpx, профайлер)
+    offload.start()
+    restore_state()
+    application = ApplicationBuilder().token(BOT_TOKEN).updater(None).rate_limiter(outbox).build()
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("calc", calc_command))
+    application.add_handler(CommandHandler("grid", grid_command))
+    application.add_handler(CommandHandler("optimize", optimize_command))
+    application.add_handler(CommandHandler("portfolio", portfolio_command))
     application.add_handler(CommandHandler("calculator", send_calculator))
     application.add_handler(CommandHandler("buy", buy_command))
     application.add_handler(CommandHandler("clear", clear))
     application.add_handler(CommandHandler("reload", reload_strategy))
     application.add_handler(CommandHandler("status", status_cmd))
+    application.add_handler(CommandHandler("stats", stats_cmd))
+    application.add_handler(CommandHandler("broadcast", broadcast_cmd))
+    application.add_handler(CommandHandler("backtest", backtest_cmd))
+    application.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex(r"^/backtest"), backtest_cmd))
+    application.add_handler(CommandHandler("profile", profile_cmd))
+    application.add_handler(CommandHandler("trace", trace_cmd))
     application.add_handler(CallbackQueryHandler(handle_callback))
+    application.add_handler(InlineQueryHandler(handle_inline))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    await application.initialize()
+
+    # Прогрев параллельно: картинки в памяти, соединения к Telegram и OpenRouter
+    await asyncio.gather(
+        offload.run_io(asset_store.build, rule_paths(IMAGE_RULES)),
+        offload.run_io(analytics.load),
+        application.initialize(),
+        warm_http_client(),
+    )
     await application.start()
-    await application.bot.set_webhook(url=f"{WEBHOOK_URL}/webhook")
-    logger.info(f"Webhook: {WEBHOOK_URL}/webhook")
 
+    # Не трогаем webhook, если он уже стоит — иначе каждый деплой сбрасывает его заново.
+    # allowed_updates: Telegram не шлёт типы апдейтов, которые бот не обрабатывает
+    webhook_url = f"{WEBHOOK_URL}/webhook"
+    info = await application.bot.get_webhook_info()
+    if info.url != webhook_url or sorted(info.allowed_updates or ()) != sorted(ALLOWED_UPDATES):
+        await application.bot.set_webhook(url=webhook_url, allowed_updates=ALLOWED_UPDATES)
+    logger.info(f"Webhook: {webhook_url}")
+
+    broadcaster = Broadcaster(application.bot, recipients, os.path.join(DATA_DIR, "broadcast.json"), priority=BULK)
+    broadcaster.resume()
+    loop_lag.start()
+    analytics.start(offload.run_io)
+    lifecycle.mark_ready()
+
+
+async def _shutdown_step(name: str, fn) -> None:
+    """Шаг остановки: ошибка логируется и не мешает остальным шагам."""
+    try:
+        result = fn()
+        if asyncio.iscoroutine(result):
+            await result
+    except Exception:
+        logger.exception(f"Остановка: не удалось — {name}")
 
 
 @app.on_event("shutdown")
 async def shutdown():
-    await application.stop()
-    await application.shutdown()
+    # startup мог упасть на любом шаге — останавливаем только то, что успело появиться
+    await _shutdown_step("ожидание апдейтов", lifecycle.drain)
+    if broadcaster is not None:
+        await _shutdown_step("остановка рассылки", broadcaster.stop)
+    await _shutdown_step("сохранение состояния", save_state)
+    await _shutdown_step("отложенная запись хранилищ", storage.flush_all)
+    logger.info(f"Остановка: {lifecycle.stats()}")
+    if application is not None:
+        if application.running:
+            await _shutdown_step("остановка приложения", application.stop)
+        await _shutdown_step("закрытие приложения", application.shutdown)
+    if http_client is not None:
+        await _shutdown_step("закрытие HTTP-клиента", http_client.aclose)
+    await _shutdown_step("монитор задержки цикла", loop_lag.stop)
+    await _shutdown_step("сохранение аналитики", analytics.stop)
+    await _shutdown_step("пулы offload", offload.shutdown)
+
+class GracefulServer(uvicorn.Server):
+    """
+    uvicorn закрывает порт сразу по сигналу, а shutdown-хук вызывает уже потом.
+    Здесь SIGTERM сначала переводит бота в draining, пока порт ещё открыт:
+    новые апдейты получают 503, /ready — 503, принятые дорабатывают.
+    Только после этого uvicorn штатно останавливается. Повторный сигнал — сразу.
+    """
+
+    def handle_exit(self, sig, frame) -> None:
+        if not lifecycle.ready or lifecycle.draining:
+            super().handle_exit(sig, frame)
+            return
+        logger.info("Получен сигнал остановки: перестаю принимать апдейты")
+        lifecycle.begin_drain()
+        asyncio.get_running_loop().call_soon_threadsafe(
+            lambda: asyncio.ensure_future(self._drain_then_exit(sig, frame))
+        )
+
+    async def _drain_then_exit(self, sig, frame) -> None:
+        await lifecycle.drain()
+        super().handle_exit(sig, frame)
+
 
 if __name__ == "__main__":
-    uvicorn.run("bot:app", host="0.0.0.0", port=PORT)
+    # app — объектом, а не строкой "bot:app": иначе модуль импортируется второй раз
+    # и GracefulServer смотрел бы на чужой lifecycle
+    config = uvicorn.Config(app, host="0.0.0.0", port=PORT, timeout_graceful_shutdown=HTTP_GRACE)
+    GracefulServer(config).run()
@@ -0,0 +1,339 @@
+"""
+Рассылка сообщений всем пользователям бота с учётом лимитов Telegram.
+
+- RecipientIndex — персистентный список chat_id всех, кто писал боту
+- TokenBucket    — асинхронный токен-бакет (используется очередью outbox)
+- Broadcaster    — фоновая рассылка: параллельные отправки, чекпоинт на диск
+                   и возобновление после рестарта
+
+Скорость отправки Broadcaster сам не ограничивает: все вызовы бота идут через
+outbox (глобальный бакет, бакет на чат, повтор по RetryAfter), рассылка
+ставится туда с приоритетом BULK и не вытесняет ответы пользователям.
+
+Из индекса убираются только чаты, которые точно недоступны (бот заблокирован,
+чат не найден). Ошибка разметки одинакова для всех получателей — рассылка
+останавливается, а не чистит индекс.
+
+Отправка идёт через обычный telegram.Bot, поэтому для проверки достаточно
+поднять локальный фейковый Bot API и передать Bot(base_url=...).
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+from telegram import InlineKeyboardMarkup
+from telegram.error import RetryAfter, Forbidden, BadRequest
+
+from storage import read_json, write_json, JsonWriter
+
+logger = logging.getLogger(__name__)
+
+CONCURRENCY = 8          # одновременных отправок в очереди outbox
+CHECKPOINT_EVERY = 50
+
+# BadRequest, после которых чат убирается из индекса
+_GONE_CHAT_ERRORS = ("chat not found", "user not found", "peer_id_invalid")
+
+
+class BroadcastAborted(Exception):
+    """Ошибка, одинаковая для всех получателей (например, разметка текста)."""
+
+
+def _is_gone_chat(e: BadRequest) -> bool:
+    message = str(e).lower()
+    return any(err in message for err in _GONE_CHAT_ERRORS)
+
+
+class RecipientIndex:
+    """
+    Персистентное множество chat_id. Пишется на диск только при изменениях,
+    отложенно и в фоне: add() вызывается на каждое сообщение нового пользователя.
+    """
+
+    def __init__(self, path: str, run_io=None):
+        self.path = path
+        self.ids = set(read_json(path, []))
+        self.writer = JsonWriter(path, lambda: sorted(self.ids), run_io=run_io)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, chat_id: int) -> None:
+        if chat_id not in self.ids:
+            self.ids.add(chat_id)
+            self.save()
+
+    def discard(self, chat_id: int) -> None:
+        if chat_id in self.ids:
+            self.ids.discard(chat_id)
+            self.save()
+
+    def save(self) -> None:
+        self.writer.mark()
+
+
+class TokenBucket:
+    """Асинхронный токен-бакет: rate токенов в секунду, ёмкость capacity."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Останавливает выдачу токенов (реакция на RetryAfter)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Broadcaster:
+    """
+    Одна активная рассылка за раз. Состояние (текст, оставшиеся чаты, счётчики)
+    сохраняется в checkpoint_path и подхватывается resume() после рестарта.
+    """
+
+    def __init__(self, bot, index: RecipientIndex, checkpoint_path: str,
+                 concurrency: int = CONCURRENCY, priority=None):
+        self.bot = bot
+        self.index = index
+        self.checkpoint_path = checkpoint_path
+        self.concurrency = concurrency
+        self.task = None
+        self.state = None
+        self._write = None     # запись чекпоинта в потоке, которая ещё может идти
+        # Приоритет в очереди исходящих (outbox.BULK), если у бота есть rate limiter
+        self.send_kwargs = {"rate_limit_args": priority} if priority is not None else {}
+
+    # ─── ПУБЛИЧНОЕ API ───
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self, text: str, parse_mode: str = None, reply_markup=None, report_to: int = None) -> bool:
+        """
+        Запускает рассылку по всему индексу. False — если уже идёт другая.
+        report_to — чат, куда сообщить, если рассылка остановлена ошибкой.
+        """
+        if self.running:
+            return False
+        self.state = {
+            "text": text,
+            "parse_mode": parse_mode,
+            "reply_markup": reply_markup.to_dict() if reply_markup else None,
+            "pending": sorted(self.index.ids),
+            "total": len(self.index),
+            "sent": 0,
+            "failed": 0,
+            "retries": 0,
+            "error": None,
+            "report_to": report_to,
+            "started": time.time(),
+        }
+        self._checkpoint()
+        self.task = asyncio.create_task(self._run())
+        return True
+
+    def resume(self) -> bool:
+        """Продолжает рассылку из чекпоинта, если он есть."""
+        if self.running:
+            return False
+        state = read_json(self.checkpoint_path, None)
+        if not state or not state.get("pending"):
+            return False
+        self.state = state
+        logger.info(f"Возобновляю рассылку: осталось {len(state['pending'])} из {state['total']}")
+        self.task = asyncio.create_task(self._run())
+        return True
+
+    async def stop(self) -> None:
+        """Останавливает рассылку, сохраняя чекпоинт для resume()."""
+        if self.running:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def cancel(self) -> None:
+        """Отменяет рассылку без возможности продолжить."""
+        await self.stop()
+        # Иначе запись в потоке, начатая до отмены, вернёт удалённый чекпоинт
+        await self._wait_write()
+        self._clear_checkpoint()
+
+    def progress(self) -> dict:
+        if not self.state:
+            return {}
+        s = self.state
+        elapsed = max(0.001, time.time() - s["started"])
+        done = s["sent"] + s["failed"]
+        return {
+            "running": self.running,
+            "total": s["total"],
+            "sent": s["sent"],
+            "failed": s["failed"],
+            "retries": s["retries"],
+            "error": s.get("error"),
+            "pending": len(s["pending"]),
+            "elapsed": elapsed,
+            "rate": done / elapsed,
+        }
+
+    def format_progress(self) -> str:
+        p = self.progress()
+        if not p:
+            return "📭 Рассылок ещё не было."
+        if p["running"]:
+            status = "▶️ Идёт"
+        elif p["error"]:
+            status = f"❌ Остановлена: {p['error']}"
+        else:
+            status = "⏸ Прервана" if p["pending"] else "✅ Завершена"
+        return (
+            f"📣 Рассылка: {status}\n"
+            f"Отправлено: {p['sent']}/{p['total']} | Ошибок: {p['failed']} | Повторов: {p['retries']}\n"
+            f"Осталось: {p['pending']} | Скорость: {p['rate']:.1f} сообщ/с | {p['elapsed']:.0f} с"
+        )
+
+    # ─── ВНУТРЕННЕЕ ───
+
+    def _checkpoint(self) -> None:
+        write_json(self.checkpoint_path, self.state)
+
+    async def _checkpoint_async(self) -> None:
+        """Чекпоинт из воркера: в потоке, не больше одной записи одновременно."""
+        if self._write is not None and not self._write.done():
+            return
+        self._write = asyncio.ensure_future(asyncio.to_thread(write_json, self.checkpoint_path, dict(self.state)))
+        await asyncio.shield(self._write)
+
+    async def _wait_write(self) -> None:
+        if self._write is not None:
+            await asyncio.gather(self._write, return_exceptions=True)
+            self._write = None
+
+    def _clear_checkpoint(self) -> None:
+        try:
+            os.remove(self.checkpoint_path)
+        except FileNotFoundError:
+            pass
+
+    async def _send_one(self, chat_id: int) -> bool:
+        """
+        True — доставлено, False — не доставлено. RetryAfter, который outbox
+        не смог переждать сам, повторяется после паузы.
+        BroadcastAborted — ошибка текста, повторится для всех получателей.
+        """
+        s = self.state
+        markup = InlineKeyboardMarkup.de_json(s["reply_markup"], self.bot) if s["reply_markup"] else None
+        while True:
+            try:
+                await self.bot.send_message(
+                    chat_id=chat_id,
+                    text=s["text"],
+                    parse_mode=s["parse_mode"],
+                    reply_markup=markup,
+                    **self.send_kwargs,
+                )
+                return True
+            except RetryAfter as e:
+                s["retries"] += 1
+                delay = getattr(e.retry_after, "total_seconds", lambda: e.retry_after)()
+                logger.warning(f"Рассылка: RetryAfter {delay}с")
+                await asyncio.sleep(float(delay) + 0.5)
+            except Forbidden as e:
+                logger.info(f"Рассылка: чат {chat_id} недоступен ({e}), убираю из индекса")
+                self.index.discard(chat_id)
+                return False
+            except BadRequest as e:
+                if _is_gone_chat(e):
+                    logger.info(f"Рассылка: чат {chat_id} не найден ({e}), убираю из индекса")
+                    self.index.discard(chat_id)
+                    return False
+                if "can't parse entities" in str(e).lower():
+                    raise BroadcastAborted(f"ошибка разметки: {e}") from e
+                logger.warning(f"Рассылка: ошибка отправки {chat_id}: {e}")
+                return False
+            except Exception as e:
+                logger.warning(f"Рассылка: ошибка отправки {chat_id}: {e}")
+                return False
+
+    async def _run(self) -> None:
+        s = self.state
+        queue: asyncio.Queue = asyncio.Queue()
+        for chat_id in s["pending"]:
+            queue.put_nowait(chat_id)
+        remaining = set(s["pending"])
+        since_checkpoint = 0
+
+        async def worker():
+            nonlocal since_checkpoint
+            while True:
+                try:
+                    chat_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                ok = await self._send_one(chat_id)
+                remaining.discard(chat_id)
+                s["sent" if ok else "failed"] += 1
+                since_checkpoint += 1
+                if since_checkpoint >= CHECKPOINT_EVERY:
+                    since_checkpoint = 0
+                    s["pending"] = sorted(remaining)
+                    await self._checkpoint_async()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        except asyncio.CancelledError:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self._wait_write()
+            s["pending"] = sorted(remaining)
+            if os.path.exists(self.checkpoint_path):
+                self._checkpoint()
+            raise
+        except BroadcastAborted as e:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self._wait_write()
+            s["pending"] = sorted(remaining)
+            s["error"] = str(e)
+            self._clear_checkpoint()
+            logger.error(f"Рассылка остановлена: {e}")
+            if s.get("report_to"):
+                try:
+                    await self.bot.send_message(
+                        chat_id=s["report_to"],
+                        text=f"❌ Рассылка остановлена: {e}\nОтправлено {s['sent']}/{s['total']} до ошибки.",
+                    )
+                except Exception as report_error:
+                    logger.warning(f"Рассылка: не удалось сообщить об остановке: {report_error}")
+            return
+        s["pending"] = []
+        await self._wait_write()
+        self._clear_checkpoint()
+        p = self.progress()
+        logger.info(f"Рассылка завершена: {p['sent']}/{p['total']}, ошибок {p['failed']}, {p['rate']:.1f} сообщ/с")
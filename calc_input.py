@@ -0,0 +1,223 @@
+"""
+Разбор входных данных калькулятора одной строкой.
+
+Понимает как строгую форму:
+    /calc 48500 50000 1ph 3 atr=1.0 cf=1.0 day=5 profit=0
+так и свободный текст:
+    "баланс 48500, депозит 50к, челлендж, сетап №3, флэт, день 5"
+
+Числа без ключа раскладываются по порядку: крупные — баланс, депозит;
+маленькие целые (до 16) — сетап, день цикла. Суффиксы k/к и m/м — тысячи
+и миллионы; число с другим хвостом, NaN/inf или пустое key= — ошибка ввода,
+а не молча отброшенное слово.
+"""
+
+import math
+import re
+
+from calculator import SETUP_NAMES, ATR_LABELS
+from storage import read_json, JsonWriter
+
+# Порядок полей = порядок шагов мастера /calc
+CALC_FIELDS = ("balance", "initial", "phase", "setup", "atr", "cf", "cycle_day", "prev_profit")
+
+# Поля, которые можно не спрашивать — у формулы есть нейтральное значение
+OPTIONAL_DEFAULTS = {"atr": 1.0, "cf": 1.0, "prev_profit": 0.0}
+
+# Не переносятся между расчётами — прибыль относится к конкретной сделке
+NOT_REMEMBERED = ("prev_profit",)
+
+_KEYS = {
+    "balance": "balance", "баланс": "balance", "балансе": "balance", "bal": "balance",
+    "initial": "initial", "депозит": "initial", "депозите": "initial", "деп": "initial", "dep": "initial",
+    "setup": "setup", "сетап": "setup", "сетапе": "setup",
+    "atr": "atr", "атр": "atr",
+    "cf": "cf", "кф": "cf", "уверенность": "cf",
+    "day": "cycle_day", "день": "cycle_day", "cycle": "cycle_day", "цикл": "cycle_day",
+    "profit": "prev_profit", "прибыль": "prev_profit",
+}
+
+_PHASES = {
+    "1ph": "1ph", "challenge": "1ph", "челлендж": "1ph", "челендж": "1ph",
+    "2ph": "2ph", "verification": "2ph", "верификация": "2ph",
+    "funded": "funded", "фандед": "funded", "фонд": "funded",
+}
+
+_ATR_WORDS = {
+    "импульс": 1.2, "impulse": 1.2,
+    "норма": 1.0, "normal": 1.0,
+    "флэт": 0.7, "флет": 0.7, "flat": 0.7,
+    "шок": 0.5, "shock": 0.5,
+}
+
+# Слова-связки, которые не считаются «лишними» при распознавании свободного текста
+_FILLER = {"риск", "расчёт", "расчет", "посчитай", "calc", "фаза", "phase", "сетапа", "на", "при", "и"}
+
+# Слово, число (с #/№ или знаком минус и буквенным хвостом — 50k, 1ph, 5abc) или "="
+_TOKEN_RE = re.compile(r"[a-zа-яё][a-zа-яё0-9]*|(?:[#№]|(?<![\w.])-)?\d+(?:\.\d+)?[a-zа-яё0-9]*|=")
+
+_NUMBER_RE = re.compile(r"[#№]?(-?\d+(?:\.\d+)?)([a-zа-яё]*)")
+_MULTIPLIERS = {"": 1, "k": 1_000, "к": 1_000, "m": 1_000_000, "м": 1_000_000}
+
+
+def parse_number(token: str) -> float:
+    """
+    "48500", "50k", "2.5к", "-500" → число. ValueError — если хвост не k/m
+    или значение не конечное. Общая для строки /calc и шагов мастера.
+    """
+    token = token.strip().lower().replace(",", ".").replace("−", "-")
+    m = _NUMBER_RE.fullmatch(token)
+    if not m or m.group(2) not in _MULTIPLIERS:
+        raise ValueError(token)
+    value = float(m.group(1)) * _MULTIPLIERS[m.group(2)]
+    if not math.isfinite(value):
+        raise ValueError(token)
+    return value
+
+
+def _is_numeric(token: str) -> bool:
+    """Токен начинается с числа — значит, это число (возможно, с ошибкой), а не слово."""
+    return token[0].isdigit() or (token[0] in "#№-" and len(token) > 1 and token[1].isdigit())
+
+
+def _validate(field: str, value):
+    """Приводит значение к типу поля. ValueError — если значение недопустимо."""
+    if field in ("balance", "initial"):
+        if value <= 0:
+            raise ValueError
+        return float(value)
+    if field == "setup":
+        if int(value) != value or int(value) not in SETUP_NAMES:
+            raise ValueError
+        return int(value)
+    if field == "atr":
+        if value not in ATR_LABELS:
+            raise ValueError
+        return float(value)
+    if field == "cf":
+        if not 0 < value <= 2:
+            raise ValueError
+        return float(value)
+    if field == "cycle_day":
+        if value < 1:
+            raise ValueError
+        return int(value)
+    if field == "prev_profit":
+        return clamp_profit(value)
+    return value
+
+
+def clamp_profit(value: float) -> float:
+    """Убыток прошлой сделки бонус не уменьшает — как в мастере /calc, берём 0."""
+    return max(0.0, float(value))
+
+
+def parse_calc_text(text: str):
+    """
+    Возвращает (fields, errors, unknown):
+    fields  — распознанные поля калькулятора
+    errors  — названия полей с недопустимыми значениями или «токен» для
+              числа, которое не удалось прочитать (2.5x, 1e999)
+    unknown — число слов, которые не удалось разобрать
+    """
+    text = text.lower().replace(",", ".").replace("−", "-").replace("-$", "-").replace("$", " ")
+    text = re.sub(r"(\d)\s+(\d{3})\b", r"\1\2", text)   # "48 500" → "48500"
+    tokens = _TOKEN_RE.findall(text)
+
+    fields, errors = {}, []
+    unknown = 0
+    bare_numbers = []
+    i = 0
+    while i < len(tokens):
+        tok = tokens[i]
+        if tok == "=":
+            i += 1
+            continue
+        if tok in _KEYS:
+            field = _KEYS[tok]
+            j = i + 1
+            explicit = j < len(tokens) and tokens[j] == "="
+            if explicit:
+                j += 1
+            if j < len(tokens) and (_is_numeric(tokens[j]) or explicit and tokens[j] not in _ATR_WORDS):
+                # key=значение: значение обязано быть числом (cf=nan — ошибка, а не пропуск)
+                try:
+                    fields[field] = _validate(field, parse_number(tokens[j]))
+                except ValueError:
+                    errors.append(field)
+                i = j + 1
+                continue
+            if explicit and j >= len(tokens):
+                errors.append(field)
+        if tok in _PHASES:
+            fields["phase"] = _PHASES[tok]
+        elif tok in _ATR_WORDS:
+            fields["atr"] = _ATR_WORDS[tok]
+        elif _is_numeric(tok):
+            try:
+                value = parse_number(tok)
+            except ValueError:
+                errors.append(f"«{tok[:20]}»")
+            else:
+                if tok[0] in "#№":
+                    try:
+                        fields["setup"] = _validate("setup", value)
+                    except ValueError:
+                        errors.append("setup")
+                else:
+                    bare_numbers.append(value)
+        elif tok not in _FILLER and tok not in _KEYS:
+            unknown += 1
+        i += 1
+
+    # Маленькие целые — это сетап/день цикла, большие (и отрицательные) — баланс/депозит
+    for value in bare_numbers:
+        order = ("setup", "cycle_day") if value == int(value) and 1 <= value <= 16 else ("balance", "initial")
+        field = next((f for f in order if f not in fields), None)
+        if field is None:
+            unknown += 1
+            continue
+        try:
+            fields[field] = _validate(field, value)
+        except ValueError:
+            errors.append(field)
+
+    return fields, errors, unknown
+
+
+def looks_like_calc(text: str) -> bool:
+    """
+    Свободный текст похож на запрос расчёта: есть баланс и фаза/сетап,
+    и почти нет посторонних слов (чтобы не перехватывать вопросы к AI).
+    """
+    if len(text) > 200:
+        return False
+    fields, errors, unknown = parse_calc_text(text)
+    return "balance" in fields and ("phase" in fields or "setup" in fields) and unknown <= 1 and not errors
+
+
+def missing_fields(session: dict, full: bool = False) -> list:
+    """
+    Поля, которых ещё нет в сессии, в порядке шагов мастера.
+    full=False — только обязательные (ATR/CF/прибыль берутся по умолчанию).
+    """
+    return [f for f in CALC_FIELDS if f not in session and (full or f not in OPTIONAL_DEFAULTS)]
+
+
+class CalcDefaults:
+    """Последние использованные значения калькулятора по пользователям (JSON на диске, запись отложенная)."""
+
+    def __init__(self, path: str, run_io=None):
+        self.path = path
+        self.data = read_json(path, {})
+        self.writer = JsonWriter(path, lambda: self.data, run_io=run_io)
+
+    def get(self, user_id: int) -> dict:
+        return dict(self.data.get(str(user_id), {}))
+
+    def remember(self, user_id: int, session: dict) -> None:
+        values = {f: session[f] for f in CALC_FIELDS if f in session and f not in NOT_REMEMBERED}
+        if self.data.get(str(user_id)) == values:
+            return
+        self.data[str(user_id)] = values
+        self.writer.mark()
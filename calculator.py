@@ -203,6 +203,7 @@ def full_calculate(
         "T": round(T, 4),
         "U": round(U, 2),
         "V": V,
+        "balance": balance,
         "setup": setup,
         "setup_name": SETUP_NAMES.get(setup, ""),
         "phase": phase,
@@ -223,7 +224,7 @@ def format_result(r: dict) -> str:
     return (
         f"📊 *Расчёт риска по стратегии*\n"
         f"{'─'*30}\n"
-        f"💰 Баланс: ${r['U']/r['T']*100*r['T']/r['T']:.0f} → {r['F']}% от депозита\n"
+        f"💰 Баланс: ${r['balance']:,.0f} → {r['F']}% от депозита\n"
         f"📋 Фаза: {phase_names.get(r['phase'], r['phase'])} | {status}\n"
         f"🎯 Сетап №{r['setup']}: {r['setup_name']}\n"
         f"📡 ATR: {r['atr_label']}\n"
@@ -0,0 +1,193 @@
+"""
+Сетка чувствительности калькулятора риска ("что если").
+
+Считает итоговый риск T за один проход по сетке:
+- баланс% × день цикла (режим "day")
+- ATR × CF (режим "atr")
+
+Все множители, зависящие только от строки (баланс%, ATR), считаются
+один раз на строку, а в ячейке остаются лишь k-цикл / CF и MIN(2.9).
+Готовые таблицы и картинки кэшируются по кортежу параметров.
+"""
+
+import io
+from functools import lru_cache
+
+from calculator import (
+    calc_F, calc_G, calc_K, calc_L, calc_Y, calc_Z, calc_R,
+    SETUP_NAMES, ATR_LABELS,
+)
+
+# Строки баланса% — по одной на каждый порог формул G/J/Y/R
+GRID_BALANCE_PCTS = (90, 93, 95, 96, 97, 98, 99, 100, 101, 102, 103, 105, 106, 108)
+
+# Колонки дней цикла — k-цикл меняется только на границах 1-5/6-10/11-13/14+
+GRID_CYCLE_DAYS = (1, 6, 11, 14)
+GRID_CYCLE_LABELS = ("1-5", "6-10", "11-13", "14+")
+
+GRID_ATRS = (0.5, 0.7, 1.0, 1.2)
+GRID_CFS = (0.5, 0.7, 1.0, 1.5)
+
+MAX_RISK = 2.9
+
+
+def risk_base(balance, initial, phase, setup, atr, cf, kr, efficiency):
+    """
+    (F, произведение всех множителей T9, кроме k-цикла Z). Общая база расчёта
+    риска для сетки, оптимизатора и бэктеста: T = MIN(2.9; база × Z + бонус).
+    """
+    F = calc_F(balance, initial)
+    G = calc_G(F, phase)
+    K = calc_K(setup)
+    L = calc_L(balance, initial)
+    M = K / (1 + L)
+    Y = calc_Y(F)
+    R = calc_R(F, L)
+    return F, G * M * kr * cf * R * efficiency * Y * atr
+
+
+def profit_bonus(prev_profit, balance):
+    """Надбавка к риску за прибыль прошлой сделки, % (убыток надбавки не даёт)."""
+    return (prev_profit * 0.4 / balance * 100) if prev_profit > 0 else 0.0
+
+
+def grid_by_day(
+    initial: float,
+    phase: str,
+    setup: int,
+    balance_pcts=GRID_BALANCE_PCTS,
+    cycle_days=GRID_CYCLE_DAYS,
+    atr: float = 1.0,
+    cf: float = 1.0,
+    kr: float = 1.0,
+    efficiency: float = 1.0,
+    prev_profit: float = 0.0,
+) -> list:
+    """
+    Матрица T% [баланс%][день цикла].
+    Совпадает с full_calculate(...)["T"] для каждой ячейки (до округления).
+    """
+    matrix = []
+    for pct in balance_pcts:
+        balance = initial * pct / 100
+        F, base = risk_base(balance, initial, phase, setup, atr, cf, kr, efficiency)
+        bonus = profit_bonus(prev_profit, balance)
+        matrix.append([min(MAX_RISK, base * calc_Z(F, day) + bonus) for day in cycle_days])
+    return matrix
+
+
+def grid_by_atr(
+    balance: float,
+    initial: float,
+    phase: str,
+    setup: int,
+    atrs=GRID_ATRS,
+    cfs=GRID_CFS,
+    cycle_day: int = 1,
+    kr: float = 1.0,
+    efficiency: float = 1.0,
+    prev_profit: float = 0.0,
+) -> list:
+    """Матрица T% [ATR][CF] для фиксированного баланса и дня цикла."""
+    # База считается с CF=1 и ATR=1, дальше только умножение на ячейку
+    F, base = risk_base(balance, initial, phase, setup, 1.0, 1.0, kr, efficiency)
+    base *= calc_Z(F, cycle_day)
+    bonus = profit_bonus(prev_profit, balance)
+    return [[min(MAX_RISK, base * atr * cf + bonus) for cf in cfs] for atr in atrs]
+
+
+def format_grid(matrix: list, row_labels, col_labels, title: str, corner: str = "") -> str:
+    """Моноширинная таблица для Telegram (оборачивается в ``` снаружи)."""
+    row_w = max(len(corner), *(len(str(r)) for r in row_labels))
+    col_w = max(4, *(len(str(c)) for c in col_labels))
+    lines = [title]
+    lines.append(corner.ljust(row_w) + " " + " ".join(str(c).rjust(col_w) for c in col_labels))
+    for label, row in zip(row_labels, matrix):
+        lines.append(str(label).ljust(row_w) + " " + " ".join(f"{v:.2f}".rjust(col_w) for v in row))
+    return "\n".join(lines)
+
+
+# ─── КЭШИРУЕМЫЕ ОТЧЁТЫ ─────────────────────────────────────────────────────────
+
+@lru_cache(maxsize=256)
+def grid_report(
+    mode: str,
+    initial: float,
+    phase: str,
+    setup: int,
+    balance: float = 0.0,
+    cycle_day: int = 1,
+    atr: float = 1.0,
+    cf: float = 1.0,
+    prev_profit: float = 0.0,
+) -> str:
+    """
+    Готовый текст сетки. mode="day" — баланс% × день цикла,
+    mode="atr" — ATR × CF при заданном балансе и дне цикла.
+    """
+    if mode == "atr":
+        matrix = grid_by_atr(balance, initial, phase, setup,
+                             cycle_day=cycle_day, prev_profit=prev_profit)
+        title = (f"Сетап №{setup}: {SETUP_NAMES.get(setup, '')}\n"
+                 f"{phase} | баланс {calc_F(balance, initial):.1f}% | день {cycle_day}\n"
+                 f"Риск T%: ATR (строки) × CF (колонки)")
+        return format_grid(matrix, GRID_ATRS, GRID_CFS, title, corner="ATR")
+
+    matrix = grid_by_day(initial, phase, setup, atr=atr, cf=cf, prev_profit=prev_profit)
+    title = (f"Сетап №{setup}: {SETUP_NAMES.get(setup, '')}\n"
+             f"{phase} | ATR {atr} | CF {cf}\n"
+             f"Риск T%: баланс% (строки) × день цикла (колонки)")
+    return format_grid(matrix, [f"{p}%" for p in GRID_BALANCE_PCTS], GRID_CYCLE_LABELS, title, corner="Бал")
+
+
+@lru_cache(maxsize=64)
+def grid_heatmap(
+    mode: str,
+    initial: float,
+    phase: str,
+    setup: int,
+    balance: float = 0.0,
+    cycle_day: int = 1,
+    atr: float = 1.0,
+    cf: float = 1.0,
+    prev_profit: float = 0.0,
+):
+    """
+    PNG-тепловая карта сетки (bytes) или None, если matplotlib не установлен.
+    Блокирующая — вызывать через asyncio.to_thread.
+    """
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        return None
+
+    if mode == "atr":
+        matrix = grid_by_atr(balance, initial, phase, setup,
+                             cycle_day=cycle_day, prev_profit=prev_profit)
+        rows, cols = [ATR_LABELS.get(a, a) for a in GRID_ATRS], [str(c) for c in GRID_CFS]
+        xlabel, ylabel = "CF", "ATR"
+    else:
+        matrix = grid_by_day(initial, phase, setup, atr=atr, cf=cf, prev_profit=prev_profit)
+        rows, cols = [f"{p}%" for p in GRID_BALANCE_PCTS], list(GRID_CYCLE_LABELS)
+        xlabel, ylabel = "День цикла", "Баланс %"
+
+    fig, ax = plt.subplots(figsize=(6, max(3, len(rows) * 0.4)))
+    try:
+        im = ax.imshow(matrix, cmap="RdYlGn_r", vmin=0, vmax=MAX_RISK, aspect="auto")
+        ax.set_xticks(range(len(cols)), labels=cols)
+        ax.set_yticks(range(len(rows)), labels=rows)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        ax.set_title(f"Сетап №{setup} | {phase} — риск T%")
+        for i, row in enumerate(matrix):
+            for j, v in enumerate(row):
+                ax.text(j, i, f"{v:.2f}", ha="center", va="center", fontsize=8)
+        fig.colorbar(im, ax=ax)
+        fig.tight_layout()
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", dpi=110)
+        return buf.getvalue()
+    finally:
+        plt.close(fig)
@@ -126,6 +126,18 @@ IMAGE_RULES = [
 ]
 
 
+# Компилируются один раз при импорте, а не на каждый вызов find_images
+COMPILED_RULES = [(re.compile(pattern), image_files, caption) for pattern, image_files, caption in IMAGE_RULES]
+
+_CAPTION_SETUP = re.compile(r"^Сетап №(\d+)")
+
+
+def caption_setup(caption: str):
+    """Номер сетапа по подписи картинки ("Сетап №3: ..."), None — если картинка не сетапа."""
+    m = _CAPTION_SETUP.match(caption)
+    return int(m.group(1)) if m else None
+
+
 def find_images(text: str) -> list:
     """
     Ищет изображения по тексту.
@@ -135,8 +147,8 @@ def find_images(text: str) -> list:
     results = []
     seen = set()
 
-    for pattern, image_files, caption in IMAGE_RULES:
-        if re.search(pattern, text_lower):
+    for regex, image_files, caption in COMPILED_RULES:
+        if regex.search(text_lower):
             if caption not in seen:
                 for img_path in image_files[:3]:
                     results.append((img_path, caption))
@@ -0,0 +1,133 @@
+"""
+Локальный роутер намерений — отвечает на типовые запросы без вызова LLM.
+
+Каждое намерение — набор скомпилированных regex с весами. Сумма весов
+совпавших паттернов — оценка; побеждает намерение с наибольшей оценкой
+не ниже порога. Вопросительные слова ("как", "почему", "объясни") снижают
+оценку шаблонных ответов: такие вопросы должна разбирать нейросеть.
+
+    classify("покажи сетап 5")         → ("show_setup", {"setup": 5})
+    classify("винрейт 3 сетапа")       → ("winrate", {"setup": 3})
+    classify("как войти по сетапу 3?") → ("llm", {"setup": 3})
+"""
+
+import re
+import time
+from collections import deque
+
+from calculator import SETUP_NAMES
+
+LLM = "llm"
+
+# Вопрос "по существу" — понижает шаблонные намерения
+_QUESTION = (r"\b(как|почему|зачем|когда|что\s+такое|что\s+значит|объясни|расскажи|разбер\w*|в\s+чём|чем\s+отлича\w*)\b", -2.0)
+
+# (намерение, порог, [(regex, вес), ...])
+_RULES = [
+    ("calculator_file", 2.0, [
+        (r"\b(excel|эксель|xlsx)\b", 2.0),
+        (r"(скачать|дай|дайте|отправь|пришли|скинь|хочу|получить)\s+(мне\s+)?(этот\s+)?(файл|калькулятор|таблиц)", 3.0),
+        (r"файл\s+с\s+риск", 3.0),
+        (r"продвинут\w*\s+риск", 2.0),
+        (r"^\s*риск[\s-]*менеджмент\s*[?!.]*\s*$", 3.0),
+        (r"^\s*(калькулятор|файл|таблица)\s*[?!.]*\s*$", 3.0),
+        (r"подар(ок|ка)", 1.0),
+        (r"бесплатн", 0.5),
+        _QUESTION,
+    ]),
+    ("buy", 2.0, [
+        (r"^\s*/?buy\b", 3.0),
+        # "как купить" перекрывает штраф за вопросительное слово
+        (r"(как|где)\s+(можно\s+)?(купить|приобрести|оплатить|получить\s+доступ)", 4.0),
+        # Цена сама по себе — чаще про сделку ("цена входа"), нужна покупка рядом
+        (r"(сколько\s+стоит|стоимост\w*|\bцен[аыу]\b|прайс)\W+(\w+\W+){0,3}?(стратеги|доступ|бот|подписк|канал)", 3.0),
+        (r"(стратеги|доступ|бот|подписк|канал)\w*\W+(\w+\W+){0,3}?(стоит|стоимост\w*|цен[аыу])\b", 3.0),
+        (r"^\s*(сколько\s+стоит|цена|стоимость|прайс)\s*[?!.]*\s*$", 3.0),
+        (r"сколько\s+стоит|стоимост\w*|\bцен[аыу]\b|прайс", 1.0),
+        (r"(купить|приобрести)\s+(полную\s+)?(стратеги|доступ|бот)", 3.0),
+        (r"\bоплат\w*", 1.5),
+        (r"сетап\w*|setup", -2.0),
+        _QUESTION,
+    ]),
+    ("show_setup", 2.5, [
+        (r"(покажи|показать|скинь|пришли|дай)\s+(мне\s+)?(схем\w*|картинк\w*|скрин\w*|график\w*|пример\w*)?\s*(по\s+)?(сетап\w*|setup)\s*(№\s*)?\d{1,2}\b", 3.0),
+        (r"(схем\w*|картинк\w*|скрин\w*)\s+(сетап\w*|setup)\s*(№\s*)?\d{1,2}\b", 3.0),
+        (r"(покажи|показать|скинь|пришли|дай)\s+(мне\s+)?\d{1,2}\s*(-?(й|го|ой))?\s*сетап", 3.0),
+        (r"^\s*(сетап|setup)\s*(№\s*)?\d{1,2}\s*[?!.]*\s*$", 3.0),
+        _QUESTION,
+    ]),
+    ("winrate", 2.0, [
+        (r"винрейт\w*|win\s*rate|процент\s+(побед|прибыльных)", 2.0),
+        (r"какой\s+(у\s+)?(винрейт|процент)", 1.0),
+        _QUESTION,
+    ]),
+    # Только запрос списка целиком: "какие сетапы лучше торговать в пятницу?" — вопрос к LLM
+    ("list_setups", 2.5, [
+        (r"^\s*((покажи|дай|скинь|пришли)\s+(мне\s+)?)?(список|перечень|все|какие)\s+(есть\s+)?"
+         r"(сетап\w*|setup\w*)(\s+(есть|бывают|у\s+тебя|в\s+стратегии))?\s*[?!.]*\s*$", 3.0),
+        (r"^\s*сколько\s+(всего\s+)?(сетап\w*|setup\w*)(\s+(всего|есть|в\s+стратегии))?\s*[?!.]*\s*$", 3.0),
+        _QUESTION,
+    ]),
+]
+
+COMPILED_RULES = [
+    (intent, threshold, [(re.compile(p), w) for p, w in patterns])
+    for intent, threshold, patterns in _RULES
+]
+
+_SETUP_RE = re.compile(r"(?:сетап\w*|setup|#|№)\s*(?:№\s*)?(\d{1,2})\b|\b(\d{1,2})\s*(?:-?(?:й|го|ом|му))?\s*сетап")
+
+
+def extract_setup(text: str):
+    """Номер сетапа из текста или None."""
+    for m in _SETUP_RE.finditer(text):
+        n = int(m.group(1) or m.group(2))
+        if n in SETUP_NAMES:
+            return n
+    return None
+
+
+def classify(text: str):
+    """(намерение, слоты). LLM — если ни одно намерение не набрало порог."""
+    text = text.lower()
+    best, best_score = LLM, 0.0
+    for intent, threshold, patterns in COMPILED_RULES:
+        score = sum(w for regex, w in patterns if regex.search(text))
+        if score >= threshold and score > best_score:
+            best, best_score = intent, score
+
+    slots = {}
+    setup = extract_setup(text)
+    if setup is not None:
+        slots["setup"] = setup
+    # Показать сетап без номера не получится — отдаём нейросети
+    if best == "show_setup" and "setup" not in slots:
+        best = LLM
+    return best, slots
+
+
+class IntentStats:
+    """Сколько запросов ушло мимо LLM и насколько быстрее ответ."""
+
+    def __init__(self, window: int = 1000):
+        self.counts: dict = {}
+        self.latency = {"local": deque(maxlen=window), LLM: deque(maxlen=window)}
+
+    def record(self, intent: str, started: float) -> None:
+        self.counts[intent] = self.counts.get(intent, 0) + 1
+        self.latency[LLM if intent == LLM else "local"].append((time.perf_counter() - started) * 1000)
+
+    def summary(self) -> str:
+        total = sum(self.counts.values())
+        if not total:
+            return "Роутер: запросов ещё не было"
+        local = total - self.counts.get(LLM, 0)
+
+        def avg(values):
+            return sum(values) / len(values) if values else 0.0
+
+        by_intent = ", ".join(f"{k}={v}" for k, v in sorted(self.counts.items(), key=lambda kv: -kv[1]))
+        return (
+            f"Роутер: без LLM {local}/{total} ({local / total:.0%}) | {by_intent}\n"
+            f"Ответ: локально {avg(self.latency['local']):.0f} мс, LLM {avg(self.latency[LLM]):.0f} мс"
+        )
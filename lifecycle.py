@@ -0,0 +1,103 @@
+"""
+Жизненный цикл процесса бота: готовность и плавная остановка.
+
+- ready   — кэши прогреты. До этого uvicorn вообще не слушает порт (startup
+             ещё идёт), так что /ready и webhook недоступны, а не отдают 503
+- draining — идёт остановка: начинается по SIGTERM (GracefulServer в bot.py),
+             пока uvicorn ещё принимает соединения. Новые апдейты получают 503
+             (Telegram повторит их на новый инстанс), /ready — 503, уже
+             принятые апдейты дожидаются до общего дедлайна
+
+Бюджет остановки (Render шлёт SIGKILL через 30 с после SIGTERM):
+DRAIN_TIMEOUT на апдейты в работе + HTTP_GRACE на закрытие соединений
+uvicorn + несколько секунд на сохранение состояния — с запасом меньше 30 с.
+
+Доставка — не более одного раза: webhook отвечает 200 до обработки, и апдейт,
+принятый перед падением или SIGKILL, Telegram уже не повторит. Это цена
+быстрого ответа; упавшие обработчики логируются и считаются в failed.
+
+Счётчики: время до готовности, принятые, отклонённые, упавшие и брошенные апдейты.
+"""
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+DRAIN_TIMEOUT = 20.0   # общий дедлайн ожидания апдейтов, от начала остановки
+HTTP_GRACE = 3         # timeout_graceful_shutdown uvicorn: webhook отвечает сразу
+
+
+class Lifecycle:
+    def __init__(self, process_start: float = None):
+        self.process_start = process_start if process_start is not None else time.perf_counter()
+        self.ready = False
+        self.draining = False
+        self.drain_deadline = None
+        self.time_to_ready = None
+        self.inflight: set = set()
+        self.accepted = 0
+        self.rejected = 0
+        self.failed = 0
+        self.dropped = 0
+
+    @property
+    def accepting(self) -> bool:
+        return self.ready and not self.draining
+
+    def mark_ready(self) -> None:
+        self.ready = True
+        self.time_to_ready = time.perf_counter() - self.process_start
+        logger.info(f"Готов к работе за {self.time_to_ready:.2f} с")
+
+    def track(self, coro) -> asyncio.Task:
+        """Запускает обработку апдейта в фоне и учитывает её до завершения."""
+        task = asyncio.create_task(coro)
+        self.accepted += 1
+        self.inflight.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: asyncio.Task) -> None:
+        self.inflight.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.failed += 1
+            logger.error("Обработка апдейта упала", exc_info=task.exception())
+
+    def begin_drain(self, timeout: float = DRAIN_TIMEOUT) -> None:
+        """Перестаёт принимать апдейты; дедлайн ожидания считается от этого момента."""
+        if not self.draining:
+            self.draining = True
+            self.drain_deadline = time.monotonic() + timeout
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT) -> int:
+        """
+        Перестаёт принимать апдейты и ждёт текущие до дедлайна остановки.
+        Повторный вызов ждёт только остаток дедлайна. Не успевшие — отменяются;
+        возвращает их число.
+        """
+        self.begin_drain(timeout)
+        pending = set(self.inflight)
+        if pending:
+            remaining = max(0.0, self.drain_deadline - time.monotonic())
+            logger.info(f"Ожидаю {len(pending)} апдейтов в обработке (до {remaining:.0f} с)")
+            _, pending = await asyncio.wait(pending, timeout=remaining)
+        for task in pending:
+            task.cancel()
+        self.dropped += len(pending)
+        if pending:
+            logger.warning(f"Брошено апдейтов при остановке: {len(pending)}")
+        return len(pending)
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "draining": self.draining,
+            "time_to_ready": round(self.time_to_ready, 3) if self.time_to_ready is not None else None,
+            "inflight": len(self.inflight),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,204 @@
+"""
+Вынос блокирующей работы с event loop.
+
+- run_io()  — ограниченный пул потоков для файлов и прочего блокирующего I/O
+- run_cpu() — пул процессов для тяжёлых вычислений (docx, тепловые карты, симуляции)
+
+Очередь каждого пула ограничена: при переполнении сразу бросается OffloadBusy,
+а не копится бесконечный хвост. Отмена ожидающей корутины отменяет задачу,
+если она ещё не начала выполняться.
+
+LoopLagMonitor меряет задержку event loop: насколько позже запланированного
+просыпается sleep(interval). Это прямой показатель того, что loop что-то блокирует.
+"""
+
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+IO_WORKERS = 4
+CPU_WORKERS = max(1, min(2, (os.cpu_count() or 1) - 1))
+MAX_QUEUE = 32
+
+
+class OffloadBusy(Exception):
+    """Очередь пула переполнена."""
+
+
+class _Pool:
+    def __init__(self, name: str, make_executor, max_queue: int):
+        self.name = name
+        self._make_executor = make_executor
+        self._executor = None
+        self.max_queue = max_queue
+        self.pending = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.wait_ms = deque(maxlen=1000)
+        self.run_ms = deque(maxlen=1000)
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = self._make_executor()
+        return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        if self.pending >= self.max_queue:
+            self.rejected += 1
+            raise OffloadBusy(f"{self.name}: очередь заполнена ({self.max_queue})")
+        self.pending += 1
+        self.submitted += 1
+        call = functools.partial(fn, *args, **kwargs)
+        queued_at = time.perf_counter()
+        try:
+            # Время ожидания в очереди считаем по старту, время работы — целиком
+            result, started_at = await asyncio.get_running_loop().run_in_executor(
+                self.executor, _timed, call
+            )
+            self.wait_ms.append((started_at - queued_at) * 1000)
+            self.run_ms.append((time.perf_counter() - started_at) * 1000)
+            self.completed += 1
+            return result
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "wait_p99_ms": round(percentile(self.wait_ms, 99), 2),
+            "run_p99_ms": round(percentile(self.run_ms, 99), 2),
+        }
+
+
+def _timed(call):
+    """Выполняется в воркере: возвращает результат и момент старта."""
+    started_at = time.perf_counter()
+    return call(), started_at
+
+
+def _noop():
+    return None
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class Offloader:
+    def __init__(self, io_workers: int = IO_WORKERS, cpu_workers: int = CPU_WORKERS, max_queue: int = MAX_QUEUE):
+        self.io = _Pool(
+            "io", lambda: ThreadPoolExecutor(io_workers, thread_name_prefix="offload-io"), max_queue
+        )
+        # fork: дочерний процесс получает уже импортированные модули бота,
+        # поэтому в пул можно отдавать функции из bot.py без повторного импорта.
+        # Форк процесса с потоками может унести в ребёнка лок, захваченный чужим
+        # потоком, — процессы пула запускаются заранее через start()
+        self.cpu_workers = cpu_workers
+        self.cpu = _Pool(
+            "cpu",
+            lambda: ProcessPoolExecutor(cpu_workers, mp_context=multiprocessing.get_context("fork")),
+            max_queue,
+        )
+
+    def start(self) -> None:
+        """
+        Запускает процессы CPU-пула сразу. Вызывать при старте, пока в процессе
+        нет других потоков: с fork все воркеры создаются на первой задаче,
+        потом пул больше не форкает.
+        """
+        others = [t.name for t in threading.enumerate() if t is not threading.current_thread()]
+        if others:
+            logger.warning(f"CPU-пул стартует при работающих потоках: {others}")
+        for future in [self.cpu.executor.submit(_noop) for _ in range(self.cpu_workers)]:
+            future.result()
+
+    async def run_io(self, fn, *args, **kwargs):
+        return await self.io.run(fn, *args, **kwargs)
+
+    async def run_cpu(self, fn, *args, **kwargs):
+        return await self.cpu.run(fn, *args, **kwargs)
+
+    def shutdown(self) -> None:
+        self.io.shutdown()
+        self.cpu.shutdown()
+
+    def stats(self) -> dict:
+        return {"io": self.io.stats(), "cpu": self.cpu.stats()}
+
+
+def read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class LoopLagMonitor:
+    """Фоновая задача: раз в interval меряет опоздание пробуждения event loop."""
+
+    def __init__(self, interval: float = 0.1, window: int = 600, warn_ms: float = 100.0):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+        self.warn_ms = warn_ms
+        self.max_ms = 0.0
+        self._task = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (time.perf_counter() - expected) * 1000)
+            self.samples.append(lag_ms)
+            self.max_ms = max(self.max_ms, lag_ms)
+            if lag_ms > self.warn_ms:
+                logger.warning(f"Event loop заблокирован на {lag_ms:.0f} мс")
+
+    def stats(self) -> dict:
+        return {
+            "p50_ms": round(percentile(self.samples, 50), 2),
+            "p99_ms": round(percentile(self.samples, 99), 2),
+            "max_ms": round(self.max_ms, 2),
+            "samples": len(self.samples),
+        }
@@ -0,0 +1,185 @@
+"""
+Оптимизатор настроек риска: CF × ATR × день цикла.
+
+Для каждой комбинации методом Монте-Карло прогоняются сделки по формулам
+калькулятора (риск T пересчитывается после каждой сделки) до одного из исходов:
+- цель   — баланс дошёл до target% от депозита
+- слив   — просадка достигла лимита max_dd% (F <= 100 - max_dd)
+- таймаут — за max_trades торговых дней не случилось ни того ни другого
+
+День цикла растёт на 1 за торговый день и сбрасывается на 1 каждые
+CYCLE_LENGTH дней; в дни, где k-цикл равен 0, сделка пропускается.
+
+Результат сделки — как в формуле AB9: выигрыш +T·RR·0.82, проигрыш −T·1.05
+(% от депозита). Все комбинации используют одинаковые случайные числа,
+поэтому разница между ними — эффект настроек, а не шум.
+
+Пакетная оценка: риск T и RR зависят только от баланса% и дня цикла, поэтому
+считаются один раз на ячейку сетки (баланс% с шагом 0.01) и переиспользуются
+всеми путями. Комбинации делятся на пачки для пула процессов (simulate_batch).
+
+Итог — фронт Парето по трём целям: меньше сделок до цели, меньше вероятность
+слива, выше вероятность дойти до цели. Комбинации, которые доходят до цели
+реже MIN_SUCCESS, на фронт не попадают: их «быстрые» пути — редкая удача.
+"""
+
+import itertools
+import random
+
+from calculator import calc_J, calc_K, calc_Z, SETUP_NAMES, ATR_LABELS
+from grid import risk_base, GRID_ATRS, GRID_CFS, GRID_CYCLE_DAYS, MAX_RISK
+
+DEFAULT_TARGETS = {"1ph": 108.0, "2ph": 105.0, "funded": 105.0}
+DEFAULT_MAX_DD = 10.0
+DEFAULT_PATHS = 1000
+DEFAULT_MAX_TRADES = 60
+MIN_SUCCESS = 0.1   # доля путей, дошедших до цели, ниже которой комбинация не рассматривается
+
+F_STEPS = 10_000   # шаг сетки баланса% — 0.01
+MAX_CYCLE_DAY = 14  # дальше k-цикл не меняется
+CYCLE_LENGTH = 20   # торговых дней в месячном цикле
+
+
+def candidates(cfs=GRID_CFS, atrs=GRID_ATRS, start_days=GRID_CYCLE_DAYS) -> list:
+    """Все комбинации (cf, atr, день цикла на старте)."""
+    return list(itertools.product(cfs, atrs, start_days))
+
+
+class _RiskTable:
+    """
+    T% и RR по ячейке (баланс% с шагом 0.01, день цикла), считаются по требованию.
+    Ключ ячейки — int: шаг баланса * 32 + день.
+    """
+
+    def __init__(self, initial, phase, setup, atr, cf):
+        self.initial = initial
+        self.phase, self.setup, self.atr, self.cf = phase, setup, atr, cf
+        self.cells = {}
+
+    def compute(self, key: int) -> tuple:
+        b = self.initial * (key // 32) / F_STEPS
+        F, base = risk_base(b, self.initial, self.phase, self.setup, self.atr, self.cf, 1.0, 1.0)
+        cell = self.cells[key] = (min(MAX_RISK, base * calc_Z(F, key % 32)), calc_J(F, self.atr))
+        return cell
+
+
+def simulate(
+    candidate: tuple,
+    balance: float,
+    initial: float,
+    phase: str,
+    setup: int,
+    target: float,
+    max_dd: float = DEFAULT_MAX_DD,
+    paths: int = DEFAULT_PATHS,
+    max_trades: int = DEFAULT_MAX_TRADES,
+    seed: int = 0,
+) -> dict:
+    """Статистика исходов для одной комбинации (cf, atr, день цикла)."""
+    cf, atr, start_day = candidate
+    table = _RiskTable(initial, phase, setup, atr, cf)
+    winrate = calc_K(setup)
+    goal, ruin_level = initial * target / 100, initial * (100 - max_dd) / 100
+    rand = random.Random(seed).random
+    cells, compute = table.cells, table.compute
+    scale = F_STEPS / initial
+    # День цикла для i-го дня симуляции, уже обрезанный до 14
+    days = [min((start_day - 1 + i) % CYCLE_LENGTH + 1, MAX_CYCLE_DAY) for i in range(max_trades)]
+
+    hits = ruins = trades_to_goal = 0
+    for _ in range(paths):
+        b, trades = balance, 0
+        for day in days:
+            key = int(b * scale) * 32 + day
+            T, J = cells.get(key) or compute(key)
+            if T <= 0:
+                # k-цикл запрещает торговлю — день проходит без сделки
+                continue
+            trades += 1
+            risk = initial * T / 100
+            b += risk * J * 0.82 if rand() < winrate else -risk * 1.05
+            if b >= goal:
+                hits += 1
+                trades_to_goal += trades
+                break
+            if b <= ruin_level:
+                ruins += 1
+                break
+
+    return {
+        "cf": cf,
+        "atr": atr,
+        "day": start_day,
+        "success": hits / paths,
+        "ruin": ruins / paths,
+        "timeout": (paths - hits - ruins) / paths,
+        "trades": trades_to_goal / hits if hits else float("inf"),
+    }
+
+
+def simulate_batch(batch: list, *args, **kwargs) -> list:
+    """Пачка комбинаций — единица работы для пула процессов."""
+    return [simulate(c, *args, **kwargs) for c in batch]
+
+
+def split(items: list, parts: int) -> list:
+    """Делит список на parts примерно равных пачек."""
+    parts = max(1, min(parts, len(items)))
+    return [items[i::parts] for i in range(parts)]
+
+
+def _objectives(r: dict) -> tuple:
+    """Все цели — на минимум."""
+    return r["trades"], r["ruin"], -r["success"]
+
+
+def _dominates(a: tuple, b: tuple) -> bool:
+    return a != b and all(x <= y for x, y in zip(a, b))
+
+
+def pareto_front(results: list, min_success: float = MIN_SUCCESS) -> list:
+    """
+    Недоминируемые по (сделок до цели, вероятность слива, вероятность цели),
+    от быстрых к безопасным. Доходящие до цели реже min_success отбрасываются.
+    """
+    viable = [(_objectives(r), r) for r in results if r["success"] > 0 and r["success"] >= min_success]
+    front = [r for key, r in viable if not any(_dominates(other, key) for other, _ in viable)]
+    return sorted(front, key=_objectives)
+
+
+def recommend(front: list, max_ruin: float):
+    """Самая быстрая комбинация фронта с риском слива не выше max_ruin."""
+    return next((r for r in front if r["ruin"] <= max_ruin), None)
+
+
+def format_front(front: list, setup: int, phase: str, target: float, max_dd: float,
+                 max_ruin: float, paths: int) -> str:
+    lines = [
+        f"🧭 *Оптимизация риска — сетап №{setup}*",
+        f"{SETUP_NAMES.get(setup, '')} | {phase}",
+        f"Цель {target:g}% | лимит просадки {max_dd:g}% | {paths} симуляций",
+        "",
+    ]
+    if not front:
+        lines.append(f"⚠️ Ни при одной комбинации цель не достигается хотя бы в {MIN_SUCCESS:.0%} симуляций.")
+        return "\n".join(lines)
+
+    lines.append("```")
+    lines.append(f"{'CF':>4} {'ATR':>4} {'день':>4} {'сделок':>6} {'цель':>6} {'слив':>6}")
+    for r in front:
+        lines.append(
+            f"{r['cf']:>4} {r['atr']:>4} {r['day']:>4} {r['trades']:>6.1f} "
+            f"{r['success']:>6.1%} {r['ruin']:>6.1%}"
+        )
+    lines.append("```")
+
+    best = recommend(front, max_ruin)
+    if best is None:
+        lines.append(f"⚠️ Нет комбинаций с риском слива ≤ {max_ruin:.0%}.")
+    else:
+        lines.append(
+            f"✅ *Быстрее всего при сливе ≤ {max_ruin:.0%}:* CF {best['cf']}, "
+            f"ATR {ATR_LABELS.get(best['atr'], best['atr'])}, старт с {best['day']}-го дня — "
+            f"≈{best['trades']:.1f} сделок, слив {best['ruin']:.1%}"
+        )
+    return "\n".join(lines)
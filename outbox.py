@@ -0,0 +1,386 @@
+"""
+Единая очередь исходящих сообщений бота.
+
+Подключается к PTB как rate limiter (ApplicationBuilder().rate_limiter(...)),
+поэтому через неё проходят все вызовы Bot API — reply_text, reply_photo,
+reply_document, рассылка — без правок в обработчиках.
+
+- Отправки в один чат выполняются строго по очереди (FIFO на чат)
+- Глобальный токен-бакет держит общую скорость ниже лимита Telegram,
+  бакет на чат — не больше ~1 сообщения в секунду с небольшим запасом
+- RetryAfter: пауза бакета этого чата и повтор того же запроса. Telegram не
+  говорит, какой лимит сработал: если флуд-контроль за последние секунды
+  пришёл в FLOOD_CHATS разных чатов (или на вызов вне чата) — это общий лимит
+  бота, и на паузу встаёт глобальный бакет
+- Текст длиннее 4096 символов режется по абзацам/строкам; куски ставятся
+  в очередь чата разом и уходят друг за другом без ожидания обработчика.
+  С parse_mode Markdown/HTML режется только между сущностями разметки
+  (не внутри *…*, `…`, <b>…</b>); негде — уходит целиком, как есть
+- Приоритеты: INTERACTIVE (ответы пользователям) всегда раньше BULK
+  (промо, рассылка); BULK занимает не все воркеры — часть держится под ответы
+  Приоритет передаётся через rate_limit_args: bot.send_message(..., rate_limit_args=BULK)
+
+Вызовы, не относящиеся к отправке в чат (answerCallbackQuery, getChatMember,
+setWebhook, sendChatAction, ...), идут сразу, только с повтором по RetryAfter.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from broadcast import TokenBucket
+from offload import percentile
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "ответы", BULK: "промо"}
+
+MESSAGE_LIMIT = 4096
+GLOBAL_RATE = 25.0        # Telegram: ~30 сообщений/с на бота
+PER_CHAT_RATE = 1.0
+PER_CHAT_BURST = 3        # ответ + картинка + кусок длинного текста уходят без паузы
+CONCURRENCY = 8
+RESERVED_WORKERS = 2      # воркеры, которые BULK не занимает
+MAX_RETRIES = 3
+IDLE_CHAT_TTL = 60.0      # состояние чата без отправок столько секунд — удаляется
+FLOOD_CHATS = 2           # RetryAfter в стольких чатах одновременно — лимит общий, не чата
+
+_NOT_QUEUED = {"sendChatAction"}
+
+
+def _is_chat_send(endpoint: str) -> bool:
+    return (endpoint.startswith("send") or endpoint in ("copyMessage", "forwardMessage")) \
+        and endpoint not in _NOT_QUEUED
+
+
+def _markdown_inside(text: str) -> list:
+    """inside[i] — позиция i внутри сущности Markdown (legacy): *…*, _…_, `…`, ```…```, [..](..)."""
+    inside = [False] * (len(text) + 1)
+    state, i = None, 0
+    while i < len(text):
+        inside[i] = state is not None
+        if state in ("`", "```"):
+            if text.startswith(state, i):
+                i += len(state)
+                state = None
+                continue
+        elif state is None and text[i] == "\\":
+            i += 2
+            continue
+        elif state is None and text.startswith("```", i):
+            state, i = "```", i + 3
+            continue
+        elif state is None and text[i] in "*_`":
+            state = text[i]
+        elif state is None and text[i] == "[":
+            state = "]"
+        elif state == "]" and text[i] == "]":
+            state = ")" if text.startswith("(", i + 1) else None
+        elif state == ")" and text[i] == ")":
+            state = None
+        elif state == text[i]:
+            state = None
+        i += 1
+    return inside
+
+
+def _html_inside(text: str) -> list:
+    """inside[i] — позиция i внутри тега или между открывающим и закрывающим тегом."""
+    inside = [False] * (len(text) + 1)
+    depth, in_tag, closing = 0, False, False
+    for i, c in enumerate(text):
+        inside[i] = depth > 0 or in_tag
+        if c == "<":
+            in_tag, closing = True, text.startswith("</", i)
+        elif c == ">" and in_tag:
+            in_tag = False
+            if closing:
+                depth = max(0, depth - 1)
+            elif text[i - 1] != "/":
+                depth += 1
+    return inside
+
+
+_MARKUP_SCANNERS = {"markdown": _markdown_inside, "html": _html_inside}
+
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT, parse_mode: str = None):
+    """
+    Режет текст на куски не длиннее limit: по абзацу, строке, пробелу, иначе жёстко.
+    С parse_mode — только в местах вне сущностей разметки; если такого места
+    нет или разметка неизвестна (MarkdownV2) — None: резать нельзя.
+    """
+    inside = None
+    if parse_mode:
+        scanner = _MARKUP_SCANNERS.get(parse_mode.lower())
+        if scanner is None:
+            return None
+        inside = scanner(text)
+    pieces, start = [], 0
+    while len(text) - start > limit:
+        cut = -1
+        for sep in ("\n\n", "\n", " "):
+            cut = text.rfind(sep, start, start + limit)
+            while cut > start and inside is not None and inside[cut]:
+                cut = text.rfind(sep, start, cut)
+            if cut > start:
+                break
+        if cut <= start:
+            if inside is not None:
+                return None
+            cut = start + limit
+        pieces.append(text[start:cut].rstrip())
+        start = cut
+        while start < len(text) and text[start].isspace():
+            start += 1
+    pieces.append(text[start:])
+    return [p for p in pieces if p]
+
+
+def split_request(endpoint: str, data: dict) -> list:
+    """
+    Длинный sendMessage → несколько запросов. Кнопки — у последнего куска,
+    ответ на сообщение (reply_parameters) — у первого. С явными entities
+    не режем: смещения не пересчитать. С parse_mode режем только между
+    сущностями разметки — иначе Telegram отклонит кусок с "can't parse entities".
+    """
+    text = data.get("text")
+    if endpoint != "sendMessage" or not isinstance(text, str) or len(text) <= MESSAGE_LIMIT \
+            or data.get("entities"):
+        return [data]
+    pieces = split_text(text, parse_mode=data.get("parse_mode"))
+    if pieces is None:
+        return [data]
+    requests = []
+    for i, piece in enumerate(pieces):
+        part = {**data, "text": piece}
+        if i < len(pieces) - 1:
+            part.pop("reply_markup", None)
+        if i > 0:
+            part.pop("reply_parameters", None)
+            part.pop("reply_to_message_id", None)
+        requests.append(part)
+    return requests
+
+
+def _retry_delay(e: RetryAfter) -> float:
+    return float(getattr(e.retry_after, "total_seconds", lambda: e.retry_after)())
+
+
+class _Job:
+    __slots__ = ("priority", "callback", "args", "kwargs", "future", "queued_at")
+
+    def __init__(self, priority, callback, args, kwargs):
+        self.priority = priority
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.perf_counter()
+
+
+class _Chat:
+    __slots__ = ("jobs", "bucket", "busy", "last_used")
+
+    def __init__(self, rate, burst):
+        self.jobs = deque()
+        self.bucket = TokenBucket(rate, burst)
+        self.busy = False
+        self.last_used = time.monotonic()
+
+
+class Outbox(BaseRateLimiter):
+    def __init__(self, rate: float = GLOBAL_RATE, per_chat_rate: float = PER_CHAT_RATE,
+                 per_chat_burst: int = PER_CHAT_BURST, concurrency: int = CONCURRENCY,
+                 max_retries: int = MAX_RETRIES):
+        self.bucket = TokenBucket(rate)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.concurrency = concurrency
+        self.bulk_limit = max(1, concurrency - RESERVED_WORKERS)
+        self.max_retries = max_retries
+        self._chats: dict = {}
+        self._ready: list = []            # куча (приоритет головы очереди, порядок, chat_id)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._workers: list = []
+        self._bulk_inflight = 0
+        self._flooded: dict = {}          # _Chat -> до какого момента в нём флуд-контроль
+        self.splits = 0
+        self.passthrough = 0
+        self.counters = {p: {"sent": 0, "failed": 0, "retries": 0} for p in PRIORITY_NAMES}
+        self.wait_ms = {p: deque(maxlen=1000) for p in PRIORITY_NAMES}
+        self.send_ms = deque(maxlen=1000)
+
+    # ─── BaseRateLimiter ───
+
+    async def initialize(self) -> None:
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def shutdown(self) -> None:
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for chat in self._chats.values():
+            for job in chat.jobs:
+                job.future.cancel()
+        self._chats.clear()
+        self._ready.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None or not _is_chat_send(endpoint):
+            self.passthrough += 1
+            return await self._call(callback, args, kwargs, None, None)
+
+        priority = rate_limit_args if rate_limit_args in PRIORITY_NAMES else INTERACTIVE
+        parts = split_request(endpoint, data)
+        if len(parts) > 1:
+            self.splits += 1
+        futures = [self._enqueue(chat_id, priority, callback, (endpoint, part), kwargs) for part in parts]
+        results = await asyncio.gather(*futures)
+        return results[-1]
+
+    # ─── ОЧЕРЕДЬ ───
+
+    def _enqueue(self, chat_id, priority, callback, args, kwargs) -> asyncio.Future:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(self.per_chat_rate, self.per_chat_burst)
+        job = _Job(priority, callback, args, kwargs)
+        chat.jobs.append(job)
+        if not chat.busy and len(chat.jobs) == 1:
+            self._schedule(chat_id, chat)
+        return job.future
+
+    def _schedule(self, chat_id, chat) -> None:
+        heapq.heappush(self._ready, (chat.jobs[0].priority, next(self._seq), chat_id))
+        self._wakeup.set()
+
+    async def _next_chat(self):
+        """Чат с самой приоритетной головой очереди. BULK ждёт, если занято bulk_limit воркеров."""
+        while True:
+            if self._ready and (self._ready[0][0] != BULK or self._bulk_inflight < self.bulk_limit):
+                return heapq.heappop(self._ready)[2]
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id = await self._next_chat()
+            chat = self._chats[chat_id]
+            job = chat.jobs.popleft()
+            chat.busy = True
+            if job.priority == BULK:
+                self._bulk_inflight += 1
+            try:
+                await self._run_job(chat, job)
+            finally:
+                if job.priority == BULK:
+                    self._bulk_inflight -= 1
+                chat.busy = False
+                chat.last_used = time.monotonic()
+                if chat.jobs:
+                    self._schedule(chat_id, chat)
+                else:
+                    self._wakeup.set()   # освободился слот BULK
+                    self._prune()
+
+    async def _run_job(self, chat: _Chat, job: _Job) -> None:
+        if job.future.done():   # обработчик отменён — не отправляем
+            return
+        await chat.bucket.acquire()
+        await self.bucket.acquire()
+        if job.future.done():
+            return
+        self.wait_ms[job.priority].append((time.perf_counter() - job.queued_at) * 1000)
+        started = time.perf_counter()
+        try:
+            result = await self._call(job.callback, job.args, job.kwargs, job.priority, chat)
+        except Exception as e:
+            self.counters[job.priority]["failed"] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        self.send_ms.append((time.perf_counter() - started) * 1000)
+        self.counters[job.priority]["sent"] += 1
+        if not job.future.done():
+            job.future.set_result(result)
+
+    async def _call(self, callback, args, kwargs, priority, chat):
+        """Запрос с повтором по RetryAfter: на паузу встаёт бакет чата или, при общем лимите, глобальный."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = _retry_delay(e) + 0.5
+                logger.warning(f"RetryAfter {delay:.1f}с ({args[0]}), повтор {attempt + 1}/{self.max_retries}")
+                if priority is not None:
+                    self.counters[priority]["retries"] += 1
+                self._pause(chat, delay)
+                await asyncio.sleep(delay)
+
+    def _pause(self, chat, delay: float) -> None:
+        """RetryAfter в одном чате — пауза только его бакета; в нескольких сразу — общая."""
+        if chat is None:
+            self.bucket.pause(delay)
+            return
+        chat.bucket.pause(delay)
+        now = time.monotonic()
+        self._flooded[chat] = now + delay
+        for key in [k for k, until in self._flooded.items() if until <= now]:
+            del self._flooded[key]
+        if len(self._flooded) >= FLOOD_CHATS:
+            logger.warning(f"RetryAfter в {len(self._flooded)} чатах — пауза общей отправки")
+            self.bucket.pause(delay)
+
+    def _prune(self) -> None:
+        """Удаляет состояние чатов, которые давно ничего не отправляли."""
+        if len(self._chats) < 1000:
+            return
+        cutoff = time.monotonic() - IDLE_CHAT_TTL
+        for chat_id in [c for c, chat in self._chats.items()
+                        if not chat.jobs and not chat.busy and chat.last_used < cutoff]:
+            del self._chats[chat_id]
+
+    # ─── МЕТРИКИ ───
+
+    def stats(self) -> dict:
+        queued = {p: 0 for p in PRIORITY_NAMES}
+        for chat in self._chats.values():
+            for job in chat.jobs:
+                queued[job.priority] += 1
+        return {
+            "queued": queued,
+            "chats": len(self._chats),
+            "splits": self.splits,
+            "passthrough": self.passthrough,
+            "counters": self.counters,
+            "wait_p50_ms": {p: round(percentile(self.wait_ms[p], 50), 1) for p in PRIORITY_NAMES},
+            "wait_p99_ms": {p: round(percentile(self.wait_ms[p], 99), 1) for p in PRIORITY_NAMES},
+            "send_p99_ms": round(percentile(self.send_ms, 99), 1),
+        }
+
+    def format_stats(self) -> str:
+        s = self.stats()
+        lines = [f"Outbox: чатов {s['chats']} | разбито длинных {s['splits']} | вне очереди {s['passthrough']} "
+                 f"| send p99 {s['send_p99_ms']} мс"]
+        for p, name in PRIORITY_NAMES.items():
+            c = s["counters"][p]
+            lines.append(
+                f"  {name}: в очереди {s['queued'][p]}, отправлено {c['sent']}, ошибок {c['failed']}, "
+                f"повторов {c['retries']} | ожидание p50 {s['wait_p50_ms'][p]} / p99 {s['wait_p99_ms'][p]} мс"
+            )
+        return "\n".join(lines)
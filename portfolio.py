@@ -0,0 +1,157 @@
+"""
+Портфель проп-счетов: риск по всем счетам одним пакетом.
+
+Пользователь заводит счета под именами (ftmo1, fn-100k, ...). Расчёт каждого
+счёта кэшируется по его входным данным, поэтому после изменения баланса
+одного счёта пересчитывается только он.
+
+Агрегированная экспозиция учитывает, что сетапы торгуют одни и те же или
+коррелирующие инструменты: сетап 4 (SP500 + NAS100) вместе с сетапами 1–3
+(NAS100) — это одна ставка на индексы США, и при одновременном стопе теряется
+сумма рисков всех таких счетов.
+"""
+
+import re
+from functools import lru_cache
+
+from calculator import full_calculate
+from grid import MAX_RISK
+from calc_input import OPTIONAL_DEFAULTS
+from storage import read_json, JsonWriter
+
+MAX_ACCOUNTS = 20
+ACCOUNT_NAME_RE = re.compile(r"[\w-]{1,20}")
+
+# Обязательные поля счёта; день цикла по умолчанию — первый
+REQUIRED_FIELDS = ("balance", "initial", "phase", "setup")
+ACCOUNT_DEFAULTS = {**OPTIONAL_DEFAULTS, "cycle_day": 1}
+
+# Инструменты сетапа: риск делится между ними поровну
+SETUP_INSTRUMENTS = {
+    1: ("NAS100",), 2: ("NAS100",), 3: ("NAS100",), 4: ("SP500", "NAS100"),
+    5: ("SP500",), 6: ("US30",), 7: ("GER40",), 8: ("GER40",),
+    9: ("UK100",), 10: ("JPY100",), 11: ("XAU",), 12: ("XAU",),
+    13: ("XAG",), 14: ("EURUSD",), 15: ("EURUSD",), 16: ("USDCAD",),
+}
+
+# Инструменты, которые обычно двигаются вместе — стоп по ним приходит одновременно
+CORRELATED_GROUPS = {
+    "Индексы США": ("NAS100", "SP500", "US30"),
+    "Европа": ("GER40", "UK100"),
+    "Металлы": ("XAU", "XAG"),
+}
+
+LOSS_FACTOR = 1.05   # проигрыш с проскальзыванием, как в формуле AB9
+
+
+@lru_cache(maxsize=4096)
+def account_risk(balance, initial, phase, setup, atr, cf, cycle_day) -> dict:
+    """Расчёт одного счёта. Кэш по входным данным — неизменённые счета не пересчитываются."""
+    return full_calculate(balance, initial, phase, setup, atr=atr, cycle_day=cycle_day, cf=cf)
+
+
+def _inputs(account: dict) -> tuple:
+    a = {**ACCOUNT_DEFAULTS, **account}
+    return (a["balance"], a["initial"], a["phase"], a["setup"], a["atr"], a["cf"], a["cycle_day"])
+
+
+def portfolio_risk(accounts: dict):
+    """
+    ([(имя, результат full_calculate)] по имени, сколько счетов реально пересчитано).
+    """
+    misses = account_risk.cache_info().misses
+    rows = [(name, account_risk(*_inputs(accounts[name]))) for name in sorted(accounts)]
+    return rows, account_risk.cache_info().misses - misses
+
+
+def exposure(rows: list) -> dict:
+    """
+    Сумма риска в $ по инструментам и группам корреляции.
+    Счёт с сетапом на два инструмента делит свой риск пополам.
+    """
+    by_instrument: dict = {}
+    for _, r in rows:
+        instruments = SETUP_INSTRUMENTS.get(r["setup"], ())
+        for inst in instruments:
+            by_instrument[inst] = by_instrument.get(inst, 0.0) + r["U"] / len(instruments)
+    by_group = {
+        group: sum(by_instrument.get(i, 0.0) for i in members)
+        for group, members in CORRELATED_GROUPS.items()
+        if any(i in by_instrument for i in members)
+    }
+    return {"instruments": by_instrument, "groups": by_group}
+
+
+def format_portfolio(rows: list, recomputed: int = None) -> str:
+    capital = sum(r["balance"] for _, r in rows)
+    total = sum(r["U"] for _, r in rows)
+    name_w = max(4, *(len(n) for n, _ in rows))
+
+    lines = [f"💼 *Портфель* — счетов: {len(rows)}, капитал ${capital:,.0f}", "```"]
+    lines.append(f"{'Счёт'.ljust(name_w)} {'сет':>3} {'фаза':>6} {'бал%':>6} {'риск%':>5} {'риск$':>8}")
+    for name, r in rows:
+        lines.append(
+            f"{name.ljust(name_w)} {r['setup']:>3} {r['phase']:>6} {r['F']:>6.1f} "
+            f"{r['T']:>5.2f} {r['U']:>8,.0f}"
+        )
+    lines.append("```")
+    lines.append(f"Суммарный риск: *${total:,.0f}* ({total / capital:.2%} капитала)")
+
+    exp = exposure(rows)
+    lines.append("\n📡 *Экспозиция по инструментам:*")
+    for inst, usd in sorted(exp["instruments"].items(), key=lambda kv: -kv[1]):
+        lines.append(f"  {inst}: ${usd:,.0f}")
+
+    if exp["groups"]:
+        lines.append("\n🔗 *Коррелирующие группы* (стоп приходит одновременно):")
+        for group, usd in sorted(exp["groups"].items(), key=lambda kv: -kv[1]):
+            loss = usd * LOSS_FACTOR
+            pct = loss / capital * 100
+            warn = " ⚠️" if pct > MAX_RISK else ""
+            lines.append(f"  {group}: ${usd:,.0f} → худший случай −${loss:,.0f} ({pct:.2f}%){warn}")
+        if any(usd * LOSS_FACTOR / capital * 100 > MAX_RISK for usd in exp["groups"].values()):
+            lines.append(f"\n⚠️ Одновременный стоп по группе — больше {MAX_RISK}% капитала. "
+                         "Сократи риск на части счетов или разнеси входы по времени.")
+    if recomputed is not None:
+        lines.append(f"\n♻️ Пересчитано счетов: {recomputed} из {len(rows)}")
+    return "\n".join(lines)
+
+
+def account_missing(account: dict) -> list:
+    return [f for f in REQUIRED_FIELDS if f not in account]
+
+
+class PortfolioStore:
+    """Счета пользователей: {user_id: {имя: поля калькулятора}} (JSON на диске, запись отложенная)."""
+
+    def __init__(self, path: str, run_io=None):
+        self.path = path
+        self.data = read_json(path, {})
+        self.writer = JsonWriter(path, lambda: self.data, run_io=run_io)
+
+    def get(self, user_id: int) -> dict:
+        return {name: dict(fields) for name, fields in self.data.get(str(user_id), {}).items()}
+
+    def upsert(self, user_id: int, name: str, fields: dict) -> dict:
+        """Создаёт счёт или обновляет указанные поля. Возвращает итоговые поля счёта."""
+        accounts = self.data.setdefault(str(user_id), {})
+        if name not in accounts and len(accounts) >= MAX_ACCOUNTS:
+            raise ValueError(f"не больше {MAX_ACCOUNTS} счетов")
+        merged = {**accounts.get(name, {}), **fields}
+        merged.pop("prev_profit", None)
+        if accounts.get(name) != merged:
+            accounts[name] = merged
+            self.writer.mark()
+        return dict(merged)
+
+    def remove(self, user_id: int, name: str = None) -> bool:
+        """Удаляет счёт, или все счета, если name не указан."""
+        accounts = self.data.get(str(user_id), {})
+        if name is None:
+            removed = bool(accounts)
+            self.data.pop(str(user_id), None)
+        else:
+            removed = accounts.pop(name, None) is not None
+        if removed:
+            self.writer.mark()
+        return removed
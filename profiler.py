@@ -0,0 +1,93 @@
+"""
+Семплирующий профайлер работающего процесса.
+
+Фоновый поток раз в interval снимает стек потока event loop через
+sys._current_frames() и считает одинаковые стеки. Пока профайлер не
+запущен — никаких накладных расходов нет. Поток-семплер получает GIL не чаще
+sys.getswitchinterval() (5 мс), поэтому очень короткие участки кода между
+await недооцениваются; select в топе — это простой event loop.
+
+Результат:
+- top()       — функции по собственному (self) и полному (total) времени
+- collapsed() — формат "f1;f2;f3 count" для flamegraph.pl / speedscope.app
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+DEFAULT_INTERVAL = 0.005
+MAX_DEPTH = 64
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = DEFAULT_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, thread_id: int = None) -> None:
+        """Начинает семплирование потока thread_id (по умолчанию — текущего)."""
+        target = thread_id if thread_id is not None else threading.get_ident()
+        self.stacks.clear()
+        self.samples = 0
+        self._stop.clear()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample, args=(target,), name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.duration = time.perf_counter() - self._started
+
+    def _sample(self, target: int) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            if frame is None or target == own:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+            self.samples += 1
+
+    def top(self, limit: int = 15) -> list:
+        """[(функция, self %, total %)] по убыванию self."""
+        if not self.samples:
+            return []
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+        ranked = sorted(total, key=lambda f: (own[f], total[f]), reverse=True)[:limit]
+        return [(f, own[f] / self.samples * 100, total[f] / self.samples * 100) for f in ranked]
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common())
+
+    def format_top(self, limit: int = 15) -> str:
+        lines = [f"🔬 Профиль: {self.duration:.1f} с, {self.samples} семплов (шаг {self.interval * 1000:.0f} мс)",
+                 f"{'self%':>6} {'total%':>7}  функция"]
+        for label, own, total in self.top(limit):
+            lines.append(f"{own:6.1f} {total:7.1f}  {label}")
+        return "\n".join(lines)
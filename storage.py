@@ -0,0 +1,110 @@
+"""
+Простое файловое хранилище состояния бота (JSON в DATA_DIR).
+
+JsonWriter — отложенная запись для хранилищ, которые меняются на горячем
+пути (новый пользователь, /calc): изменения помечают файл, а на диск он уходит
+одной записью раз в WRITE_DELAY через пул потоков, мимо event loop.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import weakref
+
+logger = logging.getLogger(__name__)
+
+WRITE_DELAY = 1.0       # изменения за это время уходят одной записью
+
+_writers = weakref.WeakSet()
+
+
+def _write_text(path: str, text: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def write_json(path: str, data) -> None:
+    """Атомарная запись JSON (через временный файл)."""
+    _write_text(path, json.dumps(data, ensure_ascii=False))
+
+
+def read_json(path: str, default):
+    """Читает JSON; при отсутствии или порче файла возвращает default."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать {path}: {e}")
+        return default
+
+
+class JsonWriter:
+    """
+    Отложенная атомарная запись JSON. mark() только помечает данные изменёнными;
+    через delay снимок сериализуется в event loop (данные меняются только там)
+    и пишется в пуле потоков. Файл пишет одна задача за раз — изменения во время
+    записи уйдут следующей. Без работающего event loop (скрипты) mark() пишет сразу.
+    """
+
+    def __init__(self, path: str, snapshot, delay: float = WRITE_DELAY, run_io=None):
+        self.path = path
+        self.snapshot = snapshot          # () -> данные для записи
+        self.delay = delay
+        self.run_io = run_io              # Offloader.run_io; None — asyncio.to_thread
+        self.dirty = False
+        self.writes = 0
+        self._task = None
+        self._wakeup = None
+        _writers.add(self)
+
+    def mark(self) -> None:
+        self.dirty = True
+        if self._task is not None and not self._task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.write_now()
+            return
+        self._wakeup = asyncio.Event()
+        self._task = loop.create_task(self._run())
+
+    def write_now(self) -> None:
+        self.dirty = False
+        write_json(self.path, self.snapshot())
+        self.writes += 1
+
+    async def flush(self) -> None:
+        """Пишет отложенное сразу и ждёт записи (при остановке)."""
+        if self._task is not None and not self._task.done():
+            self._wakeup.set()
+            await self._task
+
+    async def _run(self) -> None:
+        while self.dirty:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.delay)
+            except asyncio.TimeoutError:
+                pass
+            self.dirty = False
+            text = json.dumps(self.snapshot(), ensure_ascii=False)
+            try:
+                await (self.run_io or asyncio.to_thread)(_write_text, self.path, text)
+                self.writes += 1
+            except Exception as e:
+                logger.warning(f"Не удалось записать {self.path}: {e}")
+                self.dirty = True         # повторим через delay
+                if self._wakeup.is_set():
+                    return                # идёт остановка — не крутимся на сломанном диске
+
+
+async def flush_all() -> None:
+    """Дописывает все отложенные JsonWriter (shutdown)."""
+    for writer in list(_writers):
+        await writer.flush()
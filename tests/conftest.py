@@ -0,0 +1,18 @@
+"""
+Общая настройка тестов: корень репозитория в sys.path и окружение,
+которое bot.py читает при импорте. DATA_DIR — временный каталог.
+"""
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+for _key, _value in {
+    "BOT_TOKEN": "0:test", "OPENROUTER_API_KEY": "test", "CHANNEL_ID": "-1",
+    "PUBLIC_CHANNEL_ID": "-2", "WEBHOOK_URL": "http://localhost",
+}.items():
+    os.environ.setdefault(_key, _value)
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="tests-")
@@ -0,0 +1,75 @@
+import pytest
+
+from calc_input import parse_calc_text, parse_number, looks_like_calc, missing_fields
+
+
+def test_strict_form():
+    fields, errors, unknown = parse_calc_text("48500 50000 1ph 3 atr=1.0 cf=0.7 day=5 profit=120")
+    assert fields == {"balance": 48500.0, "initial": 50000.0, "phase": "1ph", "setup": 3,
+                      "atr": 1.0, "cf": 0.7, "cycle_day": 5, "prev_profit": 120.0}
+    assert errors == [] and unknown == 0
+
+
+def test_free_text():
+    fields, errors, _ = parse_calc_text("баланс 48 500, депозит 50к, челлендж, сетап №3, флэт, день 5")
+    assert fields == {"balance": 48500.0, "initial": 50000.0, "phase": "1ph", "setup": 3,
+                      "atr": 0.7, "cycle_day": 5}
+    assert errors == []
+
+
+def test_negative_profit_is_clamped_like_the_wizard():
+    fields, errors, _ = parse_calc_text("48500 50000 1ph 3 profit=-500")
+    assert fields["prev_profit"] == 0.0
+    assert errors == []
+
+
+@pytest.mark.parametrize("text", ["balance=-5 50000 1ph 3", "-48500 50000 1ph 3", "48500 dep=-1 1ph 3"])
+def test_negative_balance_or_deposit_is_rejected(text):
+    _, errors, _ = parse_calc_text(text)
+    assert errors
+    assert not looks_like_calc(text)
+
+
+@pytest.mark.parametrize("text, balance", [("2.5k 50k 1ph 3", 2500.0), ("1.2m 1m 1ph 3", 1_200_000.0),
+                                           ("баланс 48.5к депозит 50к фаза 1ph 3", 48500.0)])
+def test_thousand_and_million_suffixes(text, balance):
+    fields, errors, _ = parse_calc_text(text)
+    assert errors == []
+    assert fields["balance"] == balance
+
+
+@pytest.mark.parametrize("text", ["2.5x 50000 1ph 3", "48500abc 50000 1ph 3"])
+def test_number_with_trailing_junk_rejects_the_input(text):
+    _, errors, _ = parse_calc_text(text)
+    assert errors
+    assert not looks_like_calc(text)
+
+
+@pytest.mark.parametrize("text", ["48500 50000 1ph 3 cf=nan", "48500 50000 1ph 3 cf=inf",
+                                  "48500 50000 1ph 3 cf=1e999", "48500 50000 1ph 3 cf="])
+def test_non_finite_or_missing_value_is_an_error(text):
+    _, errors, _ = parse_calc_text(text)
+    assert "cf" in errors
+
+
+def test_range_with_dash_is_not_a_negative_number():
+    fields, errors, _ = parse_calc_text("48500-50000 1ph 3")
+    assert (fields["balance"], fields["initial"]) == (48500.0, 50000.0)
+    assert errors == []
+
+
+def test_parse_number():
+    assert parse_number("48,5k") == 48500.0
+    assert parse_number("−500") == -500.0
+    for bad in ("nan", "inf", "5abc", "", "1e999", "9" * 400):
+        with pytest.raises(ValueError):
+            parse_number(bad)
+
+
+def test_question_is_not_a_calc():
+    assert not looks_like_calc("какой сетап лучше для nas100 при балансе 48500?")
+
+
+def test_missing_fields():
+    assert missing_fields({"balance": 1, "initial": 1, "phase": "1ph"}) == ["setup", "cycle_day"]
+    assert "atr" in missing_fields({}, full=True)
@@ -0,0 +1,59 @@
+import pytest
+
+from calculator import full_calculate
+from grid import grid_by_day, grid_by_atr, grid_report, GRID_BALANCE_PCTS, GRID_CYCLE_DAYS, GRID_ATRS, GRID_CFS
+
+bot = pytest.importorskip("bot")
+
+
+def test_grid_by_day_matches_full_calculate():
+    matrix = grid_by_day(50000, "1ph", 3, atr=0.7, cf=1.5, prev_profit=200)
+    for row, pct in zip(matrix, GRID_BALANCE_PCTS):
+        for value, day in zip(row, GRID_CYCLE_DAYS):
+            r = full_calculate(50000 * pct / 100, 50000, "1ph", 3, atr=0.7, cycle_day=day, cf=1.5, prev_profit=200)
+            assert value == pytest.approx(r["T"], abs=0.01)
+
+
+def test_grid_by_atr_matches_full_calculate():
+    matrix = grid_by_atr(48500, 50000, "2ph", 7, cycle_day=6)
+    for row, atr in zip(matrix, GRID_ATRS):
+        for value, cf in zip(row, GRID_CFS):
+            r = full_calculate(48500, 50000, "2ph", 7, atr=atr, cycle_day=6, cf=cf)
+            assert value == pytest.approx(r["T"], abs=0.01)
+
+
+def test_grid_report_modes():
+    day = grid_report("day", 50000, "1ph", 3)
+    assert "баланс% (строки) × день цикла" in day and "1-5" in day
+    atr = grid_report("atr", 50000, "1ph", 3, balance=48500, cycle_day=5)
+    assert "ATR (строки) × CF" in atr and "день 5" in atr
+
+
+def test_parse_grid_args_day_mode():
+    p = bot.parse_grid_args(["50k", "1ph", "3", "cf=0.7", "img"])
+    assert (p["mode"], p["initial"], p["cf"], p["img"], p["ignored"]) == ("day", 50000.0, 0.7, True, [])
+
+
+def test_parse_grid_args_atr_mode():
+    p = bot.parse_grid_args(["50000", "1ph", "3", "atr", "48500", "day=5"])
+    assert (p["mode"], p["balance"], p["cycle_day"], p["ignored"]) == ("atr", 48500.0, 5, [])
+
+
+@pytest.mark.parametrize("cf", ["nan", "inf", "0", "-1", "abc"])
+def test_parse_grid_args_rejects_bad_cf(cf):
+    with pytest.raises(ValueError):
+        bot.parse_grid_args(["50000", "1ph", "3", f"cf={cf}"])
+
+
+@pytest.mark.parametrize("args", [["nan", "1ph", "3"], ["50000", "3ph", "3"], ["50000", "1ph", "17"], ["50000", "1ph"]])
+def test_parse_grid_args_rejects_bad_positionals(args):
+    with pytest.raises(ValueError):
+        bot.parse_grid_args(args)
+
+
+def test_parse_grid_args_reports_ignored_arguments():
+    # В режиме day баланс (4-й аргумент) и day= — не оси таблицы
+    p = bot.parse_grid_args(["50000", "1ph", "3", "48500", "day=5", "foo=1"])
+    assert p["ignored"] == ["48500", "day=5", "foo=1"]
+    p = bot.parse_grid_args(["50000", "1ph", "3", "atr", "48500", "99", "cf=0.7"])
+    assert p["ignored"] == ["99", "cf=0.7"]
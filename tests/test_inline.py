@@ -0,0 +1,26 @@
+import pytest
+
+bot = pytest.importorskip("bot")
+
+
+def test_example_from_request_without_saved_day():
+    # @bot 48500 50000 1ph 3 — без сохранённого day= день цикла берётся 1
+    fields = bot.inline_fields(1001, "48500 50000 1ph 3")
+    assert fields is not None
+    assert fields["cycle_day"] == 1
+    variants = bot.inline_variants(fields)
+    assert len(variants) == len(bot.ATR_LABELS)
+    assert variants[0][0] == "1.0"      # ATR по умолчанию — первым
+
+
+def test_saved_day_wins_over_inline_default():
+    bot.calc_defaults.data["1002"] = {"cycle_day": 5}
+    try:
+        assert bot.inline_fields(1002, "48500 50000 1ph 3")["cycle_day"] == 5
+        assert bot.inline_fields(1002, "48500 50000 1ph 3 day=2")["cycle_day"] == 2
+    finally:
+        bot.calc_defaults.data.pop("1002")
+
+
+def test_incomplete_query_has_no_results():
+    assert bot.inline_fields(1003, "48500 1ph") is None
@@ -0,0 +1,45 @@
+import pytest
+
+from intents import classify, extract_setup, LLM
+
+
+@pytest.mark.parametrize("text, intent, setup", [
+    ("покажи сетап 5", "show_setup", 5),
+    ("Сетап №12", "show_setup", 12),
+    ("винрейт 3 сетапа", "winrate", 3),
+    ("Какой винрейт у сетапа 3", "winrate", 3),
+    ("скачать калькулятор", "calculator_file", None),
+    ("Риск-менеджмент?", "calculator_file", None),
+    ("как купить стратегию?", "buy", None),
+    ("сколько стоит доступ к боту", "buy", None),
+    ("Какие сетапы есть?", "list_setups", None),
+    ("список сетапов", "list_setups", None),
+    ("покажи все сетапы", "list_setups", None),
+    ("сколько всего сетапов?", "list_setups", None),
+])
+def test_routed_locally(text, intent, setup):
+    got, slots = classify(text)
+    assert got == intent
+    assert slots.get("setup") == setup
+
+
+@pytest.mark.parametrize("text", [
+    # Вопросы по существу со словами шаблонных намерений — к LLM
+    "какие сетапы лучше торговать в пятницу?",
+    "все сетапы по NAS100 работают на 8H?",
+    "какие сетапы подходят для фазы funded",
+    "сколько сетапов работает на GER40 утром?",
+    "как войти по сетапу 3?",
+    "почему винрейт сетапа 3 выше?",
+    "какая цена входа в сетапе 4?",
+    "покажи сетап",
+    "объясни что такое FVG",
+])
+def test_substantive_questions_go_to_llm(text):
+    assert classify(text)[0] == LLM
+
+
+def test_extract_setup():
+    assert extract_setup("разбор по 7-му сетапу") == 7
+    assert extract_setup("сетап 99") is None
+    assert extract_setup("без номера") is None
@@ -0,0 +1,32 @@
+from optimizer import pareto_front, recommend, MIN_SUCCESS
+
+
+def _r(trades, ruin, success, cf=1.0):
+    return {"cf": cf, "atr": 1.0, "day": 1, "trades": trades, "ruin": ruin, "success": success,
+            "timeout": 1 - ruin - success}
+
+
+def test_rarely_successful_combination_is_not_on_the_front():
+    lucky = _r(trades=3, ruin=0.0, success=MIN_SUCCESS / 2)
+    steady = _r(trades=12, ruin=0.02, success=0.9)
+    front = pareto_front([lucky, steady])
+    assert front == [steady]
+    assert recommend(front, max_ruin=0.05) is steady
+
+
+def test_success_probability_is_an_objective():
+    fast = _r(trades=8, ruin=0.05, success=0.5)
+    reliable = _r(trades=8, ruin=0.05, success=0.8)
+    slower_but_surer = _r(trades=10, ruin=0.05, success=0.95)
+    front = pareto_front([fast, reliable, slower_but_surer])
+    assert fast not in front                      # доминируется: те же сделки и слив, цель реже
+    assert front == [reliable, slower_but_surer]
+
+
+def test_front_is_sorted_fast_to_safe():
+    results = [_r(20, 0.01, 0.7), _r(5, 0.3, 0.6), _r(10, 0.1, 0.65)]
+    assert [r["trades"] for r in pareto_front(results)] == [5, 10, 20]
+
+
+def test_unreachable_goal_gives_empty_front():
+    assert pareto_front([_r(float("inf"), 0.5, 0.0)]) == []
@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+
+from outbox import Outbox, split_request, split_text, MESSAGE_LIMIT
+
+
+def _long(paragraph: str, count: int) -> str:
+    return "\n\n".join(paragraph for _ in range(count))
+
+
+def test_short_message_is_not_split():
+    data = {"chat_id": 1, "text": "привет"}
+    assert split_request("sendMessage", data) == [data]
+
+
+def test_plain_text_split_keeps_buttons_on_last_and_reply_on_first():
+    text = _long("а" * 1000, 10)
+    parts = split_request("sendMessage", {"chat_id": 1, "text": text, "reply_markup": "kb",
+                                          "reply_parameters": "rp"})
+    assert len(parts) > 1
+    assert all(len(p["text"]) <= MESSAGE_LIMIT for p in parts)
+    assert "\n\n".join(p["text"] for p in parts) == text
+    assert "reply_markup" in parts[-1] and all("reply_markup" not in p for p in parts[:-1])
+    assert "reply_parameters" in parts[0] and all("reply_parameters" not in p for p in parts[1:])
+
+
+def test_markdown_is_never_cut_inside_an_entity():
+    # Жирный абзац на ~5000 символов с переводами строк внутри: резать можно только после него
+    bold = "*" + "\n".join("слово " * 20 for _ in range(40)) + "*"
+    text = "Вступление\n\n" + bold + "\n\n" + "хвост " * 100
+    parts = split_request("sendMessage", {"chat_id": 1, "text": text, "parse_mode": "Markdown"})
+    for p in parts:
+        assert p["text"].count("*") % 2 == 0
+
+
+def test_markdown_split_between_entities():
+    text = _long("*жирный* текст `код` " * 50, 6)
+    parts = split_request("sendMessage", {"chat_id": 1, "text": text, "parse_mode": "Markdown"})
+    assert len(parts) > 1
+    for p in parts:
+        assert len(p["text"]) <= MESSAGE_LIMIT
+        assert p["text"].count("*") % 2 == 0 and p["text"].count("`") % 2 == 0
+
+
+def test_html_split_between_tags():
+    text = _long("<b>жирный</b> текст <i>курсив\nна две строки</i>", 200)
+    parts = split_request("sendMessage", {"chat_id": 1, "text": text, "parse_mode": "HTML"})
+    assert len(parts) > 1
+    for p in parts:
+        assert p["text"].count("<b>") == p["text"].count("</b>")
+        assert p["text"].count("<i>") == p["text"].count("</i>")
+
+
+def test_unsplittable_markup_is_sent_whole():
+    text = "```" + "x\n" * 3000 + "```"
+    data = {"chat_id": 1, "text": text, "parse_mode": "Markdown"}
+    assert split_request("sendMessage", data) == [data]
+    data_v2 = {"chat_id": 1, "text": _long("a" * 100, 60), "parse_mode": "MarkdownV2"}
+    assert split_request("sendMessage", data_v2) == [data_v2]
+
+
+def test_escaped_marker_does_not_open_an_entity():
+    text = _long("snake\\_case слово", 400)
+    assert len(split_text(text, parse_mode="Markdown")) > 1
+
+
+def test_explicit_entities_are_not_split():
+    data = {"chat_id": 1, "text": "a" * 5000, "entities": [{"type": "bold", "offset": 0, "length": 5}]}
+    assert split_request("sendMessage", data) == [data]
+
+
+def test_retry_after_in_one_chat_pauses_only_that_chat():
+    async def main():
+        outbox = Outbox()
+        await outbox.initialize()
+        calls = {"n": 0}
+
+        async def flood_once(endpoint, data):
+            calls["n"] += 1
+            if calls["n"] == 1:
+                raise RetryAfter(0)
+            return True
+
+        try:
+            await outbox.process_request(flood_once, ("sendMessage", {}), {}, "sendMessage",
+                                         {"chat_id": 1, "text": "x"}, None)
+            assert outbox.bucket.paused_until < time.monotonic()      # общий бакет не тронут
+            assert outbox._chats[1].bucket.paused_until > 0           # бакет чата на паузе
+        finally:
+            await outbox.shutdown()
+
+    asyncio.run(main())
@@ -0,0 +1,41 @@
+import asyncio
+import json
+
+from storage import JsonWriter, read_json, flush_all
+
+
+def test_writes_immediately_outside_event_loop(tmp_path):
+    data = {"a": 1}
+    writer = JsonWriter(str(tmp_path / "x.json"), lambda: data)
+    writer.mark()
+    assert read_json(writer.path, None) == {"a": 1}
+
+
+def test_coalesces_changes_into_one_background_write(tmp_path):
+    data = {}
+    writer = JsonWriter(str(tmp_path / "x.json"), lambda: data, delay=0.05)
+
+    async def main():
+        for i in range(100):
+            data[str(i)] = i
+            writer.mark()
+        assert read_json(writer.path, None) is None      # пока ничего не записано
+        await asyncio.sleep(0.2)
+
+    asyncio.run(main())
+    assert writer.writes == 1
+    assert len(read_json(writer.path, {})) == 100
+
+
+def test_flush_all_writes_pending_changes_at_once(tmp_path):
+    data = {"k": "v"}
+    writer = JsonWriter(str(tmp_path / "x.json"), lambda: data, delay=60)
+
+    async def main():
+        writer.mark()
+        await flush_all()
+
+    asyncio.run(main())
+    with open(writer.path, encoding="utf-8") as f:
+        assert json.load(f) == {"k": "v"}
+    assert not writer.dirty
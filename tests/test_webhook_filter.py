@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+import webhook_filter
+from webhook_filter import classify, ACCEPT, MAX_BODY, FilterStats
+
+
+def _body(update: dict) -> bytes:
+    return json.dumps({"update_id": 1, **update}).encode()
+
+
+def _message(**fields) -> dict:
+    return {"message": {"message_id": 1, "date": 0, "chat": {"id": 5, "type": "private"}, **fields}}
+
+
+@pytest.mark.parametrize("update", [
+    _message(text="привет"),
+    _message(text="/calc 48500 50000 1ph 3"),
+    _message(text="x" * 3000),          # длинный текст — отказ даёт handle_message после проверок
+    _message(document={"file_id": "f"}, caption="/backtest"),
+    {"callback_query": {"id": "1", "data": "x"}},
+    {"inline_query": {"id": "1", "query": "48500 50000 1ph 3"}},
+])
+def test_handled_updates_are_accepted(update):
+    decision, data = classify(_body(update))
+    assert decision == ACCEPT
+    assert data["update_id"] == 1
+
+
+@pytest.mark.parametrize("update, reason", [
+    ({"edited_message": {"message_id": 1, "text": "x"}}, "ignored"),
+    ({"channel_post": {"message_id": 1, "text": "x"}}, "ignored"),
+    ({"my_chat_member": {}}, "ignored"),
+    (_message(sticker={"file_id": "s"}), "non_text"),
+    (_message(photo=[{"file_id": "p"}]), "non_text"),
+    (_message(document={"file_id": "f"}, caption="просто файл"), "non_text"),
+])
+def test_unhandled_updates_are_dropped(update, reason):
+    assert classify(_body(update))[0] == reason
+
+
+@pytest.mark.parametrize("body", [b"not json", b"[1, 2]", b"", b"\xff\xfe"])
+def test_invalid_bodies(body):
+    assert classify(body) == ("invalid", None)
+
+
+def test_oversized_body_is_not_parsed():
+    assert classify(b" " * (MAX_BODY + 1)) == ("oversized", None)
+
+
+def test_no_too_long_shortcut_before_handlers():
+    # Отказ на длинный текст больше не отвечается из сырого dict в обход доступа и rate limit
+    assert not hasattr(webhook_filter, "TOO_LONG")
+
+
+def test_stats_summary():
+    stats = FilterStats()
+    assert "ещё не было" in stats.summary()
+    for decision in (ACCEPT, ACCEPT, "ignored", "non_text"):
+        stats.record(decision)
+    assert "2/4 (50%)" in stats.summary()
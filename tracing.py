@@ -0,0 +1,123 @@
+"""
+Трассировка обработки апдейтов.
+
+Каждый апдейт — трасса (user_id, тип, общее время) со списком спанов:
+время каждого ожидаемого внешнего вызова (проверка доступа, LLM, отправки).
+Последние трассы хранятся в кольцевом буфере для /trace <user_id>.
+
+Когда трассировка выключена, trace()/span() возвращают общий пустой
+контекст-менеджер — цена одного ContextVar.get().
+
+    with tracer.trace(user_id, "message"):
+        with tracer.span("llm"):
+            reply = await ask_openrouter(...)
+"""
+
+import contextvars
+import time
+from collections import deque
+
+TRACE_BUFFER_SIZE = 500
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class _Noop:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _Noop()
+
+
+class _Trace:
+    __slots__ = ("user_id", "kind", "started", "t0", "total_ms", "spans", "error", "_token", "_tracer")
+
+    def __init__(self, tracer, user_id, kind):
+        self._tracer = tracer
+        self.user_id = user_id
+        self.kind = kind
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.total_ms = 0.0
+        self.spans = []
+        self.error = None
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.total_ms = (time.perf_counter() - self.t0) * 1000
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        _current.reset(self._token)
+        self._tracer.traces.append(self)
+        return False
+
+
+class _Span:
+    __slots__ = ("trace", "name", "t0")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        t1 = time.perf_counter()
+        self.trace.spans.append((
+            self.name,
+            (self.t0 - self.trace.t0) * 1000,
+            (t1 - self.t0) * 1000,
+            exc_type.__name__ if exc_type else None,
+        ))
+        return False
+
+
+class Tracer:
+    def __init__(self, maxlen: int = TRACE_BUFFER_SIZE):
+        self.enabled = False
+        self.traces = deque(maxlen=maxlen)
+
+    def trace(self, user_id, kind: str):
+        """Трасса одного апдейта. Вложенные трассы не создаются."""
+        if not self.enabled or _current.get() is not None:
+            return _NOOP
+        return _Trace(self, user_id, kind)
+
+    def span(self, name: str):
+        """Замер одного вызова внутри текущей трассы."""
+        trace = _current.get()
+        if trace is None:
+            return _NOOP
+        return _Span(trace, name)
+
+    def for_user(self, user_id: int, limit: int = 5) -> list:
+        return [t for t in reversed(self.traces) if t.user_id == user_id][:limit]
+
+    def recent(self, limit: int = 5) -> list:
+        return list(reversed(self.traces))[:limit]
+
+    def span_stats(self) -> dict:
+        """name -> (число вызовов, среднее мс, максимум мс) по всему буферу."""
+        acc = {}
+        for t in self.traces:
+            for name, _, duration, _ in t.spans:
+                count, total, peak = acc.get(name, (0, 0.0, 0.0))
+                acc[name] = (count + 1, total + duration, max(peak, duration))
+        return {name: (c, total / c, peak) for name, (c, total, peak) in acc.items()}
+
+
+def format_trace(t) -> str:
+    when = time.strftime("%H:%M:%S", time.localtime(t.started))
+    lines = [f"🧵 {when} {t.kind} user={t.user_id} — {t.total_ms:.0f} мс" + (f" ❌ {t.error}" if t.error else "")]
+    for name, offset, duration, error in t.spans:
+        lines.append(f"  +{offset:6.0f} мс  {name:<14} {duration:7.1f} мс" + (f" ❌ {error}" if error else ""))
+    return "\n".join(lines)
@@ -0,0 +1,78 @@
+"""
+Быстрый предфильтр webhook: решает судьбу апдейта по сырому JSON до
+построения объектов telegram.Update.
+
+- тело больше MAX_BODY байт — отбрасывается без разбора
+- JSON разбирается orjson (если установлен), иначе стандартным json
+- типы апдейтов, которые не обрабатывает ни один хендлер (edited_message,
+  channel_post, my_chat_member, ...), и сообщения без текста отбрасываются
+
+Отбрасывается только то, что и так не дошло бы ни до одного хендлера —
+результат для пользователя тот же. Всё, на что бот отвечает (в том числе
+отказ на слишком длинный текст), проходит через хендлеры с проверкой
+доступа и rate limit.
+
+ALLOWED_UPDATES передаётся в set_webhook — тогда Telegram вообще не шлёт
+лишние типы; фильтр остаётся страховкой на время смены настроек.
+"""
+
+import json
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Типы апдейтов, для которых есть хендлеры в bot.py
+ALLOWED_UPDATES = ["message", "callback_query", "inline_query"]
+
+MAX_BODY = 64 * 1024   # обычный апдейт — единицы КБ, текст сообщения ≤ 4096 символов
+
+# Документ обрабатывается только как загрузка лога для /backtest
+DOCUMENT_CAPTION_PREFIX = "/backtest"
+
+ACCEPT = "accept"
+
+
+def classify(body: bytes):
+    """
+    (решение, данные). Решение — ACCEPT или причина отбрасывания:
+    oversized / invalid / ignored / non_text. Данные — dict апдейта (или None).
+    """
+    if len(body) > MAX_BODY:
+        return "oversized", None
+    try:
+        data = _loads(body)
+    except ValueError:
+        return "invalid", None
+    if not isinstance(data, dict):
+        return "invalid", None
+
+    if "callback_query" in data or "inline_query" in data:
+        return ACCEPT, data
+    message = data.get("message")
+    if not isinstance(message, dict):
+        return "ignored", data
+
+    if message.get("text"):
+        return ACCEPT, data
+    if "document" in message and str(message.get("caption", "")).startswith(DOCUMENT_CAPTION_PREFIX):
+        return ACCEPT, data
+    return "non_text", data
+
+
+class FilterStats:
+    def __init__(self):
+        self.counts: dict = {}
+
+    def record(self, decision: str) -> None:
+        self.counts[decision] = self.counts.get(decision, 0) + 1
+
+    def summary(self) -> str:
+        total = sum(self.counts.values())
+        if not total:
+            return "Webhook: апдейтов ещё не было"
+        dropped = total - self.counts.get(ACCEPT, 0)
+        details = ", ".join(f"{k}={v}" for k, v in sorted(self.counts.items(), key=lambda kv: -kv[1]))
+        return f"Webhook: отсеяно до разбора {dropped}/{total} ({dropped / total:.0%}) | {details}"